@@ -0,0 +1,126 @@
+"""Componenti di supporto per lo script di valutazione `valut.py`.
+
+I moduli di questo package non dipendono da `valut.py` e non eseguono
+operazioni costose all'import, così possono essere riusati da script,
+worker e test senza inizializzare il giudice remoto.
+"""
+
+from .cache import JudgeCache
+from .checkpoint import CheckpointJournal, file_content_hash
+from .columnar import COLUMNS_DIR, analyze, write_columns
+from .concurrency import EvaluationEngine, RateLimiter, estimate_tokens
+from .consistency import SamplingSpec, VoteTally
+from .context_cache import ContextCache, SharedPrefix
+from .dedup import DuplicateIndex, NearDuplicateIndex, conversation_fingerprint
+from .gating import Gate, gate_levels
+from .incremental import FINGERPRINT_KEY, IncrementalPlan, InputFingerprints, PreviousResults, log_key
+from .ingest import (
+    LOG_SUFFIXES,
+    IngestPipeline,
+    find_log_files,
+    format_transcript,
+    iter_conversation_spans,
+    prepare_log_record,
+    prepare_payload_record,
+)
+from .instrumentation import PROFILE_NAME, Profiler, RunMetrics
+from .pool import GeminiRestModel, JudgePool, OllamaModel, PoolEndpoint, load_pool
+from .prompts import MetricPlan, PromptPlan, PromptStats, metric_applies
+from .retry import (
+    FATAL,
+    REJECTED,
+    CircuitBreaker,
+    CircuitOpenError,
+    FatalJudgeError,
+    JudgeError,
+    JudgeRetrier,
+    MalformedResponseError,
+    RequestRejectedError,
+    RetriesExhaustedError,
+    RetryPolicy,
+    classify_error,
+)
+from .service import EvaluationService, MicroBatcher, PayloadError, make_server, parse_address
+from .shard import ShardSpec, merge_shards, shard_of, write_manifest
+from .sink import JsonlDetailsSink, compact_details, compact_summary, iter_detail_records, write_details
+from .store import STORE_NAME, ResultsStore, export_store, iter_store
+from .transcript import TranscriptOptions, build_transcript
+from .watch import LogWatcher
+
+__all__ = [
+    "COLUMNS_DIR",
+    "FATAL",
+    "FINGERPRINT_KEY",
+    "LOG_SUFFIXES",
+    "PROFILE_NAME",
+    "REJECTED",
+    "STORE_NAME",
+    "CheckpointJournal",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "ContextCache",
+    "DuplicateIndex",
+    "EvaluationEngine",
+    "EvaluationService",
+    "FatalJudgeError",
+    "Gate",
+    "GeminiRestModel",
+    "IncrementalPlan",
+    "IngestPipeline",
+    "InputFingerprints",
+    "JsonlDetailsSink",
+    "JudgeCache",
+    "JudgeError",
+    "JudgePool",
+    "JudgeRetrier",
+    "LogWatcher",
+    "MalformedResponseError",
+    "MetricPlan",
+    "MicroBatcher",
+    "NearDuplicateIndex",
+    "OllamaModel",
+    "PayloadError",
+    "PoolEndpoint",
+    "PreviousResults",
+    "Profiler",
+    "PromptPlan",
+    "PromptStats",
+    "RateLimiter",
+    "RequestRejectedError",
+    "ResultsStore",
+    "RetriesExhaustedError",
+    "RetryPolicy",
+    "RunMetrics",
+    "SamplingSpec",
+    "ShardSpec",
+    "SharedPrefix",
+    "TranscriptOptions",
+    "VoteTally",
+    "analyze",
+    "build_transcript",
+    "classify_error",
+    "compact_details",
+    "compact_summary",
+    "conversation_fingerprint",
+    "estimate_tokens",
+    "export_store",
+    "file_content_hash",
+    "find_log_files",
+    "format_transcript",
+    "gate_levels",
+    "iter_conversation_spans",
+    "iter_detail_records",
+    "iter_store",
+    "load_pool",
+    "log_key",
+    "make_server",
+    "merge_shards",
+    "metric_applies",
+    "parse_address",
+    "prepare_log_record",
+    "prepare_payload_record",
+    "shard_of",
+    "write_columns",
+    "write_details",
+    "write_manifest",
+]
@@ -0,0 +1,172 @@
+"""Comandi di manutenzione sugli output di `valut.py`.
+
+Uso: `python -m evaluation <comando> ...` (vedi `--help` per l'elenco).
+"""
+
+import argparse
+import json
+import sqlite3
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+from .columnar import COLUMNS_DIR, GROUP_COLUMNS, analyze, is_stale, write_analysis, write_columns
+from .shard import merge_shards
+from .sink import compact_details
+from .store import export_store
+
+console = Console()
+DEFAULT_METRICS_CONFIG = Path(__file__).resolve().parent.parent / "config" / "config_metrics.json"
+
+
+def cmd_compact(args: argparse.Namespace) -> int:
+    """Unisce e deduplica per `log_file` uno o più file di dettagli (.json o .jsonl)."""
+    output = args.output
+    output_format = args.format or ("jsonl" if output.suffix.lower() == ".jsonl" else "json")
+    read, written = compact_details(args.inputs, output, output_format=output_format)
+    console.print(f"[green]Compattati {read} record in {written} simulazioni: '{output}'[/green]")
+    return 0
+
+
+def cmd_merge(args: argparse.Namespace) -> int:
+    """Unisce le cartelle di output degli shard (`valut.py --shard i/N`) in un unico insieme di risultati."""
+    try:
+        summary = merge_shards(args.shards, args.output, details_format=args.details_format)
+    except ValueError as e:
+        console.print(f"[bold red]Errore: {e}.[/bold red]")
+        return 1
+    for warning in summary["warnings"]:
+        console.print(f"[yellow]Attenzione: {warning}.[/yellow]")
+    console.print(f"[green]Uniti {len(args.shards)} shard in '{args.output}': {summary['rows']} righe CSV, "
+                  f"{summary['details']} dettagli, {summary['detail_files']} file in details/.[/green]")
+    return 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    """Rigenera CSV, dettagli e `details/` da un archivio `valut.py --results-store`."""
+    try:
+        summary = export_store(args.store, args.output, details_format=args.details_format,
+                               details_files=not args.no_detail_files)
+    except (ValueError, sqlite3.Error) as e:
+        console.print(f"[bold red]Errore: {e}.[/bold red]")
+        return 1
+    console.print(f"[green]Esportato '{args.store}' in '{args.output}': {summary['rows']} righe CSV, "
+                  f"{summary['details']} dettagli, {summary['detail_files']} file in details/.[/green]")
+    return 0
+
+
+def _convert(output_dir: Path, metrics_config: Path) -> dict:
+    with open(metrics_config, encoding="utf-8") as f:
+        config = json.load(f)
+    return write_columns(output_dir / "results_summary.csv", config, output_dir / COLUMNS_DIR)
+
+
+def cmd_columns(args: argparse.Namespace) -> int:
+    """Converte `results_summary.csv` nell'archivio colonnare tipizzato `results_columns/`."""
+    try:
+        schema = _convert(args.output_dir, args.metrics_config)
+    except (OSError, ValueError) as e:
+        console.print(f"[bold red]Errore: {e}.[/bold red]")
+        return 1
+    console.print(f"[green]Archivio colonnare scritto in '{args.output_dir / COLUMNS_DIR}': {schema['rows']} righe, "
+                  f"{len(schema['metrics'])} metriche.[/green]")
+    return 0
+
+
+def cmd_analyze(args: argparse.Namespace) -> int:
+    """Aggregati per gruppo (Approach, Profile, Scenario, Asymmetry) delle metriche valutate."""
+    columns_dir = args.output_dir / COLUMNS_DIR
+    csv_path = args.output_dir / "results_summary.csv"
+    by = [c.strip() for c in args.by.split(",") if c.strip()]
+    metrics = [m.strip() for m in args.metrics.split(",") if m.strip()] if args.metrics else None
+    try:
+        if csv_path.exists() and is_stale(columns_dir, csv_path):
+            # archivio mancante o più vecchio del CSV: lo (ri)creiamo
+            _convert(args.output_dir, args.metrics_config)
+        results = analyze(columns_dir, by=by, metrics=metrics)
+    except (OSError, ValueError) as e:
+        console.print(f"[bold red]Errore: {e}.[/bold red]")
+        return 1
+    if args.output:
+        write_analysis(results, args.output)
+        console.print(f"[green]{len(results)} aggregati salvati in '{args.output}'.[/green]")
+        return 0
+    table = Table(title=f"Metriche per {', '.join(by) or 'intero corpus'}")
+    for column in [*by, "Metrica", "Validi", "N/A", "Falliti", "Media", "Dev. std", "Distribuzione"]:
+        table.add_column(column)
+    for entry in results:
+        distribution = ", ".join(f"{k} {v}" for k, v in entry.get("distribution", {}).items())
+        table.add_row(*(entry[c] for c in by), entry["metric"], str(entry["valid"]), str(entry["not_applicable"]),
+                      str(entry["failed"] + entry["invalid"]),
+                      "" if entry.get("mean") is None else f"{entry['mean']:.3f}",
+                      "" if entry.get("std") is None else f"{entry['std']:.3f}",
+                      distribution if entry["value_type"] != "boolean" else f"vero {entry['distribution']['true']}")
+    console.print(table)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Parser di `python -m evaluation`, con un sottocomando per strumento."""
+    parser = argparse.ArgumentParser(prog="python -m evaluation",
+                                     description="Strumenti per gli output di valutazione.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_compact = sub.add_parser("compact", help="Unisce e deduplica per log_file i file di dettagli (.json/.jsonl).")
+    p_compact.add_argument("inputs", nargs="+", type=Path, help="File di dettagli, dal più vecchio al più recente.")
+    p_compact.add_argument("-o", "--output", type=Path, required=True, help="File di destinazione (.json o .jsonl).")
+    p_compact.add_argument("--format", choices=["json", "jsonl"], default=None,
+                           help="Formato di uscita (default: dall'estensione).")
+    p_compact.set_defaults(func=cmd_compact)
+
+    p_merge = sub.add_parser("merge", help="Unisce gli output degli shard di valut.py --shard in un'unica cartella.")
+    p_merge.add_argument("shards", nargs="+", type=Path,
+                         help="Cartelle di output degli shard (a parità di Sim_ID vince l'ultima).")
+    p_merge.add_argument("-o", "--output", type=Path, required=True, help="Cartella di destinazione.")
+    p_merge.add_argument("--details-format", choices=["json", "jsonl"], default="json",
+                         help="Formato del file riepilogativo dei dettagli.")
+    p_merge.set_defaults(func=cmd_merge)
+
+    p_export = sub.add_parser("export", help="Rigenera results_summary.csv, i dettagli e details/ da un archivio "
+                                             "valut.py --results-store.")
+    p_export.add_argument("store", type=Path,
+                          help="Archivio SQLite dei risultati (es. evaluation_results/results.sqlite).")
+    p_export.add_argument("-o", "--output", type=Path, required=True, help="Cartella di destinazione.")
+    p_export.add_argument("--details-format", choices=["json", "jsonl"], default="json",
+                          help="Formato del file riepilogativo dei dettagli.")
+    p_export.add_argument("--no-detail-files", action="store_true",
+                          help="Non scrive i file per simulazione in details/.")
+    p_export.set_defaults(func=cmd_export)
+
+    p_columns = sub.add_parser("columns", help="Converte results_summary.csv nell'archivio colonnare tipizzato "
+                                               "results_columns/.")
+    p_columns.add_argument("output_dir", type=Path, help="Cartella di output di valut.py.")
+    p_columns.add_argument("--metrics-config", type=Path, default=DEFAULT_METRICS_CONFIG,
+                           help="config_metrics.json con i value_type delle metriche.")
+    p_columns.set_defaults(func=cmd_columns)
+
+    p_analyze = sub.add_parser("analyze", help="Aggregati delle metriche per gruppo (conteggi, media, deviazione "
+                                               "standard, distribuzioni).")
+    p_analyze.add_argument("output_dir", type=Path,
+                           help="Cartella di output di valut.py (l'archivio colonnare viene creato se manca).")
+    p_analyze.add_argument("--by", default=",".join(GROUP_COLUMNS),
+                           help="Colonne di raggruppamento separate da virgola (vuoto = intero corpus).")
+    p_analyze.add_argument("--metrics", default=None,
+                           help="Metriche da includere, separate da virgola (default: tutte).")
+    p_analyze.add_argument("--metrics-config", type=Path, default=DEFAULT_METRICS_CONFIG,
+                           help="config_metrics.json con i value_type delle metriche.")
+    p_analyze.add_argument("-o", "--output", type=Path, default=None,
+                           help="Salva gli aggregati in un file .csv o .json invece di stamparli.")
+    p_analyze.set_defaults(func=cmd_analyze)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Esegue il sottocomando richiesto e ritorna il codice di uscita."""
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
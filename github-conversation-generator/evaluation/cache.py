@@ -0,0 +1,159 @@
+"""Cache persistente (SQLite) delle risposte del giudice.
+
+Le chiavi sono l'hash SHA-256 di nome del modello, configurazione di
+generazione, system prompt e prompt utente: con `temperature=0.0` due
+richieste identiche producono la stessa valutazione, quindi rieseguire
+`valut.py` dopo un crash o dopo aver aggiunto una metrica non ripete le
+chiamate già fatte. Il chiamante decide cosa è memorizzabile (i fallimenti
+e i fallback stub non devono mai finire in cache).
+"""
+
+import dataclasses
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+
+def _config_fingerprint(generation_config: Any) -> Any:
+    """Rappresentazione stabile e serializzabile della configurazione di generazione."""
+    if generation_config is None:
+        return None
+    if dataclasses.is_dataclass(generation_config) and not isinstance(generation_config, type):
+        return dataclasses.asdict(generation_config)
+    if isinstance(generation_config, dict):
+        return generation_config
+    if hasattr(generation_config, "__dict__"):
+        return {k: v for k, v in vars(generation_config).items() if not k.startswith("_")}
+    return repr(generation_config)
+
+
+class JudgeCache:
+    """Cache chiave/valore su SQLite, thread-safe, con evizione per età e dimensione."""
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int | None = 100_000,
+        max_age_days: float | None = 30,
+        refresh: bool = False,
+    ):
+        """Apre (o crea) la cache in `path`; con `refresh` le letture sono sempre miss e le voci vengono riscritte."""
+        self.path = Path(path)
+        self.max_entries = max_entries if max_entries and max_entries > 0 else None
+        self.max_age_days = max_age_days if max_age_days and max_age_days > 0 else None
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS judge_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_judge_cache_last_used ON judge_cache(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, generation_config: Any, system_prompt: str, user_prompt: str,
+                 variant: str = "") -> str:
+        """Chiave della richiesta; `variant` distingue più campioni dello stesso prompt."""
+        fields = {
+            "model": model_name,
+            "generation_config": _config_fingerprint(generation_config),
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+        }
+        # senza variante la chiave resta quella storica, così le voci già in cache restano valide
+        if variant:
+            fields["variant"] = variant
+        payload = json.dumps(
+            fields,
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Any | None:
+        """Ritorna il valore memorizzato, o None. Con `refresh` ogni lettura è un miss."""
+        if self.refresh:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM judge_cache WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and self.max_age_days and now - row[1] > self.max_age_days * 86400:
+                self._conn.execute("DELETE FROM judge_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evicted += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE judge_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        """Salva (o sostituisce) `value` sotto `key`."""
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO judge_cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, data, now, now),
+            )
+            self._conn.commit()
+            self.stores += 1
+
+    def evict(self) -> int:
+        """Rimuove le voci scadute e, oltre `max_entries`, quelle usate meno di recente."""
+        removed = 0
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM judge_cache WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_entries:
+                (count,) = self._conn.execute("SELECT COUNT(*) FROM judge_cache").fetchone()
+                excess = count - self.max_entries
+                if excess > 0:
+                    removed += self._conn.execute(
+                        "DELETE FROM judge_cache WHERE key IN "
+                        "(SELECT key FROM judge_cache ORDER BY last_used ASC LIMIT ?)",
+                        (excess,),
+                    ).rowcount
+            self._conn.commit()
+            self.evicted += removed
+        return removed
+
+    def __len__(self) -> int:
+        """Numero di voci in cache."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM judge_cache").fetchone()[0]
+
+    def summary(self) -> str:
+        """Riepilogo di una riga di hit, miss, scritture e rimozioni."""
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return (f"hit {self.hits}, miss {self.misses} ({rate:.1f}% hit rate), "
+                f"salvate {self.stores}, rimosse {self.evicted}")
+
+    def close(self) -> None:
+        """Chiude la connessione al database."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,105 @@
+"""Journal di checkpoint per riprendere una valutazione interrotta.
+
+Il journal è un file JSONL append-only nella cartella di output. Contiene
+due tipi di record:
+
+- `metric`: una valutazione completata per la coppia (hash del contenuto
+  del log, metrica), scritta appena la chiamata termina;
+- `log`: il log è stato scritto per intero nel CSV e in `details/`.
+
+Con `--resume` il journal viene riletto: i log completati vengono saltati e
+le metriche già valutate riusate, così si perde al massimo il lavoro in volo.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+def file_content_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 del contenuto del file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CheckpointJournal:
+    """Registro thread-safe delle valutazioni completate."""
+
+    def __init__(self, path: Path, resume: bool = False):
+        """Apre il checkpoint; con `resume` ricarica le voci già scritte e vi appende le nuove."""
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._metrics: dict[tuple[str, str], dict] = {}
+        self._completed: dict[tuple[str, str], str] = {}
+        self.skipped_lines = 0
+
+        if resume and self.path.exists():
+            self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")  # noqa: SIM115 (chiuso da close())
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # tipicamente l'ultima riga troncata da un crash
+                    self.skipped_lines += 1
+                    continue
+                kind = record.get("type")
+                if kind == "metric":
+                    self._metrics[(record["log_hash"], record["metric"])] = record["evaluation"]
+                elif kind == "log":
+                    self._completed[(record["log_file"], record["log_hash"])] = record["sim_id"]
+
+    def _append(self, record: dict, sync: bool = False) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    @property
+    def completed_count(self) -> int:
+        """Numero di log completati."""
+        return len(self._completed)
+
+    @property
+    def metric_count(self) -> int:
+        """Numero di valutazioni di metrica salvate."""
+        return len(self._metrics)
+
+    def get_metric(self, log_hash: str, metric_name: str) -> dict | None:
+        """Valutazione salvata per la metrica del log `log_hash`, se presente."""
+        return self._metrics.get((log_hash, metric_name))
+
+    def record_metric(self, log_hash: str, metric_name: str, evaluation: dict) -> None:
+        """Registra la valutazione di una metrica."""
+        with self._lock:
+            self._metrics[(log_hash, metric_name)] = evaluation
+        self._append({"type": "metric", "log_hash": log_hash, "metric": metric_name, "evaluation": evaluation})
+
+    def completed_sim_id(self, log_file: str, log_hash: str) -> str | None:
+        """Sim_ID con cui il log è già stato scritto, o None se va (ri)valutato."""
+        return self._completed.get((log_file, log_hash))
+
+    def record_log(self, log_file: str, log_hash: str, sim_id: str) -> None:
+        """Registra il log come completato (con fsync)."""
+        with self._lock:
+            self._completed[(log_file, log_hash)] = sim_id
+        self._append({"type": "log", "log_file": log_file, "log_hash": log_hash, "sim_id": sim_id}, sync=True)
+
+    def close(self) -> None:
+        """Chiude il file del checkpoint."""
+        with self._lock:
+            self._file.close()
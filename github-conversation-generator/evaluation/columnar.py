@@ -0,0 +1,416 @@
+"""Archivio colonnare tipizzato dei risultati e aggregati per gruppo.
+
+`results_summary.csv` ha una riga di stringhe per simulazione: ogni analisi
+deve riconvertire i valori. `write_columns` lo trasforma una volta in una
+cartella `results_columns/` con un file `.npy` per colonna (formato NumPy
+1.0, scritto con la sola libreria standard) e uno `schema.json`:
+
+- le colonne di raggruppamento (`Approach`, `Profile`, `Scenario`,
+  `Asymmetry`) e `Sim_ID` sono codificate a dizionario (`int32`, -1 = vuoto);
+- ogni metrica ha il tipo del suo `value_type` in `config_metrics.json`:
+  `integer`/`likert_5` -> `float64` (NaN = nessun valore), `boolean` ->
+  `int8` (1/0, -1 = nessun valore), `string` -> codici a dizionario `int32`;
+- accanto ai valori, una colonna `int8` di stato per metrica distingue le
+  celle valide da quelle non applicabili, fallite o non interpretabili.
+
+`analyze` calcola conteggi, media, deviazione standard, minimo e massimo
+(per le metriche numeriche e booleane) e distribuzioni (per quelle
+testuali), raggruppati per le colonne richieste. Con NumPy installato le
+colonne vengono mappate in memoria e aggregate con operazioni vettoriali
+(`bincount`, `reduceat`); senza, un percorso in puro Python produce gli
+stessi risultati.
+"""
+
+import ast
+import csv
+import json
+import math
+import os
+import re
+import struct
+import sys
+from array import array
+from collections.abc import Iterable
+from pathlib import Path
+
+try:  # opzionale: aggregazioni vettoriali e colonne mappate in memoria
+    import numpy as np
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    np = None
+
+COLUMNS_DIR = "results_columns"
+SCHEMA_NAME = "schema.json"
+SCHEMA_VERSION = 1
+GROUP_COLUMNS = ("Approach", "Profile", "Scenario", "Asymmetry")
+_FIXED_COLUMNS = ("Sim_ID",) + GROUP_COLUMNS
+
+# Stato di una cella metrica
+OK = 0
+NOT_APPLICABLE = 1
+FAILED = 2
+INVALID = 3
+STATUS_NAMES = ("valid", "not_applicable", "failed", "invalid")
+_FAILED_SCORES = {"EVALUATION_FAILED", "EVALUATION_SKIPPED", "STUB"}
+
+_TRUE = {"true", "1", "yes", "si", "sì", "vero"}
+_FALSE = {"false", "0", "no", "falso"}
+# typecode di `array` -> descr NumPy (little endian)
+_DESCR = {"d": "<f8", "b": "|i1", "i": "<i4"}
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_UNSAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _kind(value_type: str) -> str:
+    value_type = (value_type or "").lower()
+    if value_type in ("integer", "likert_5", "number", "float"):
+        return "numeric"
+    if value_type == "boolean":
+        return "boolean"
+    return "string"
+
+
+def parse_cell(kind: str, text: str) -> tuple[float | int | str | None, int]:
+    """Valore tipizzato e stato di una cella del CSV."""
+    text = (text or "").strip()
+    if text.upper() in ("N/A", "NA", "NULL", "NONE"):
+        return None, NOT_APPLICABLE
+    if not text or text.upper() in _FAILED_SCORES:
+        return None, FAILED
+    if kind == "numeric":
+        try:
+            value = float(text)
+        except ValueError:
+            return None, INVALID
+        return (value, OK) if math.isfinite(value) else (None, INVALID)
+    if kind == "boolean":
+        low = text.lower()
+        if low in _TRUE:
+            return 1, OK
+        if low in _FALSE:
+            return 0, OK
+        return None, INVALID
+    return text, OK
+
+
+# --- file .npy (formato 1.0) ---
+
+def _write_npy(path: Path, values: array) -> None:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    header = repr({"descr": _DESCR[values.typecode], "fortran_order": False, "shape": (len(values),)})
+    # magic (8) + lunghezza (2) + header, allineati a 64 byte e terminati da "\n"
+    padding = 64 - (len(_NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * (padding % 64) + "\n").encode("latin1")
+    tmp = path.with_suffix(".npy.tmp")
+    with open(tmp, "wb") as f:
+        f.write(_NPY_MAGIC + struct.pack("<H", len(header)) + header)
+        values.tofile(f)
+    os.replace(tmp, path)
+
+
+def _read_npy(path: Path):
+    """Colonna come array NumPy mappato in memoria, o come `array` senza NumPy."""
+    if np is not None:
+        return np.load(path, mmap_mode="r")
+    with open(path, "rb") as f:
+        if f.read(len(_NPY_MAGIC)) != _NPY_MAGIC:
+            raise ValueError(f"'{path}' non è un file .npy supportato")
+        (header_len,) = struct.unpack("<H", f.read(2))
+        header = ast.literal_eval(f.read(header_len).decode("latin1"))
+        typecode = next(code for code, descr in _DESCR.items() if descr == header["descr"])
+        values = array(typecode)
+        values.frombytes(f.read())
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _file_name(index: int, name: str, suffix: str = "") -> str:
+    return f"{index:03d}_{_UNSAFE_NAME_RE.sub('_', name)}{suffix}.npy"
+
+
+# --- scrittura ---
+
+def write_columns(csv_path: Path, metrics_config: list[dict], dest_dir: Path | None = None) -> dict:
+    """Converte `results_summary.csv` nell'archivio colonnare; ritorna lo schema scritto.
+
+    `dest_dir` di default è `results_columns/` accanto al CSV. Le metriche
+    assenti da `metrics_config` vengono trattate come testuali.
+    """
+    csv_path = Path(csv_path)
+    dest_dir = Path(dest_dir) if dest_dir is not None else csv_path.parent / COLUMNS_DIR
+    value_types = {m.get("metric_name"): (m.get("value_type") or "string").lower()
+                   for m in metrics_config if isinstance(m, dict)}
+
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None or tuple(header[:len(_FIXED_COLUMNS)]) != _FIXED_COLUMNS:
+            raise ValueError(f"'{csv_path}' non ha l'header di results_summary.csv "
+                             f"({', '.join(_FIXED_COLUMNS)}, metriche...)")
+        metric_names = header[len(_FIXED_COLUMNS):]
+        kinds = [_kind(value_types.get(name, "string")) for name in metric_names]
+
+        fixed_codes = [array("i") for _ in _FIXED_COLUMNS]
+        fixed_dicts: list[dict[str, int]] = [{} for _ in _FIXED_COLUMNS]
+        values = [array({"numeric": "d", "boolean": "b", "string": "i"}[kind]) for kind in kinds]
+        statuses = [array("b") for _ in metric_names]
+        metric_dicts: list[dict[str, int]] = [{} for _ in metric_names]
+        missing = {"numeric": math.nan, "boolean": -1, "string": -1}
+
+        rows = 0
+        for row in reader:
+            if not row:
+                continue
+            rows += 1
+            if len(row) < len(header):
+                row = row + [""] * (len(header) - len(row))
+            for col, (codes, dictionary) in enumerate(zip(fixed_codes, fixed_dicts)):
+                cell = row[col]
+                codes.append(dictionary.setdefault(cell, len(dictionary)) if cell else -1)
+            for m, kind in enumerate(kinds):
+                value, status = parse_cell(kind, row[len(_FIXED_COLUMNS) + m])
+                if status != OK:
+                    values[m].append(missing[kind])
+                elif kind == "string":
+                    values[m].append(metric_dicts[m].setdefault(value, len(metric_dicts[m])))
+                else:
+                    values[m].append(value)
+                statuses[m].append(status)
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    columns = {}
+    for n, (name, codes, dictionary) in enumerate(zip(_FIXED_COLUMNS, fixed_codes, fixed_dicts)):
+        file_name = _file_name(n, name)
+        _write_npy(dest_dir / file_name, codes)
+        columns[name] = {"kind": "dictionary", "file": file_name, "dictionary": list(dictionary)}
+    metrics = []
+    for m, (name, kind) in enumerate(zip(metric_names, kinds)):
+        n = len(_FIXED_COLUMNS) + m
+        entry = {"name": name, "value_type": value_types.get(name, "string"), "kind": kind,
+                 "file": _file_name(n, name), "status_file": _file_name(n, name, ".status")}
+        if kind == "string":
+            entry["dictionary"] = list(metric_dicts[m])
+        _write_npy(dest_dir / entry["file"], values[m])
+        _write_npy(dest_dir / entry["status_file"], statuses[m])
+        metrics.append(entry)
+
+    stat = csv_path.stat()
+    schema = {
+        "version": SCHEMA_VERSION,
+        "rows": rows,
+        "source": {"path": csv_path.name, "size": stat.st_size, "mtime": stat.st_mtime},
+        "columns": columns,
+        "metrics": metrics,
+    }
+    tmp = dest_dir / (SCHEMA_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, dest_dir / SCHEMA_NAME)
+    return schema
+
+
+def read_schema(columns_dir: Path) -> dict:
+    """Legge lo schema dell'archivio colonnare in `columns_dir` (ValueError se la versione non è supportata)."""
+    with open(Path(columns_dir) / SCHEMA_NAME, encoding="utf-8") as f:
+        schema = json.load(f)
+    if schema.get("version") != SCHEMA_VERSION:
+        raise ValueError(f"versione dell'archivio colonnare non supportata: {schema.get('version')}")
+    return schema
+
+
+def is_stale(columns_dir: Path, csv_path: Path) -> bool:
+    """True se l'archivio manca o non corrisponde più al CSV da cui è stato creato."""
+    try:
+        source = read_schema(columns_dir)["source"]
+    except (OSError, ValueError, KeyError):
+        return True
+    stat = Path(csv_path).stat()
+    return source.get("size") != stat.st_size or source.get("mtime") != stat.st_mtime
+
+
+# --- aggregati ---
+
+def _group_inverse(code_columns: list, rows: int):
+    """Indice di gruppo per riga e codici (per colonna) di ogni gruppo."""
+    if np is not None:
+        if not code_columns:
+            return np.zeros(rows, dtype=np.int64), [np.zeros(1 if rows else 0, dtype=np.int64)]
+        # combinazione progressiva delle colonne, ricompattata a ogni passo: nessun overflow
+        key = np.asarray(code_columns[0], dtype=np.int64) + 1
+        for codes in code_columns[1:]:
+            _, key = np.unique(key, return_inverse=True)
+            key = key.astype(np.int64) * (int(np.max(codes, initial=-1)) + 2) + (np.asarray(codes, dtype=np.int64) + 1)
+        _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+        return inverse.reshape(-1), [np.asarray(codes)[first] for codes in code_columns]
+    index: dict[tuple, int] = {}
+    inverse = array("q", (index.setdefault(key, len(index)) for key in zip(*code_columns))) if code_columns \
+        else array("q", bytes(8 * rows))
+    groups = list(index) if code_columns else ([()] if rows else [])
+    return inverse, [[g[c] for g in groups] for c in range(len(code_columns))]
+
+
+def _numeric_stats_numpy(values, status, inverse, groups: int, kind: str) -> dict:
+    valid = status == OK
+    g = inverse[valid]
+    v = np.asarray(values)[valid].astype(np.float64)
+    count = np.bincount(g, minlength=groups)
+    sums = np.bincount(g, weights=v, minlength=groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / count
+        sq = np.bincount(g, weights=(v - mean[g]) ** 2, minlength=groups)
+        std = np.sqrt(sq / (count - 1))
+    mins = np.full(groups, np.nan)
+    maxs = np.full(groups, np.nan)
+    if len(g):
+        order = np.argsort(g, kind="stable")
+        gs, vs = g[order], v[order]
+        starts = np.flatnonzero(np.r_[True, gs[1:] != gs[:-1]])
+        mins[gs[starts]] = np.minimum.reduceat(vs, starts)
+        maxs[gs[starts]] = np.maximum.reduceat(vs, starts)
+    stats = {"mean": mean, "std": np.where(count > 1, std, np.nan), "min": mins, "max": maxs}
+    if kind == "boolean":
+        stats["distribution"] = {"true": sums, "false": count - sums}
+    return stats
+
+
+def _string_stats_numpy(values, status, inverse, groups: int, dictionary: list[str]) -> dict:
+    valid = status == OK
+    k = len(dictionary)
+    counts = np.bincount(inverse[valid] * k + np.asarray(values)[valid], minlength=groups * k).reshape(groups, k) \
+        if k else np.zeros((groups, 0))
+    return {"distribution": {label: counts[:, j] for j, label in enumerate(dictionary)}}
+
+
+def _stats_python(values, status, inverse, groups: int, kind: str, dictionary: list[str] | None) -> dict:
+    count = [0] * groups
+    sums = [0.0] * groups
+    mins = [math.nan] * groups
+    maxs = [math.nan] * groups
+    distribution = [dict.fromkeys(dictionary or (), 0) for _ in range(groups)] if kind == "string" else None
+    for g, v, s in zip(inverse, values, status):
+        if s != OK:
+            continue
+        count[g] += 1
+        if kind == "string":
+            distribution[g][dictionary[v]] += 1
+            continue
+        sums[g] += v
+        if not v >= mins[g]:  # anche con mins[g] NaN
+            mins[g] = float(v)
+        if not v <= maxs[g]:
+            maxs[g] = float(v)
+    if kind == "string":
+        return {"distribution": {label: [d[label] for d in distribution] for label in dictionary or ()}}
+    mean = [sums[g] / count[g] if count[g] else math.nan for g in range(groups)]
+    sq = [0.0] * groups
+    for g, v, s in zip(inverse, values, status):
+        if s == OK:
+            sq[g] += (v - mean[g]) ** 2
+    std = [math.sqrt(sq[g] / (count[g] - 1)) if count[g] > 1 else math.nan for g in range(groups)]
+    stats = {"mean": mean, "std": std, "min": mins, "max": maxs}
+    if kind == "boolean":
+        stats["distribution"] = {"true": sums, "false": [count[g] - sums[g] for g in range(groups)]}
+    return stats
+
+
+def _status_counts(status, inverse, groups: int) -> dict[str, list[int]]:
+    if np is not None:
+        counts = np.bincount(inverse * len(STATUS_NAMES) + np.asarray(status, dtype=np.int64),
+                             minlength=groups * len(STATUS_NAMES)).reshape(groups, len(STATUS_NAMES))
+        return {name: counts[:, s].tolist() for s, name in enumerate(STATUS_NAMES)}
+    counts = [[0] * len(STATUS_NAMES) for _ in range(groups)]
+    for g, s in zip(inverse, status):
+        counts[g][s] += 1
+    return {name: [c[s] for c in counts] for s, name in enumerate(STATUS_NAMES)}
+
+
+def _number(value) -> float | None:
+    value = float(value)
+    return None if math.isnan(value) else round(value, 6)
+
+
+def analyze(columns_dir: Path, by: Iterable[str] = GROUP_COLUMNS, metrics: Iterable[str] | None = None) -> list[dict]:
+    """Aggregati per gruppo e metrica, ordinati per gruppo e poi nell'ordine delle metriche.
+
+    Ogni voce contiene le colonne di raggruppamento, `metric`, `value_type`,
+    `rows` e i conteggi per stato (`valid`, `not_applicable`, `failed`,
+    `invalid`); per le metriche numeriche e booleane anche `mean`, `std`
+    (campionaria), `min` e `max`, per quelle booleane e testuali `distribution`.
+    """
+    columns_dir = Path(columns_dir)
+    schema = read_schema(columns_dir)
+    by = list(by)
+    unknown = [c for c in by if c not in schema["columns"]]
+    if unknown:
+        raise ValueError(f"colonne di raggruppamento sconosciute: {', '.join(unknown)} "
+                         f"(disponibili: {', '.join(schema['columns'])})")
+    selected = schema["metrics"]
+    if metrics is not None:
+        wanted = list(metrics)
+        names = {m["name"] for m in selected}
+        missing = [name for name in wanted if name not in names]
+        if missing:
+            raise ValueError(f"metriche sconosciute: {', '.join(missing)}")
+        selected = [m for m in selected if m["name"] in wanted]
+
+    rows = schema["rows"]
+    code_columns = [_read_npy(columns_dir / schema["columns"][c]["file"]) for c in by]
+    inverse, group_codes = _group_inverse(code_columns, rows)
+    groups = len(group_codes[0]) if by else (1 if rows else 0)
+    labels = [tuple(schema["columns"][c]["dictionary"][int(code)] if int(code) >= 0 else ""
+                    for c, code in zip(by, (codes[g] for codes in group_codes)))
+              for g in range(groups)]
+    if np is not None:
+        group_rows = np.bincount(inverse, minlength=groups).tolist()
+    else:
+        group_rows = [0] * groups
+        for g in inverse:
+            group_rows[g] += 1
+
+    results: list[tuple[tuple, int, dict]] = []
+    for position, metric in enumerate(selected):
+        values = _read_npy(columns_dir / metric["file"])
+        status = _read_npy(columns_dir / metric["status_file"])
+        kind = metric["kind"]
+        if np is not None:
+            status = np.asarray(status)
+            stats = (_string_stats_numpy(values, status, inverse, groups, metric["dictionary"]) if kind == "string"
+                     else _numeric_stats_numpy(values, status, inverse, groups, kind))
+        else:
+            stats = _stats_python(values, status, inverse, groups, kind, metric.get("dictionary"))
+        counts = _status_counts(status, inverse, groups)
+        for g in range(groups):
+            entry = dict(zip(by, labels[g]))
+            entry.update(metric=metric["name"], value_type=metric["value_type"], rows=group_rows[g])
+            entry.update({name: int(counts[name][g]) for name in STATUS_NAMES})
+            for stat in ("mean", "std", "min", "max"):
+                if stat in stats:
+                    entry[stat] = _number(stats[stat][g])
+            if "distribution" in stats:
+                entry["distribution"] = {label: int(col[g]) for label, col in stats["distribution"].items()}
+            results.append((labels[g], position, entry))
+    results.sort(key=lambda item: item[:2])
+    return [entry for _, _, entry in results]
+
+
+def write_analysis(results: list[dict], dest: Path) -> None:
+    """Salva gli aggregati in CSV (distribuzioni come `etichetta=conteggio;...`) o in JSON."""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.suffix.lower() == ".json":
+        with open(dest, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        return
+    fields: list[str] = []
+    for entry in results:
+        fields.extend(k for k in entry if k not in fields)
+    with open(dest, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for entry in results:
+            row = dict(entry)
+            if "distribution" in row:
+                row["distribution"] = ";".join(f"{k}={v}" for k, v in row["distribution"].items())
+            writer.writerow(row)
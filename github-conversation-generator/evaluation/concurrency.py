@@ -0,0 +1,235 @@
+"""Motore di valutazione concorrente e limitatore di frequenza per il giudice.
+
+`EvaluationEngine` mantiene due pool di thread separati: uno per le
+conversazioni in corso (finestra limitata, risultati restituiti nell'ordine
+di ingresso) e uno per le singole chiamate al giudice, così che N richieste
+restino in volo attraverso log e metriche diversi senza rischio di deadlock.
+
+`RateLimiter` sostituisce la vecchia `time.sleep(1)` fissa con due token
+bucket (richieste/minuto e token/minuto) condivisi da tutti i worker.
+"""
+
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+
+def estimate_tokens(text: str) -> int:
+    """Stima grossolana dei token di un testo (~4 caratteri per token)."""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """Token bucket thread-safe per richieste/minuto e token/minuto.
+
+    Le richieste prenotano la capacità al momento della chiamata e, se il
+    bucket è in debito, attendono fuori dal lock il tempo necessario a
+    ripagarlo: in questo modo l'ordine di arrivo viene rispettato e una
+    singola richiesta più grande della capacità non blocca per sempre.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        burst_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Limiti per minuto su richieste e token; `None` o 0 disattivano il limite corrispondente."""
+        self.requests_per_minute = requests_per_minute if requests_per_minute and requests_per_minute > 0 else None
+        self.tokens_per_minute = tokens_per_minute if tokens_per_minute and tokens_per_minute > 0 else None
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._last = clock()
+
+        # Le richieste vengono distribuite uniformemente (burst di pochi secondi),
+        # i token invece possono essere spesi tutti in un minuto.
+        self._req_capacity = (
+            max(1.0, self.requests_per_minute / 60.0 * burst_seconds) if self.requests_per_minute else 0.0
+        )
+        self._tok_capacity = float(self.tokens_per_minute or 0)
+        self._req_balance = self._req_capacity
+        self._tok_balance = self._tok_capacity
+
+        self.waited_seconds = 0.0
+        self.acquired = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Vero se almeno uno dei due limiti è attivo."""
+        return self.requests_per_minute is not None or self.tokens_per_minute is not None
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._last)
+        self._last = now
+        if self.requests_per_minute:
+            rate = self.requests_per_minute / 60.0
+            self._req_balance = min(self._req_capacity, self._req_balance + elapsed * rate)
+        if self.tokens_per_minute:
+            rate = self.tokens_per_minute / 60.0
+            self._tok_balance = min(self._tok_capacity, self._tok_balance + elapsed * rate)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Prenota una richiesta da `tokens` token; ritorna i secondi di attesa."""
+        wait = 0.0
+        with self._lock:
+            self._refill(self._clock())
+            self.acquired += 1
+            if self.requests_per_minute:
+                self._req_balance -= 1.0
+                if self._req_balance < 0:
+                    wait = max(wait, -self._req_balance / (self.requests_per_minute / 60.0))
+            if self.tokens_per_minute and tokens > 0:
+                self._tok_balance -= tokens
+                if self._tok_balance < 0:
+                    wait = max(wait, -self._tok_balance / (self.tokens_per_minute / 60.0))
+            self.waited_seconds += wait
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def wait_estimate(self, tokens: int = 0) -> float:
+        """Secondi che `acquire(tokens)` attenderebbe ora, senza prenotare nulla."""
+        with self._lock:
+            self._refill(self._clock())
+            wait = 0.0
+            if self.requests_per_minute and self._req_balance < 1.0:
+                wait = (1.0 - self._req_balance) / (self.requests_per_minute / 60.0)
+            if self.tokens_per_minute and tokens > 0 and self._tok_balance < tokens:
+                wait = max(wait, (tokens - self._tok_balance) / (self.tokens_per_minute / 60.0))
+            return wait
+
+    def record_tokens(self, tokens: int) -> None:
+        """Addebita token consumati a posteriori (es. quelli della risposta)."""
+        if not self.tokens_per_minute or tokens <= 0:
+            return
+        with self._lock:
+            self._refill(self._clock())
+            self._tok_balance -= tokens
+
+
+class _PriorityExecutor:
+    """Pool di thread che esegue prima i lavori con priorità più bassa (FIFO a parità)."""
+
+    _STOP = float("inf")
+
+    def __init__(self, workers: int, name: str):
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._shutdown_lock = threading.Lock()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}_{n}", daemon=True) for n in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, priority: float, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        with self._shutdown_lock:
+            # come ThreadPoolExecutor: dopo lo shutdown nessun worker eseguirebbe il lavoro
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._queue.put((priority, next(self._seq), future, fn, args, kwargs))
+        return future
+
+    def _worker(self) -> None:
+        while True:
+            _, _, future, fn, args, kwargs = self._queue.get()
+            if future is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        with self._shutdown_lock:
+            already = self._shutdown
+            self._shutdown = True
+        if cancel_futures:
+            while True:
+                try:
+                    _, _, future, *_ = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if future is not None:
+                    future.cancel()
+        if not already:
+            for _ in self._threads:
+                self._queue.put((self._STOP, next(self._seq), None, None, (), {}))
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+class EvaluationEngine:
+    """Esegue le valutazioni in parallelo mantenendo l'ordine dei risultati.
+
+    - `submit()` accoda una singola chiamata al giudice nel pool `judge`
+      (al massimo `workers` chiamate in volo).
+    - `map_ordered()` elabora gli elementi (tipicamente i file di log) nel
+      pool `log`, con al massimo `max_pending` elementi in corso, e li
+      restituisce nello stesso ordine in cui sono stati forniti.
+
+    Le chiamate accodate mentre si elabora un elemento ereditano la sua
+    posizione come priorità: i log più vecchi vengono completati per primi,
+    così l'output ordinato (e il checkpoint) avanza in modo regolare invece
+    di completare tutti i log in volo insieme alla fine.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int | None = None):
+        """`workers` chiamate al giudice in parallelo, al più `max_pending` log in lavorazione."""
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending or self.workers * 2))
+        self._calls = _PriorityExecutor(self.workers, "judge")
+        self._items = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix="log")
+        self._local = threading.local()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Accoda una chiamata al giudice con la priorità del log corrente."""
+        priority = getattr(self._local, "priority", None)
+        return self._calls.submit(0 if priority is None else priority, fn, *args, **kwargs)
+
+    def _run_item(self, position: int, fn: Callable[[Any], Any], item: Any) -> Any:
+        self._local.priority = position
+        try:
+            return fn(item)
+        finally:
+            self._local.priority = None
+
+    def map_ordered(self, fn: Callable[[Any], Any], items: Iterable[Any]) -> Iterator[tuple[Any, Any]]:
+        """Applica `fn` agli elementi in parallelo, restituendo `(item, risultato)` in ordine."""
+        pending: deque[tuple[Any, Future]] = deque()
+        for position, item in enumerate(items):
+            pending.append((item, self._items.submit(self._run_item, position, fn, item)))
+            if len(pending) >= self.max_pending:
+                head, fut = pending.popleft()
+                yield head, fut.result()
+        while pending:
+            head, fut = pending.popleft()
+            yield head, fut.result()
+
+    def close(self, cancel: bool = False) -> None:
+        """Attende (o con `cancel` annulla) i lavori in coda e chiude i pool."""
+        self._items.shutdown(wait=not cancel, cancel_futures=cancel)
+        self._calls.shutdown(wait=not cancel, cancel_futures=cancel)
+
+    def __enter__(self) -> "EvaluationEngine":
+        """Ritorna il motore stesso."""
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Chiude il motore, annullando i lavori in coda se è in corso un'eccezione."""
+        self.close(cancel=exc_type is not None)
@@ -0,0 +1,113 @@
+"""Autoconsistenza: più campioni del giudice per una metrica, con arresto anticipato.
+
+Una metrica con `"samples": k` in `config_metrics.json` viene valutata con
+fino a k chiamate indipendenti, a temperatura `sample_temperature` (il
+giudice di default risponde a temperatura 0 e darebbe sempre lo stesso voto).
+Le chiamate partono a ondate parallele: la prima ne lancia `agreement`
+(default: maggioranza di k) e ci si ferma appena un punteggio raccoglie
+`agreement` voti; altrimenti l'ondata successiva lancia solo le chiamate che
+mancano perché il punteggio più votato possa raggiungere l'accordo, fino a k.
+
+Il punteggio finale è quello più votato (a parità, il primo ottenuto); la
+valutazione riporta in `Samples` la distribuzione dei voti e l'accordo.
+"""
+
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass
+
+DEFAULT_SAMPLE_TEMPERATURE = 0.7
+
+
+@dataclass(frozen=True)
+class SamplingSpec:
+    """Campionamento di una metrica: `samples` chiamate al più, stop con `agreement` voti uguali."""
+
+    samples: int
+    agreement: int
+    temperature: float = DEFAULT_SAMPLE_TEMPERATURE
+
+    def __post_init__(self):
+        """Valida numero di campioni, soglia di accordo e temperatura."""
+        if self.samples < 2:
+            raise ValueError(f"'samples' deve essere almeno 2 (ricevuto {self.samples})")
+        if not 1 <= self.agreement <= self.samples:
+            raise ValueError(f"'samples_agreement' deve essere tra 1 e {self.samples} (ricevuto {self.agreement})")
+        if self.temperature < 0:
+            raise ValueError(f"'sample_temperature' non può essere negativa (ricevuto {self.temperature})")
+
+    @classmethod
+    def from_metric(cls, metric: dict) -> "SamplingSpec | None":
+        """Legge `samples`, `samples_agreement` e `sample_temperature`; None se la metrica non è campionata."""
+        name = metric.get("metric_name", "UNKNOWN_METRIC")
+        try:
+            samples = int(metric.get("samples", 1))
+            if samples <= 1:
+                return None
+            agreement = int(metric.get("samples_agreement", samples // 2 + 1))
+            temperature = float(metric.get("sample_temperature", DEFAULT_SAMPLE_TEMPERATURE))
+            return cls(samples, agreement, temperature)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"metrica '{name}': campionamento non valido: {e}") from None
+
+    def cache_variant(self, sample: int) -> str:
+        """Distingue in cache i campioni di uno stesso prompt."""
+        return f"sample={sample};temperature={self.temperature}"
+
+
+class VoteTally:
+    """Voti raccolti per una metrica campionata.
+
+    `vote_key(evaluation)` ritorna la forma canonica del punteggio, o "" per
+    i campioni falliti (che non votano).
+    """
+
+    def __init__(self, spec: SamplingSpec, vote_key: Callable[[dict], str]):
+        """Votazione vuota; `vote_key` estrae da una valutazione il punteggio da contare."""
+        self.spec = spec
+        self._vote_key = vote_key
+        self.evaluations: list[dict] = []
+        self.votes: Counter[str] = Counter()
+        # prima valutazione ottenuta per ogni punteggio (giustificazione e risposta grezza)
+        self._first: dict[str, dict] = {}
+
+    @property
+    def issued(self) -> int:
+        """Numero di valutazioni raccolte."""
+        return len(self.evaluations)
+
+    def add(self, evaluation: dict) -> None:
+        """Aggiunge una valutazione e ne conta il voto."""
+        self.evaluations.append(evaluation)
+        key = self._vote_key(evaluation)
+        if key:
+            self.votes[key] += 1
+            self._first.setdefault(key, evaluation)
+
+    def _top(self) -> tuple[str, int]:
+        # Counter.most_common mantiene l'ordine di inserimento a parità di voti
+        return self.votes.most_common(1)[0] if self.votes else ("", 0)
+
+    def next_wave(self) -> int:
+        """Campioni da lanciare nella prossima ondata (0: accordo raggiunto o campioni esauriti)."""
+        _, top = self._top()
+        if top >= self.spec.agreement:
+            return 0
+        return min(self.spec.samples - self.issued, self.spec.agreement - top)
+
+    def result(self) -> dict:
+        """Valutazione finale, con distribuzione dei voti e accordo in `Samples`."""
+        key, top = self._top()
+        valid = sum(self.votes.values())
+        evaluation = dict(self._first[key] if key else self.evaluations[0])
+        evaluation["Samples"] = {
+            "requested": self.spec.samples,
+            "issued": self.issued,
+            "failed": self.issued - valid,
+            "agreement_required": self.spec.agreement,
+            "votes": dict(self.votes),
+            "agreement": round(top / valid, 3) if valid else 0.0,
+            "consensus": top >= self.spec.agreement,
+            "temperature": self.spec.temperature,
+        }
+        return evaluation
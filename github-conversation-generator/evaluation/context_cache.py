@@ -0,0 +1,159 @@
+"""Cache di contesto del provider per il prefisso comune dei prompt di una conversazione.
+
+I prompt delle metriche di una conversazione condividono lo stesso prefisso
+(system prompt, ground truth, trascrizione, persona: vedi
+`PromptPlan.shared_prefix`) e differiscono solo per il blocco finale della
+metrica. `SharedPrefix` registra quel prefisso una sola volta nella cache di
+contesto del provider, alla prima chiamata che lo usa, e le chiamate
+successive inviano solo il blocco della metrica facendo riferimento alla voce
+registrata: i token del prefisso vengono fatturati a tariffa ridotta e il
+modello non li rielabora.
+
+La registrazione è delegata a una funzione `register(model, prefix, ttl)`
+fornita da chi usa il modulo: ritorna `(modello legato alla cache, funzione
+di rilascio)`, oppure None se il modello non supporta la cache di contesto.
+Se la registrazione fallisce, `ContextCache` la disattiva per il resto
+dell'esecuzione (avvisando con `on_disable`) e le chiamate inviano il prompt
+completo, come senza cache.
+"""
+
+import contextlib
+import threading
+from collections.abc import Callable
+from typing import Any
+
+Register = Callable[[Any, str, float], tuple[Any, Callable[[], None]] | None]
+
+
+def _estimate_tokens(chars: int) -> int:
+    return chars // 4 + 1 if chars else 0
+
+
+class ContextCache:
+    """Configurazione e statistiche della cache di contesto per un'esecuzione (thread-safe).
+
+    Un prefisso viene registrato solo se supera `min_tokens` token stimati
+    (i provider rifiutano voci più piccole) e se la conversazione prevede
+    almeno `min_calls` chiamate al giudice; la voce scade dopo `ttl` secondi
+    se non viene rilasciata prima.
+    """
+
+    def __init__(self, register: Register, min_tokens: int = 4096, ttl: float = 600.0, min_calls: int = 2,
+                 on_disable: Callable[[str], None] | None = None):
+        """Cache dei prefissi registrati con `register`; `on_disable` riceve il motivo se la cache si disattiva."""
+        self._register = register
+        self._on_disable = on_disable
+        self.min_tokens = max(0, int(min_tokens))
+        self.ttl = max(1.0, float(ttl))
+        self.min_calls = max(1, int(min_calls))
+        self._lock = threading.Lock()
+        self.disabled_reason: str | None = None
+        self.registrations = 0
+        self.failures = 0
+        self.cached_calls = 0
+        self.cached_tokens = 0
+        self.prompt_tokens = 0
+
+    def prefix(self, text: str, expected_calls: int) -> "SharedPrefix | None":
+        """Prefisso condiviso da `expected_calls` chiamate; None se non conviene registrarlo."""
+        if self.disabled_reason is not None or expected_calls < self.min_calls:
+            return None
+        if _estimate_tokens(len(text)) < self.min_tokens:
+            return None
+        return SharedPrefix(self, text)
+
+    def disable(self, reason: str) -> None:
+        """Disattiva la cache per il resto dell'esecuzione."""
+        with self._lock:
+            self.failures += 1
+            if self.disabled_reason is not None:
+                return
+            self.disabled_reason = reason
+        if self._on_disable is not None:
+            self._on_disable(reason)
+
+    def record_usage(self, prompt_tokens: int, cached_tokens: int) -> None:
+        """Token di input di una chiamata fatta con la cache, come riportati dal provider."""
+        with self._lock:
+            self.cached_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+    def to_dict(self) -> dict:
+        """Contatori di registrazioni, chiamate e token serviti dalla cache."""
+        with self._lock:
+            return {
+                "registrations": self.registrations,
+                "failures": self.failures,
+                "cached_calls": self.cached_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+                "disabled_reason": self.disabled_reason,
+            }
+
+    def summary(self) -> str:
+        """Riepilogo di una riga dei contatori."""
+        stats = self.to_dict()
+        text = (f"{stats['registrations']} prefissi registrati, {stats['cached_calls']} chiamate con cache, "
+                f"{stats['cached_tokens']} token di input su {stats['prompt_tokens']} serviti dalla cache "
+                f"({stats['cached_ratio'] * 100:.1f}%)")
+        if stats["disabled_reason"]:
+            text += f"; disattivata: {stats['disabled_reason']}"
+        return text
+
+
+class SharedPrefix:
+    """Prefisso dei prompt di una conversazione, registrato al più una volta (alla prima chiamata)."""
+
+    def __init__(self, cache: ContextCache, text: str):
+        """Prefisso `text` da registrare in `cache` alla prima chiamata utile."""
+        self.cache = cache
+        self.text = text
+        self._lock = threading.Lock()
+        self._resolved = False
+        self._model: Any = None
+        self._model_key: int | None = None
+        self._release: Callable[[], None] | None = None
+
+    def split(self, prompt: str) -> str | None:
+        """Parte di `prompt` dopo il prefisso, o None se il prompt non inizia con il prefisso."""
+        return prompt[len(self.text):] if prompt.startswith(self.text) else None
+
+    def bind(self, model: Any) -> Any | None:
+        """Modello legato alla voce in cache per `model`, registrandola se serve; None se non disponibile.
+
+        Le chiamate concorrenti attendono la registrazione fatta dalla prima;
+        se fallisce la cache viene disattivata e si ritorna None.
+        """
+        with self._lock:
+            if self._resolved and self._model_key == id(model):
+                return self._model
+            if self._resolved or self.cache.disabled_reason is not None:
+                # il modello è cambiato (fallback allo stub): la voce registrata non vale più
+                return None
+            self._resolved = True
+            self._model_key = id(model)
+            try:
+                bound = self.cache._register(model, self.text, self.cache.ttl)
+            except Exception as e:
+                self.cache.disable(f"{type(e).__name__}: {e}")
+                return None
+            if bound is None:
+                self.cache.disable(f"il modello '{getattr(model, 'model_name', type(model).__name__)}' "
+                                   f"non supporta la cache di contesto")
+                return None
+            self._model, self._release = bound
+            with self.cache._lock:
+                self.cache.registrations += 1
+            return self._model
+
+    def close(self) -> None:
+        """Rilascia la voce in cache (fine della conversazione); gli errori non sono fatali."""
+        with self._lock:
+            release, self._release = self._release, None
+            self._model = None
+        if release is not None:
+            # la voce scade comunque dopo `ttl`
+            with contextlib.suppress(Exception):
+                release()
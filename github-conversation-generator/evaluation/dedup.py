@@ -0,0 +1,224 @@
+"""Conversazioni duplicate nel corpus: duplicati esatti e quasi-duplicati.
+
+Un corpus generato contiene spesso conversazioni identiche (riesecuzioni
+dello stesso scenario, lo stesso log copiato in più cartelle di profilo).
+Ogni conversazione preparata dall'ingest ha un'impronta
+(`conversation_fingerprint`) calcolata su ciò che il giudice vede: ground
+truth, trascrizione normalizzata, sezione persona e approccio (che decide
+quali metriche si applicano). `DuplicateIndex` fa valutare una sola volta le
+conversazioni con la stessa impronta: la prima viene valutata, le altre
+attendono il suo risultato e lo riusano con il proprio Sim_ID.
+
+`NearDuplicateIndex` stima invece la somiglianza di Jaccard tra le
+conversazioni (ground truth, trascrizione e persona) con MinHash su shingle
+di parole, e raggruppa quelle sopra soglia (LSH a bande per non confrontare
+tutte le coppie): serve solo al report `near_duplicates.json`, per potare il
+corpus; non cambia la valutazione.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from concurrent.futures import Future
+
+_WS_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"\w+")
+_MERSENNE_61 = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_text(text: str) -> str:
+    """Spazi consecutivi ridotti a uno e bordi rimossi: differenze di formattazione non contano."""
+    return _WS_RE.sub(" ", text).strip()
+
+
+def _conversation_text(conv: dict) -> str:
+    # con la strategia `relevance` il giudice vede anche finestre ricavate dai turni completi
+    turns = conv.get("transcript_turns")
+    return normalize_text("\n".join(turns) if turns else conv["transcript"])
+
+
+def conversation_fingerprint(conv: dict) -> str:
+    """Impronta (SHA-256) di ciò che il giudice valuta: approccio, ground truth, trascrizione e persona."""
+    payload = [conv["approach"], conv["ground_truth"], _conversation_text(conv),
+               normalize_text(conv["persona_section"])]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class DuplicateIndex:
+    """Coordina la valutazione delle conversazioni con la stessa impronta (thread-safe).
+
+    `claim(fingerprint)` ritorna None alla prima conversazione, che va
+    valutata e il cui risultato va pubblicato con `resolve()` (o `fail()`),
+    e alle successive il Future di quel risultato. I risultati restano in
+    memoria per l'intera esecuzione, come le valutazioni nel journal.
+    """
+
+    def __init__(self):
+        """Registro vuoto."""
+        self._lock = threading.Lock()
+        self._results: dict[str, Future] = {}
+        self.conversations = 0
+        self.duplicates = 0
+        self.calls_saved = 0
+
+    def claim(self, fingerprint: str) -> Future | None:
+        """Ritorna il Future del primo log con `fingerprint`, oppure None se questo è il primo."""
+        with self._lock:
+            self.conversations += 1
+            future = self._results.get(fingerprint)
+            if future is None:
+                self._results[fingerprint] = Future()
+                return None
+            self.duplicates += 1
+            return future
+
+    def resolve(self, fingerprint: str, result) -> None:
+        """Pubblica il risultato del primo log con `fingerprint` ai suoi duplicati."""
+        self._results[fingerprint].set_result(result)
+
+    def fail(self, fingerprint: str, error: BaseException) -> None:
+        """La prima valutazione è fallita: le copie in attesa ricevono l'errore, le successive riprovano."""
+        with self._lock:
+            future = self._results.pop(fingerprint)
+        future.set_exception(error)
+
+    def add_saved_calls(self, calls: int) -> None:
+        """Somma `calls` alle chiamate al giudice evitate."""
+        with self._lock:
+            self.calls_saved += calls
+
+    def to_dict(self) -> dict:
+        """Contatori di conversazioni, duplicati e chiamate evitate."""
+        with self._lock:
+            return {
+                "conversations": self.conversations,
+                "unique": self.conversations - self.duplicates,
+                "duplicates": self.duplicates,
+                "duplicate_rate": round(self.duplicates / self.conversations, 4) if self.conversations else 0.0,
+                "calls_saved": self.calls_saved,
+            }
+
+    def summary(self) -> str:
+        """Riepilogo di una riga dei duplicati esatti."""
+        stats = self.to_dict()
+        return (f"{stats['duplicates']} duplicati esatti su {stats['conversations']} conversazioni "
+                f"({stats['duplicate_rate'] * 100:.1f}%), {stats['calls_saved']} chiamate al giudice evitate")
+
+
+def _shingles(text: str, size: int) -> set[bytes]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words).encode("utf-8")} if words else set()
+    return {" ".join(words[i:i + size]).encode("utf-8") for i in range(len(words) - size + 1)}
+
+
+class NearDuplicateIndex:
+    """Quasi-duplicati tra conversazioni con MinHash e LSH a bande.
+
+    Ogni conversazione diventa l'insieme dei suoi shingle di `shingle_size`
+    parole; la firma MinHash di `num_perm` valori stima la somiglianza di
+    Jaccard. Le firme vengono divise in `bands` bande: due conversazioni sono
+    candidate se coincidono in almeno una banda, e restano nel report se la
+    somiglianza stimata è almeno `threshold`.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, shingle_size: int = 5):
+        """Indice MinHash/LSH con `num_perm` permutazioni divise in `bands` bande."""
+        if not 0 < threshold <= 1:
+            raise ValueError(f"soglia di somiglianza non valida: {threshold} (attesa tra 0 e 1)")
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) deve essere multiplo di bands ({bands})")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        # permutazioni (a*x + b) mod p, deterministiche tra esecuzioni
+        seed = hashlib.sha256(b"valut-minhash").digest()
+        rng = int.from_bytes(seed, "big")
+        self._perms = []
+        for _ in range(num_perm):
+            rng = (rng * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            a = rng % (_MERSENNE_61 - 1) + 1
+            rng = (rng * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            self._perms.append((a, rng % _MERSENNE_61))
+        self._lock = threading.Lock()
+        self._entries: list[tuple[dict, tuple[int, ...]]] = []
+        self._buckets: dict[tuple[int, tuple[int, ...]], list[int]] = {}
+
+    def signature(self, text: str) -> tuple[int, ...]:
+        """Firma MinHash del testo normalizzato."""
+        hashes = [int.from_bytes(hashlib.blake2b(s, digest_size=8).digest(), "big") for s in
+                  _shingles(normalize_text(text), self.shingle_size)]
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        return tuple(min(((a * h + b) % _MERSENNE_61) & _MAX_HASH for h in hashes) for a, b in self._perms)
+
+    def add(self, conv: dict) -> None:
+        """Registra una conversazione preparata (firma calcolata fuori dal lock)."""
+        signature = self.signature("\n".join([conv["ground_truth"], _conversation_text(conv), conv["persona_section"]]))
+        entry = {"sim_id": conv["sim_id"], "log_file": conv["log_file"]}
+        rows = self.num_perm // self.bands
+        with self._lock:
+            position = len(self._entries)
+            self._entries.append((entry, signature))
+            for band in range(self.bands):
+                key = (band, signature[band * rows:(band + 1) * rows])
+                self._buckets.setdefault(key, []).append(position)
+
+    def _similarity(self, a: tuple[int, ...], b: tuple[int, ...]) -> float:
+        return sum(x == y for x, y in zip(a, b)) / self.num_perm
+
+    def clusters(self) -> list[dict]:
+        """Gruppi di conversazioni collegate da coppie sopra soglia, dal più numeroso."""
+        with self._lock:
+            entries = list(self._entries)
+            candidates = {(i, j) for members in self._buckets.values()
+                          for n, i in enumerate(members) for j in members[n + 1:]}
+        parent = list(range(len(entries)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        pairs: dict[int, list[tuple[int, int, float]]] = {}
+        for i, j in sorted(candidates):
+            similarity = self._similarity(entries[i][1], entries[j][1])
+            if similarity >= self.threshold:
+                pairs.setdefault(i, []).append((i, j, similarity))
+                parent[find(j)] = find(i)
+        groups: dict[int, list[int]] = {}
+        for i in range(len(entries)):
+            groups.setdefault(find(i), []).append(i)
+        clusters = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            member_pairs = [pair for i in members for pair in pairs.get(i, [])]
+            clusters.append({
+                "size": len(members),
+                "min_similarity": round(min(s for _, _, s in member_pairs), 3),
+                "conversations": [entries[i][0] for i in members],
+                "pairs": [{"a": entries[i][0]["sim_id"], "b": entries[j][0]["sim_id"], "similarity": round(s, 3)}
+                          for i, j, s in member_pairs],
+            })
+        clusters.sort(key=lambda c: (-c["size"], c["conversations"][0]["sim_id"]))
+        return clusters
+
+    def report(self) -> dict:
+        """Parametri dell'indice e cluster di conversazioni quasi duplicate."""
+        clusters = self.clusters()
+        return {
+            "threshold": self.threshold,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "shingle_size": self.shingle_size,
+            "conversations": len(self._entries),
+            "clusters": len(clusters),
+            # conversazioni che si potrebbero togliere tenendone una per gruppo
+            "redundant": sum(c["size"] - 1 for c in clusters),
+            "groups": clusters,
+        }
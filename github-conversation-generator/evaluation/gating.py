@@ -0,0 +1,98 @@
+"""Grafo condizionale delle metriche: dipendenze e condizioni di salto.
+
+In `config_metrics.json` una metrica può indicare:
+
+- `depends_on`: metriche da valutare prima di lei (nome o lista di nomi);
+- `skip_if`: oggetto `{"Metrica": valore}` (o lista di valori); la metrica
+  viene saltata, con punteggio `N/A` e il motivo nei dettagli, se una delle
+  metriche indicate ha ottenuto uno di quei valori. Le metriche di `skip_if`
+  sono implicitamente dipendenze.
+
+Le dipendenze formano un DAG, verificato all'avvio. Ogni metrica ha un
+livello (0 senza dipendenze, altrimenti uno in più della dipendenza più
+profonda): le metriche dello stesso livello partono insieme, quelle dei
+livelli successivi appena i risultati che le condizionano sono disponibili.
+Una dipendenza fallita o non applicabile non fa saltare nulla, a meno che il
+suo valore (es. `"N/A"`) non compaia esplicitamente in `skip_if`.
+"""
+
+from dataclasses import dataclass
+
+
+def canonical_value(value) -> str:
+    """Forma confrontabile di un punteggio: true/"True", 4/"4.0"/" 4 " sono lo stesso valore."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    text = str(value).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        return text.lower()
+    return str(int(number)) if number.is_integer() else repr(number)
+
+
+@dataclass(frozen=True)
+class Gate:
+    """Dipendenze di una metrica e valori delle dipendenze che la fanno saltare."""
+
+    depends_on: tuple[str, ...]
+    skip_if: tuple[tuple[str, frozenset[str]], ...] = ()
+
+    @classmethod
+    def from_metric(cls, metric: dict) -> "Gate | None":
+        """Legge `depends_on` e `skip_if`; None se la metrica non è condizionata."""
+        name = metric.get("metric_name", "UNKNOWN_METRIC")
+        depends_on = metric.get("depends_on") or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        skip_if = metric.get("skip_if") or {}
+        if not isinstance(depends_on, list) or not all(isinstance(d, str) for d in depends_on):
+            raise ValueError(f"metrica '{name}': 'depends_on' deve essere un nome o una lista di nomi di metriche")
+        if not isinstance(skip_if, dict):
+            raise ValueError(f"metrica '{name}': 'skip_if' deve essere un oggetto {{\"Metrica\": valore}}")
+        conditions = []
+        for dependency, values in skip_if.items():
+            values = values if isinstance(values, list) else [values]
+            conditions.append((dependency, frozenset(canonical_value(v) for v in values)))
+        # le metriche delle condizioni sono dipendenze implicite; ordine stabile, senza duplicati
+        names = tuple(dict.fromkeys([*depends_on, *skip_if]))
+        if not names:
+            return None
+        if name in names:
+            raise ValueError(f"metrica '{name}': non può dipendere da se stessa")
+        return cls(names, tuple(conditions))
+
+    def skip_reason(self, values: dict[str, object]) -> str | None:
+        """Motivo del salto dati i punteggi delle dipendenze, o None se la metrica va valutata."""
+        for dependency, skip_values in self.skip_if:
+            value = values.get(dependency, "")
+            if canonical_value(value) in skip_values:
+                return f"{dependency} = {value}"
+        return None
+
+
+def gate_levels(gates: dict[str, Gate | None]) -> dict[str, int]:
+    """Livello di ogni metrica nel DAG; `ValueError` per dipendenze sconosciute o cicliche."""
+    for name, gate in gates.items():
+        for dependency in gate.depends_on if gate else ():
+            if dependency not in gates:
+                raise ValueError(f"metrica '{name}': dipende da '{dependency}', che non è in config_metrics.json")
+
+    levels: dict[str, int] = {}
+    visiting: list[str] = []
+
+    def level(name: str) -> int:
+        if name in levels:
+            return levels[name]
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise ValueError(f"dipendenze cicliche tra le metriche: {' -> '.join(cycle)}")
+        visiting.append(name)
+        gate = gates[name]
+        levels[name] = 1 + max((level(d) for d in gate.depends_on), default=-1) if gate else 0
+        visiting.pop()
+        return levels[name]
+
+    for name in gates:
+        level(name)
+    return levels
@@ -0,0 +1,191 @@
+"""Invalidazione fine dei risultati: `valut.py --incremental` ricalcola solo le celle cambiate.
+
+Ogni valutazione scritta nei dettagli porta l'impronta dei suoi input
+(`Fingerprint`, vedi `InputFingerprints`):
+
+- l'hash del contenuto del log (`log_hash`);
+- la definizione completa della metrica in `config_metrics.json` (criteri,
+  descrizione, tipo di valore, campioni, condizioni...);
+- il system prompt di `config_judge.json`, il modello del giudice e le
+  opzioni di riduzione della trascrizione;
+- per le metriche condizionate (`depends_on`), le impronte delle loro
+  dipendenze: se una dipendenza cambia, cambia anche la metrica che ne dipende.
+
+Con `--incremental` le valutazioni dell'esecuzione precedente
+(`PreviousResults`: archivio `--results-store` o file riepilogativo dei
+dettagli) vengono riusate quando l'impronta coincide con quella attesa; le
+altre celle (log nuovi o modificati, metriche modificate o aggiunte,
+valutazioni fallite) vengono ricalcolate. `IncrementalPlan` riassume celle da
+ricalcolare e da riusare prima di qualunque chiamata al giudice.
+"""
+
+import hashlib
+import json
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+from .prompts import MetricPlan, PromptPlan
+from .sink import iter_detail_records
+from .store import iter_store
+from .transcript import TranscriptOptions
+
+FINGERPRINT_KEY = "Fingerprint"
+# Punteggi di valutazioni non riuscite: non ricevono impronta e vengono sempre ricalcolate
+UNSTAMPED_SCORES = frozenset({"EVALUATION_FAILED", "EVALUATION_SKIPPED"})
+
+
+def _digest(payload) -> str:
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class InputFingerprints:
+    """Impronte degli input di ogni cella (log, metrica) per un piano di prompt e un modello."""
+
+    def __init__(self, plan: PromptPlan, model_name: str, transcript_options: TranscriptOptions | None = None):
+        """Impronte delle metriche per il prompt di sistema, il modello e le opzioni di trascrizione correnti."""
+        options = None
+        if transcript_options is not None and transcript_options.enabled:
+            options = [transcript_options.budget_tokens, list(transcript_options.strategies),
+                       transcript_options.head_ratio, transcript_options.relevance_window]
+        judge = _digest([plan.system_prompt, model_name, options])
+        self._metrics: dict[str, str] = {}
+        # in ordine di livello: le dipendenze hanno già la loro impronta
+        for mp in sorted(plan.metrics, key=lambda m: m.level):
+            dependencies = [self._metrics[name] for name in mp.gate.depends_on] if mp.gate else []
+            self._metrics[mp.name] = _digest([judge, mp.metric, dependencies])
+
+    def cell(self, log_hash: str, metric_name: str) -> str:
+        """Impronta della cella (log, metrica)."""
+        return _digest([self._metrics[metric_name], log_hash])[:32]
+
+    def stamp(self, log_hash: str, metric_name: str, evaluation: dict) -> dict:
+        """Copia della valutazione con l'impronta; le valutazioni fallite restano senza."""
+        if str(evaluation.get("Score", "")) in UNSTAMPED_SCORES:
+            return evaluation
+        return {**evaluation, FINGERPRINT_KEY: self.cell(log_hash, metric_name)}
+
+
+def log_key(log_file: str, logs_dir: Path) -> str:
+    """Chiave di un log (o di una conversazione `file#k`) indipendente da come è stata indicata la cartella."""
+    path, sep, sub = str(log_file).rpartition("#")
+    if not sep or not sub.isdigit():
+        # `#` nel nome del file o della cartella, non l'indice di una conversazione
+        path, sep, sub = str(log_file), "", ""
+    resolved = Path(path).resolve()
+    try:
+        path = resolved.relative_to(Path(logs_dir).resolve()).as_posix()
+    except ValueError:
+        path = resolved.as_posix()
+    return f"{path}{sep}{sub}"
+
+
+class PreviousResults:
+    """Valutazioni di un'esecuzione precedente per log, tenute in memoria per l'esecuzione incrementale."""
+
+    def __init__(self, logs_dir: Path, details: Iterable[dict] = (), source: Path | None = None):
+        """Valutazioni precedenti di `details`, indicizzate per log relativo a `logs_dir`."""
+        self.logs_dir = Path(logs_dir)
+        self.source = source
+        self._by_log: dict[str, dict[str, dict]] = {}
+        for detail in details:
+            if detail.get("log_file") and isinstance(detail.get("evaluations"), dict):
+                # a parità di log vince l'ultimo dettaglio (file JSONL in append)
+                self._by_log[log_key(detail["log_file"], self.logs_dir)] = detail["evaluations"]
+        self._seen: set[str] = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_dir: Path, logs_dir: Path, details_format: str = "json",
+             store_path: Path | None = None) -> "PreviousResults":
+        """Dall'archivio SQLite (se indicato ed esistente) o dal file riepilogativo dei dettagli in `output_dir`."""
+        if store_path is not None and Path(store_path).exists():
+            return cls(logs_dir, (detail for _, detail in iter_store(store_path)), Path(store_path))
+        names = ["results_details.jsonl", "results_details.json"]
+        if details_format != "jsonl":
+            names.reverse()
+        for name in names:
+            path = Path(output_dir) / name
+            if path.exists():
+                return cls(logs_dir, iter_detail_records(path), path)
+        return cls(logs_dir)
+
+    def __len__(self) -> int:
+        """Numero di log con valutazioni precedenti."""
+        return len(self._by_log)
+
+    def reusable(self, conv: dict, fingerprints: InputFingerprints, plans: Iterable[MetricPlan]) -> dict[str, dict]:
+        """Valutazioni precedenti della conversazione la cui impronta coincide con quella attesa."""
+        key = log_key(conv["log_file"], self.logs_dir)
+        with self._lock:
+            self._seen.add(key)
+        previous = self._by_log.get(key)
+        if not previous:
+            return {}
+        reuse = {}
+        for mp in plans:
+            evaluation = previous.get(mp.name)
+            if isinstance(evaluation, dict) and \
+                    evaluation.get(FINGERPRINT_KEY) == fingerprints.cell(conv["log_hash"], mp.name):
+                reuse[mp.name] = evaluation
+        return reuse
+
+    def known(self, conv: dict) -> bool:
+        """Vero se il log della conversazione ha valutazioni precedenti."""
+        return log_key(conv["log_file"], self.logs_dir) in self._by_log
+
+    def unseen(self) -> list[str]:
+        """Log dell'esecuzione precedente non incontrati in questa (rimossi dalla cartella o non più validi)."""
+        with self._lock:
+            return sorted(set(self._by_log) - self._seen)
+
+
+class IncrementalPlan:
+    """Celle da ricalcolare e da riusare, per simulazione e per metrica (thread-safe)."""
+
+    def __init__(self):
+        """Contatori a zero."""
+        self._lock = threading.Lock()
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.recompute = 0
+        self.reuse = 0
+        self.by_metric: dict[str, dict[str, int]] = {}
+        self.removed: list[str] = []
+
+    def add(self, known: bool, plans: Iterable[MetricPlan], reused: Iterable[str]) -> None:
+        """Conta una simulazione e le sue celle riutilizzate o da ricalcolare."""
+        reused = set(reused)
+        names = [mp.name for mp in plans]
+        stale = [name for name in names if name not in reused]
+        with self._lock:
+            if not known:
+                self.new += 1
+            elif stale:
+                self.changed += 1
+            else:
+                self.unchanged += 1
+            self.recompute += len(stale)
+            self.reuse += len(names) - len(stale)
+            for name in names:
+                entry = self.by_metric.setdefault(name, {"recompute": 0, "reuse": 0})
+                entry["reuse" if name in reused else "recompute"] += 1
+
+    def to_dict(self) -> dict:
+        """Contatori per simulazione, per cella e per metrica."""
+        with self._lock:
+            return {
+                "simulations": {"new": self.new, "changed": self.changed, "unchanged": self.unchanged,
+                                "removed": len(self.removed)},
+                "cells": {"recompute": self.recompute, "reuse": self.reuse},
+                "by_metric": {name: dict(entry) for name, entry in self.by_metric.items()},
+                "removed": list(self.removed),
+            }
+
+    def summary(self) -> str:
+        """Riepilogo di una riga del piano incrementale."""
+        return (f"{self.new + self.changed + self.unchanged} simulazioni ({self.new} nuove, {self.changed} modificate, "
+                f"{self.unchanged} invariate, {len(self.removed)} rimosse); {self.recompute} celle da ricalcolare, "
+                f"{self.reuse} riutilizzate")
@@ -0,0 +1,485 @@
+"""Fase di ingest: lettura dei log e preparazione dei record da valutare.
+
+Tutto ciò che serve al giudice per una conversazione (metadati dal percorso,
+ground truth, trascrizione, sezione persona) viene calcolato qui, lontano
+dal thread che parla con l'API. Le funzioni sono pure e serializzabili, così
+`IngestPipeline` può eseguirle in un pool di processi: l'ingest di file
+grandi o numerosi si sovrappone all'I/O di rete e usa tutti i core.
+
+I worker non stampano nulla: gli avvisi vengono restituiti nel record
+(`messages`) e mostrati dal processo principale.
+
+Ogni file viene letto una sola volta in un buffer di byte e decodificato con
+`orjson` se installato (altrimenti con `json`; la variabile d'ambiente
+`VALUT_JSON_BACKEND=json|orjson` forza la scelta). I file con testo prima
+del JSON vengono recuperati con un decoder incrementale sullo stesso buffer.
+
+Un file può contenere più conversazioni: un file `.jsonl` (un log per riga)
+o un `.json` con un array di log al primo livello. Questi file non vengono
+mai caricati per intero: il processo principale li mappa in memoria (mmap) e
+ne individua solo i confini delle conversazioni (`iter_conversation_spans`),
+i worker leggono e preparano una conversazione alla volta. La k-esima
+conversazione (da 0) ha come identificativo stabile `<file>#k`, usato come
+`log_file` in output e nel journal, e Sim_ID `Sim_<indice file>_<scenario>#k`;
+profilo, scenario e approccio si ricavano dal percorso del file come per i
+log singoli.
+"""
+
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import signal
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .dedup import conversation_fingerprint
+from .transcript import TranscriptOptions, build_transcript
+from .turns import format_turns
+
+try:
+    import orjson
+except ImportError:  # backend opzionale
+    orjson = None
+
+JSON_BACKEND = os.environ.get("VALUT_JSON_BACKEND", "").lower() or ("orjson" if orjson is not None else "json")
+if JSON_BACKEND == "orjson" and orjson is None:
+    JSON_BACKEND = "json"
+# Chiavi che identificano l'oggetto di un log tra quelli recuperabili da un file sporco
+_LOG_KEYS = ("conversation", "agents", "messages")
+_MAX_RECOVERY_CANDIDATES = 32
+# Estensioni dei file di log; i `.jsonl` contengono sempre una conversazione per riga
+LOG_SUFFIXES = (".json", ".jsonl")
+# Prossima parentesi strutturale: testo e stringhe JSON prima di lei vengono saltati dal motore delle regex
+_ARRAY_TOKEN_RE = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])', re.DOTALL)
+_BOM = b"\xef\xbb\xbf"
+# Ogni quanti byte scanditi le pagine mappate di un file multi-conversazione vengono rilasciate
+_RELEASE_BYTES = 64 * 1024 * 1024
+
+
+def _loads(raw: bytes):
+    """Decodifica il buffer con il backend scelto; in caso di errore vale il comportamento di `json`."""
+    if JSON_BACKEND == "orjson":
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # orjson è più restrittivo (BOM, NaN, interi enormi): `json` decide l'esito finale
+            pass
+    return json.loads(raw.decode("utf-8"))
+
+
+def _recover_json(text: str):
+    """Primo oggetto JSON decodificabile nel testo, saltando eventuale testo prefisso.
+
+    Prova i `{` in ordine con un decoder incrementale (il testo dopo l'oggetto
+    viene ignorato). Oltre al primo `{` accetta solo oggetti con le chiavi
+    tipiche di un log: in un file troncato un sotto-oggetto (es. la ground
+    truth) non va scambiato per il log.
+    """
+    decoder = json.JSONDecoder()
+    start = text.find('{')
+    for candidate in range(_MAX_RECOVERY_CANDIDATES):
+        if start == -1:
+            break
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            start = text.find('{', start + 1)
+            continue
+        if candidate == 0 or (isinstance(value, dict) and any(k in value for k in _LOG_KEYS)):
+            return value
+        start = text.find('{', end)
+    return None
+
+
+def format_transcript(conversation_log: list[dict]) -> str:
+    """Formatta il log di conversazione in una stringa leggibile.
+
+    Supporta più formati di log: prova chiavi comuni come
+    'agent'/'content' oppure 'speaker'/'message' o 'speaker'/'text'
+    (lo schema viene rilevato una volta, vedi `turns.format_turns`).
+    """
+    return "\n".join(format_turns(conversation_log))
+
+
+def read_log(log_file: Path) -> tuple[dict | None, str, list[str]]:
+    """Legge un file di log una sola volta.
+
+    Ritorna `(log_data, hash del contenuto, avvisi)`; `log_data` è None se il
+    file va saltato (vuoto, non parsabile, non è un oggetto JSON).
+    """
+    messages: list[str] = []
+    log_hash = ""
+    # Protezione: salta file JSON vuoti o non-parsabili invece di rompere l'intero run.
+    try:
+        raw = Path(log_file).read_bytes()
+        log_hash = hashlib.sha256(raw).hexdigest()
+        if not raw:
+            messages.append(f"[yellow]File vuoto ignorato: {log_file}[/yellow]")
+            return None, log_hash, messages
+        log_data = _loads(raw)
+    except json.JSONDecodeError:
+        # Tentativo di recupero: rimuoviamo eventuale testo prefisso non-JSON
+        try:
+            txt = raw.decode("utf-8", errors="replace")
+            log_data = _recover_json(txt)
+            if log_data is not None:
+                messages.append(f"[yellow]Parsed JSON dopo trimming del prefisso per: {log_file}[/yellow]")
+            elif '{' in txt:
+                messages.append(f"[yellow]JSON non valido in file, salto: {log_file}[/yellow]")
+                return None, log_hash, messages
+            else:
+                messages.append("[yellow]JSON non valido in file (nessun oggetto individuabile), salto: "
+                                f"{log_file}[/yellow]")
+                return None, log_hash, messages
+        except Exception:
+            messages.append(f"[yellow]JSON non valido in file, salto: {log_file}[/yellow]")
+            return None, log_hash, messages
+    except Exception as e:
+        messages.append(f"[yellow]Errore aprendo/parsing {log_file}: {e} - salto file[/yellow]")
+        return None, log_hash, messages
+
+    if not isinstance(log_data, dict):
+        messages.append(f"[yellow]Il file non contiene un oggetto JSON, salto: {log_file}[/yellow]")
+        return None, log_hash, messages
+
+    # Le chiavi alternative dei turni (speaker/message, role/content, ...) vengono
+    # gestite dagli adattatori di `turns` quando si costruisce la trascrizione.
+    if 'conversation' in log_data and not log_data['conversation']:
+        log_data['conversation'] = []
+    return log_data, log_hash, messages
+
+
+def prepare_conversation(log_data: dict, log_file: Path, logs_dir: Path, index: int,
+                         transcript_options: TranscriptOptions | None = None, sub_index: int | None = None) -> dict:
+    """Estrae metadati, ground truth, trascrizione e persona da un log già caricato.
+
+    Con un budget in `transcript_options` la trascrizione viene ridotta e il
+    report della riduzione salvato in `transcript_trimming`. `sub_index` è la
+    posizione della conversazione in un file multi-conversazione.
+    """
+    # Estrazione metadati dal nome/percorso del file
+    relative_path = log_file.relative_to(logs_dir)
+    profile = relative_path.parent.name if len(relative_path.parts) > 1 else "N/A"
+    scenario_name = relative_path.stem
+    sim_id = f"Sim_{(index+1):03d}_{scenario_name}"
+    if sub_index is not None:
+        sim_id = f"{sim_id}#{sub_index}"
+    approach = 'A' if 'approach_a' in log_file.name.lower() else 'B'
+    asymmetry_level = scenario_name.split('_')[-1]
+
+    # Preparazione dati per la valutazione
+    agents = log_data.get("agents", [])
+
+    # Estrarre ground-truth e il system_prompt completo dell'Agent_2 (raw + parsed se JSON)
+    gt_obj = agents[0].get("system_prompt", {}) if len(agents) > 0 and isinstance(agents[0], dict) else {}
+    ground_truth = json.dumps(gt_obj, ensure_ascii=False)
+    transcript_turns = None
+    transcript_trimming = None
+    if transcript_options is not None and transcript_options.enabled:
+        transcript, turns, transcript_trimming = build_transcript(log_data.get("conversation", []), transcript_options)
+        if "relevance" in transcript_options.strategies:
+            # servono per le finestre di rilevanza per metrica (PromptPlan.metric_context)
+            transcript_turns = turns
+    else:
+        transcript = format_transcript(log_data.get("conversation", []))
+
+    # Agent_2: estrai system_prompt raw e prova a parsarlo se contiene JSON
+    agent2_persona_raw = ""
+    agent2_persona_parsed = {}
+    agent2_profile_name = ""
+    if len(agents) > 1 and isinstance(agents[1], dict):
+        agent2_persona_raw = agents[1].get("system_prompt", "") or ""
+        # tentativo semplice di estrarre oggetto JSON contenuto nella stringa
+        try:
+            start = agent2_persona_raw.find("{")
+            end = agent2_persona_raw.rfind("}")
+            if start != -1 and end != -1 and end > start:
+                candidate = agent2_persona_raw[start:end+1]
+                parsed = json.loads(candidate)
+                if isinstance(parsed, dict):
+                    agent2_persona_parsed = parsed
+                    persona_cfg = parsed.get("persona_configuration", {}) or {}
+                    agent2_profile_name = persona_cfg.get("profile_name", "") or persona_cfg.get("agent_name", "")
+        except Exception:
+            agent2_persona_parsed = {}
+
+    # Aggiungiamo le informazioni del personaggio al prompt del giudice per valutazioni contestuali
+    persona_section = ""
+    if agent2_profile_name or agent2_persona_parsed:
+        persona_section = "\n\n**AGENT_2 PERSONA / CHARACTER METADATA**\n"
+        if agent2_profile_name:
+            persona_section += f"- Profile name: {agent2_profile_name}\n"
+        if agent2_persona_parsed:
+            persona_section += f"- Persona JSON (estratto): {json.dumps(agent2_persona_parsed, ensure_ascii=False)}\n"
+        else:
+            persona_section += f"- Persona raw (non-json): {agent2_persona_raw[:1000]}\n"
+
+    conv = {
+        "sim_id": sim_id,
+        "log_file": str(log_file) if sub_index is None else f"{log_file}#{sub_index}",
+        "approach": approach,
+        "profile": profile,
+        "scenario_name": scenario_name,
+        "asymmetry_level": asymmetry_level,
+        "ground_truth": ground_truth,
+        "transcript": transcript,
+        "persona_section": persona_section,
+        # Rendiamo disponibili queste informazioni anche nei dettagli di output
+        "extra_persona_info": {
+            "agent2_persona_raw": agent2_persona_raw,
+            "agent2_persona_parsed": agent2_persona_parsed,
+            "agent2_profile_name": agent2_profile_name,
+        },
+    }
+    if transcript_trimming is not None:
+        conv["transcript_trimming"] = transcript_trimming
+    if transcript_turns is not None:
+        conv["transcript_turns"] = transcript_turns
+    # impronta per riconoscere le conversazioni duplicate (vedi `dedup`)
+    conv["fingerprint"] = conversation_fingerprint(conv)
+    return conv
+
+
+def prepare_log_record(log_file: str, logs_dir: str, index: int,
+                       transcript_options: TranscriptOptions | None = None) -> dict:
+    """Legge e prepara un log in un record compatto pronto per il giudice.
+
+    Il record contiene `log_file`, `log_hash`, `messages` e `conv` (None se
+    il log va saltato). Gira anche in un processo separato.
+    """
+    log_path = Path(log_file)
+    log_data, log_hash, messages = read_log(log_path)
+    conv = None
+    if log_data is not None:
+        try:
+            conv = prepare_conversation(log_data, log_path, Path(logs_dir), index, transcript_options)
+            conv['log_hash'] = log_hash
+        except Exception as e:
+            messages.append(f"[yellow]Errore preparando {log_file}: {e} - salto file[/yellow]")
+            conv = None
+    return {"log_file": str(log_file), "log_hash": log_hash, "conv": conv, "messages": messages}
+
+
+def find_log_files(logs_dir: Path) -> list[Path]:
+    """File di log sotto `logs_dir` (`.json` e `.jsonl`), in ordine: la posizione determina il Sim_ID."""
+    return sorted(path for suffix in LOG_SUFFIXES for path in Path(logs_dir).rglob(f"*{suffix}"))
+
+
+def is_multi_conversation(log_file: Path) -> bool:
+    """True per i `.jsonl` e per i `.json` il cui primo carattere significativo è `[`."""
+    if log_file.suffix == ".jsonl":
+        return True
+    try:
+        with open(log_file, "rb") as f:
+            head = f.read(4096)
+            while head:
+                head = head.removeprefix(_BOM).lstrip()
+                if head:
+                    return head[:1] == b"["
+                head = f.read(4096)
+    except OSError:
+        # l'errore viene segnalato dalla lettura normale del file
+        pass
+    return False
+
+
+def iter_conversation_spans(log_file: Path) -> Iterator[tuple[int, int]]:
+    """Intervalli di byte `(inizio, fine)` delle conversazioni di un file multi-conversazione, in ordine.
+
+    Il file è mappato in memoria: la memoria usata non dipende dalla sua
+    dimensione. Nei `.jsonl` ogni riga non vuota è una conversazione; nei
+    `.json` lo sono gli oggetti dell'array di primo livello, individuati
+    tenendo il conto delle parentesi fuori dalle stringhe.
+    """
+    with open(log_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            released = 0
+
+            def release(position: int) -> None:
+                # le pagine già scandite escono dalla memoria del processo (restano nella cache del sistema)
+                nonlocal released
+                if position - released >= _RELEASE_BYTES and hasattr(mmap, "MADV_DONTNEED"):
+                    upto = position - position % mmap.PAGESIZE
+                    mm.madvise(mmap.MADV_DONTNEED, released, upto - released)
+                    released = upto
+
+            if log_file.suffix == ".jsonl":
+                position, size = 0, len(mm)
+                while position < size:
+                    end = mm.find(b"\n", position)
+                    end = size if end == -1 else end
+                    if mm[position:end].strip():
+                        yield position, end
+                    position = end + 1
+                    release(position)
+                return
+            depth = 0
+            start = -1
+            for match in _ARRAY_TOKEN_RE.finditer(mm):
+                token = mm[match.start(1)]
+                if token in b"[{":
+                    depth += 1
+                    if depth == 2 and token == 0x7B:
+                        start = match.start(1)
+                else:
+                    depth -= 1
+                    if depth == 1 and start != -1:
+                        yield start, match.end()
+                        start = -1
+                        release(match.end())
+                    elif depth <= 0:
+                        return
+            if start != -1:
+                # array troncato: l'ultima conversazione incompleta viene segnalata dal worker
+                yield start, len(mm)
+
+
+def prepare_span_record(log_file: str, start: int, end: int, sub_index: int, logs_dir: str, index: int,
+                        transcript_options: TranscriptOptions | None = None) -> dict:
+    """Come `prepare_log_record()`, per la conversazione `sub_index` di un file multi-conversazione.
+
+    Legge solo i byte `[start, end)` del file; `log_hash` è l'hash di quei byte.
+    """
+    log_path = Path(log_file)
+    reference = f"{log_file}#{sub_index}"
+    messages: list[str] = []
+    log_hash = ""
+    conv = None
+    try:
+        with open(log_path, "rb") as f:
+            f.seek(start)
+            raw = f.read(end - start).strip()
+        log_hash = hashlib.sha256(raw).hexdigest()
+        log_data = _loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        messages.append(f"[yellow]JSON non valido nella conversazione, salto: {reference}[/yellow]")
+        log_data = None
+    except Exception as e:
+        messages.append(f"[yellow]Errore leggendo {reference}: {e} - salto conversazione[/yellow]")
+        log_data = None
+    if log_data is not None and not (isinstance(log_data, dict) and any(k in log_data for k in _LOG_KEYS)):
+        messages.append(f"[yellow]L'elemento non è un log di conversazione, salto: {reference}[/yellow]")
+        log_data = None
+    if log_data is not None:
+        if not log_data.get("conversation"):
+            log_data["conversation"] = []
+        try:
+            conv = prepare_conversation(log_data, log_path, Path(logs_dir), index, transcript_options, sub_index)
+            conv['log_hash'] = log_hash
+        except Exception as e:
+            messages.append(f"[yellow]Errore preparando {reference}: {e} - salto conversazione[/yellow]")
+    return {"log_file": reference, "log_hash": log_hash, "conv": conv, "messages": messages}
+
+
+def _ignore_sigint() -> None:
+    # Ctrl+C lo gestisce il processo principale, che poi chiude il pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def prepare_payload_record(payload: bytes, name: str = "request", profile: str | None = None, index: int = 0,
+                           transcript_options: TranscriptOptions | None = None) -> dict:
+    """Come `prepare_log_record()`, per un log ricevuto in memoria (es. dal servizio HTTP).
+
+    `payload` è il contenuto di un file di log oppure direttamente la lista
+    dei turni, in uno qualunque degli schemi di `format_transcript()`.
+    `name` e `profile` prendono il posto di nome del file e cartella: da
+    `name` si ricavano scenario, approccio e asimmetria come per i file.
+    """
+    log_file = Path(profile, f"{name}.json") if profile else Path(f"{name}.json")
+    log_hash = hashlib.sha256(payload).hexdigest()
+    messages: list[str] = []
+    conv = None
+    try:
+        log_data = _loads(payload)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        log_data = None
+        messages.append(f"JSON non valido: {e}")
+    if isinstance(log_data, list):
+        log_data = {"conversation": log_data}
+    elif log_data is not None and not isinstance(log_data, dict):
+        log_data = None
+        messages.append("il corpo deve essere un oggetto di log o una lista di turni")
+    if log_data is not None:
+        if not log_data.get("conversation"):
+            log_data["conversation"] = []
+        try:
+            conv = prepare_conversation(log_data, log_file, Path(), index, transcript_options)
+            conv['log_hash'] = log_hash
+        except Exception as e:
+            messages.append(f"Errore preparando la conversazione: {e}")
+    return {"log_file": str(log_file), "log_hash": log_hash, "conv": conv, "messages": messages}
+
+
+class IngestPipeline:
+    """Prepara i log in un pool di processi, con un numero limitato di record in anticipo.
+
+    `iter_records()` restituisce, nell'ordine dei file, tuple
+    `(indice, file, fetch)` dove `fetch()` attende e ritorna il record: chi
+    consuma (il thread del log nel motore di valutazione) si blocca solo sul
+    proprio record, mentre il pool continua a preparare i successivi. Con
+    `workers=0` la preparazione avviene direttamente nel thread consumatore.
+
+    I file multi-conversazione producono un record per conversazione, con
+    file `<file>#k` e lo stesso indice; `extra_records` conta i record in più
+    (o in meno, per i file senza conversazioni) rispetto ai file ricevuti.
+    """
+
+    def __init__(self, logs_dir: Path, workers: int | None = None, prefetch: int = 32,
+                 transcript_options: TranscriptOptions | None = None):
+        """Pipeline su `logs_dir` con `workers` processi (0 per leggere nel processo corrente)."""
+        self.logs_dir = Path(logs_dir)
+        self.transcript_options = transcript_options
+        self.workers = (os.cpu_count() or 1) if workers is None else max(0, int(workers))
+        self.prefetch = max(1, int(prefetch))
+        self._pool = (ProcessPoolExecutor(max_workers=self.workers, initializer=_ignore_sigint)
+                      if self.workers > 0 else None)
+        self.extra_records = 0
+
+    def _jobs(self, log_files: Iterable[Path], indices: Iterable[int] | None) -> Iterator[tuple[int, Path, tuple]]:
+        """`(indice, file o <file>#k, (funzione, argomenti...))` per ogni record da preparare."""
+        for i, log_file in (enumerate(log_files) if indices is None else zip(indices, log_files)):
+            if not is_multi_conversation(log_file):
+                yield i, log_file, (prepare_log_record, str(log_file), str(self.logs_dir), i, self.transcript_options)
+                continue
+            self.extra_records -= 1
+            for k, (start, end) in enumerate(iter_conversation_spans(log_file)):
+                self.extra_records += 1
+                yield i, Path(f"{log_file}#{k}"), (prepare_span_record, str(log_file), start, end, k,
+                                                   str(self.logs_dir), i, self.transcript_options)
+
+    def iter_records(self, log_files: Iterable[Path],
+                     indices: Iterable[int] | None = None) -> Iterator[tuple[int, Path, Callable[[], dict]]]:
+        """`indices` sono gli indici dei log nell'elenco completo (da cui il `Sim_ID`), di default 0, 1, 2, ..."""
+        pending: deque[tuple[int, Path, Callable[[], dict]]] = deque()
+        for i, log_file, job in self._jobs(log_files, indices):
+            if self._pool is None:
+                yield i, log_file, functools.partial(*job)
+                continue
+            future = self._pool.submit(*job)
+            pending.append((i, log_file, future.result))
+            if len(pending) >= self.prefetch:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def close(self, cancel: bool = False) -> None:
+        """Chiude il pool di processi, annullando i lavori in coda con `cancel`."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=not cancel, cancel_futures=cancel)
+
+    def __enter__(self) -> "IngestPipeline":
+        """Ritorna la pipeline stessa."""
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Chiude la pipeline, annullando i lavori in coda se è in corso un'eccezione."""
+        self.close(cancel=exc_type is not None)
@@ -0,0 +1,327 @@
+"""Strumentazione di un'esecuzione: latenze, dimensioni, ritentativi, tempi per fase.
+
+`RunMetrics` raccoglie, in modo thread-safe e con costo trascurabile:
+
+- latenza di ogni chiamata al giudice (istogramma per metrica e modello),
+  dimensioni di prompt e risposte, chiamate fallite;
+- tempo speso nelle fasi locali (`stage()`: ingest, valutazione, scrittura);
+- contatori liberi (`add()`), ad es. ritentativi, fallback allo stub, secondi
+  di attesa imposti da limitatore, backoff e circuit breaker.
+
+A fine esecuzione `write()` salva `run_report.json` e un file di testo nel
+formato del textfile collector di Prometheus (`run_metrics.prom`).
+
+`Profiler` avvolge il percorso caldo locale con cProfile: ogni thread che
+entra in `active()` viene profilato e alla fine le statistiche sono unite in
+un unico file pstats. Su Python 3.12+ cProfile è globale al processo: il
+primo profiler attivo copre già tutti i thread e gli altri non si attivano.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from pathlib import Path
+
+# Limiti superiori (secondi) dei bucket dell'istogramma di latenza, come in Prometheus
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+REPORT_NAME = "run_report.json"
+PROMETHEUS_NAME = "run_metrics.prom"
+PROFILE_NAME = "profile.pstats"
+_PREFIX = "valut"
+
+
+class _CallStats:
+    __slots__ = ("calls", "failed", "seconds", "max_seconds", "prompt_bytes", "response_bytes", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.prompt_bytes = 0
+        self.response_bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def quantile(self, q: float) -> float:
+        """Quantile stimato per interpolazione lineare dentro il bucket."""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(self.buckets):
+            upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max_seconds
+            if count and seen + count >= rank:
+                return round(min(lower + (upper - lower) * (rank - seen) / count, self.max_seconds), 4)
+            seen += count
+            lower = upper
+        return round(self.max_seconds, 4)
+
+
+def _prom_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _prom_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+
+class RunMetrics:
+    """Metriche di un'esecuzione di `valut.py`."""
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        """Metriche vuote; `clock` misura le durate."""
+        self._clock = clock
+        self._start = clock()
+        self.started_at = datetime.now(UTC)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calls: dict[tuple[str, str], _CallStats] = {}
+        self._stages: dict[str, list[float]] = {}
+        self._counters: dict[str, dict[tuple[str, str] | None, float]] = {}
+
+    # --- chiamate al giudice ---
+
+    @contextmanager
+    def label(self, label: str) -> Iterator[None]:
+        """Etichetta (metrica o `batch:<gruppo>`) delle chiamate fatte da questo thread."""
+        previous = getattr(self._local, "label", None)
+        self._local.label = label
+        try:
+            yield
+        finally:
+            self._local.label = previous
+
+    def observe_call(self, model: str, seconds: float, prompt_bytes: int, response_bytes: int = 0,
+                     ok: bool = True) -> None:
+        """Registra durata, byte e esito di una chiamata al giudice."""
+        key = (getattr(self._local, "label", None) or "unlabelled", model)
+        bucket = next((i for i, upper in enumerate(LATENCY_BUCKETS) if seconds <= upper), len(LATENCY_BUCKETS))
+        with self._lock:
+            stats = self._calls.get(key)
+            if stats is None:
+                stats = self._calls[key] = _CallStats()
+            stats.calls += 1
+            stats.failed += not ok
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.prompt_bytes += prompt_bytes
+            stats.response_bytes += response_bytes
+            stats.buckets[bucket] += 1
+
+    # --- fasi locali e contatori ---
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Misura il tempo trascorso nel blocco sotto la fase `name`."""
+        start = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - start
+            with self._lock:
+                entry = self._stages.setdefault(name, [0.0, 0])
+                entry[0] += elapsed
+                entry[1] += 1
+
+    def add(self, name: str, value: float = 1, **label: str) -> None:
+        """Incrementa un contatore, con al più un'etichetta (es. `reason="backoff"`)."""
+        if len(label) > 1:
+            raise ValueError("i contatori hanno al più un'etichetta")
+        key = next(iter(label.items())) if label else None
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def counter(self, name: str, **label: str) -> float:
+        """Valore del contatore `name` con l'eventuale etichetta."""
+        key = next(iter(label.items())) if label else None
+        with self._lock:
+            return self._counters.get(name, {}).get(key, 0)
+
+    @property
+    def elapsed(self) -> float:
+        """Secondi trascorsi dalla creazione."""
+        return self._clock() - self._start
+
+    # --- report ---
+
+    def to_dict(self) -> dict:
+        """Istantanea serializzabile di chiamate, fasi e contatori."""
+        wall = self.elapsed
+        with self._lock:
+            calls = [
+                {
+                    "metric": label,
+                    "model": model,
+                    "calls": s.calls,
+                    "failed": s.failed,
+                    "latency_seconds": {
+                        "total": round(s.seconds, 4),
+                        "mean": round(s.seconds / s.calls, 4) if s.calls else 0.0,
+                        "p50": s.quantile(0.5),
+                        "p95": s.quantile(0.95),
+                        "max": round(s.max_seconds, 4),
+                        "buckets": dict(zip([*map(str, LATENCY_BUCKETS), "+Inf"], s.buckets)),
+                    },
+                    "prompt_bytes": s.prompt_bytes,
+                    "response_bytes": s.response_bytes,
+                    "avg_prompt_bytes": round(s.prompt_bytes / s.calls) if s.calls else 0,
+                    "avg_response_bytes": round(s.response_bytes / s.calls) if s.calls else 0,
+                }
+                for (label, model), s in sorted(self._calls.items())
+            ]
+            stages = {name: {"seconds": round(sec, 4), "count": count} for name, (sec, count) in self._stages.items()}
+            counters = {
+                name: series[None] if list(series) == [None]
+                else {k[1] if k else "": round(v, 4) for k, v in series.items()}
+                for name, series in self._counters.items()
+            }
+        total_calls = sum(c["calls"] for c in calls)
+        call_seconds = sum(c["latency_seconds"]["total"] for c in calls)
+        logs_done = self.counter("logs", status="evaluated")
+        sleeps = counters.get("sleep_seconds", {})
+        return {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(UTC).isoformat(),
+            "wall_seconds": round(wall, 3),
+            "throughput": {
+                "logs_per_second": round(logs_done / wall, 3) if wall else 0.0,
+                "calls_per_second": round(total_calls / wall, 3) if wall else 0.0,
+            },
+            "judge": {
+                "calls": total_calls,
+                "failed": sum(c["failed"] for c in calls),
+                "call_seconds": round(call_seconds, 3),
+                "prompt_bytes": sum(c["prompt_bytes"] for c in calls),
+                "response_bytes": sum(c["response_bytes"] for c in calls),
+            },
+            # tempo cumulato nei thread: chiamate utili contro attese (limitatore, backoff, breaker)
+            "time_split": {
+                "judge_call_seconds": round(call_seconds, 3),
+                "sleep_seconds": round(sum(sleeps.values()) if isinstance(sleeps, dict) else sleeps, 3),
+            },
+            "stages": stages,
+            "counters": counters,
+            "calls": calls,
+        }
+
+    def to_prometheus(self) -> str:
+        """Metriche nel formato testuale di Prometheus (textfile collector)."""
+        lines: list[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {_PREFIX}_{name} {kind}")
+
+        with self._lock:
+            calls = sorted(self._calls.items())
+            stages = sorted(self._stages.items())
+            counters = sorted((name, sorted(series.items(), key=lambda kv: kv[0] or ("", "")))
+                              for name, series in self._counters.items())
+
+        family("judge_call_duration_seconds", "histogram", "Latenza delle chiamate al giudice (tentativi inclusi).")
+        for (label, model), s in calls:
+            labels = {"metric": label, "model": model}
+            cumulative = 0
+            for upper, count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], s.buckets):
+                cumulative += count
+                lines.append(f"{_PREFIX}_judge_call_duration_seconds_bucket{_prom_labels(labels | {'le': upper})} "
+                             f"{cumulative}")
+            lines.append(f"{_PREFIX}_judge_call_duration_seconds_sum{_prom_labels(labels)} {s.seconds:.6f}")
+            lines.append(f"{_PREFIX}_judge_call_duration_seconds_count{_prom_labels(labels)} {s.calls}")
+        for name, attr, help_text in (("judge_call_failures_total", "failed", "Chiamate al giudice fallite."),
+                                      ("judge_prompt_bytes_total", "prompt_bytes",
+                                       "Byte dei prompt inviati al giudice."),
+                                      ("judge_response_bytes_total", "response_bytes",
+                                       "Byte delle risposte del giudice.")):
+            family(name, "counter", help_text)
+            for (label, model), s in calls:
+                lines.append(f"{_PREFIX}_{name}{_prom_labels({'metric': label, 'model': model})} {getattr(s, attr)}")
+
+        family("stage_seconds_total", "counter", "Tempo cumulato per fase locale.")
+        for name, (seconds, _) in stages:
+            lines.append(f"{_PREFIX}_stage_seconds_total{_prom_labels({'stage': name})} {seconds:.6f}")
+        for name, series in counters:
+            family(f"{name}_total", "counter", f"Contatore '{name}'.")
+            for key, value in series:
+                lines.append(f"{_PREFIX}_{name}_total{_prom_labels(dict([key]) if key else {})} {_prom_value(value)}")
+
+        family("run_duration_seconds", "gauge", "Durata dell'esecuzione.")
+        lines.append(f"{_PREFIX}_run_duration_seconds {self.elapsed:.3f}")
+        family("run_last_completion_timestamp_seconds", "gauge", "Fine dell'ultima esecuzione (epoch).")
+        lines.append(f"{_PREFIX}_run_last_completion_timestamp_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_dir: Path) -> tuple[Path, Path]:
+        """Scrive `run_report.json` e `run_metrics.prom` (in modo atomico, per il textfile collector)."""
+        output_dir = Path(output_dir)
+        report_path = output_dir / REPORT_NAME
+        prom_path = output_dir / PROMETHEUS_NAME
+        for path, text in ((report_path, json.dumps(self.to_dict(), ensure_ascii=False, indent=2)),
+                           (prom_path, self.to_prometheus())):
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        return report_path, prom_path
+
+
+class Profiler:
+    """cProfile sui thread del percorso caldo locale, uniti in un unico pstats."""
+
+    def __init__(self, enabled: bool = False):
+        """Profiler inattivo se `enabled` è falso."""
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles: list[cProfile.Profile] = []
+
+    @contextmanager
+    def active(self) -> Iterator[None]:
+        """Profila il blocco nel thread corrente (i blocchi annidati usano lo stesso profilo)."""
+        if not self.enabled or getattr(self._local, "profile", None) is not None:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: un altro profiler è già attivo e copre anche questo thread
+            yield
+            return
+        self._local.profile = profile
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._local.profile = None
+            with self._lock:
+                self._profiles.append(profile)
+
+    def dump(self, path: Path, limit: int = 40) -> str | None:
+        """Salva le statistiche in `path` (pstats) e ritorna il riepilogo per tempo cumulato e proprio."""
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(str(path))
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(limit)
+        # per tempo proprio: le attese (sleep, lock) in cima, subito sotto il lavoro locale vero e proprio
+        stats.sort_stats("tottime").print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,345 @@
+"""Pool di giudici: instrada le chiamate su più endpoint (modello, chiave, backend).
+
+Con un solo modello e una sola chiave il throughput è limitato dalla quota
+di quella chiave. `JudgePool` espone la stessa interfaccia di un modello
+(`model_name`, `generate_content()`), quindi retry, cache e metriche di
+`valut.py` restano invariati, ma ogni chiamata viene assegnata a uno degli
+endpoint configurati:
+
+- `least_loaded`: l'endpoint che può partire subito (quota disponibile) con
+  meno chiamate in volo in rapporto al peso;
+- `weighted`: round-robin pesato "smooth" (come nginx) tra gli endpoint
+  disponibili.
+
+Ogni endpoint ha le proprie quote (`rpm`, `tpm`, `max_in_flight`) e uno
+stato di salute: dopo `failure_threshold` errori consecutivi (o un 429 con
+`Retry-After`) viene escluso per `cooldown` secondi, un errore irreversibile
+(modello inesistente, chiave non valida) lo disattiva. Una chiamata fallita
+passa subito all'endpoint successivo; solo quando li ha provati tutti
+l'errore risale alla politica di retry.
+
+Backend disponibili: `gemini` (API REST `generateContent` con una chiave
+per endpoint), `ollama` (server locale compatibile con `POST /api/generate`)
+e `genai` (client `google.generativeai` del processo, una sola chiave). I
+backend HTTP usano solo la libreria standard.
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections.abc import Callable
+from typing import Any
+
+from .concurrency import RateLimiter, estimate_tokens
+from .retry import FATAL, MALFORMED, RATE_LIMITED, REJECTED, MalformedResponseError, classify_error, retry_after
+
+STRATEGIES = ("least_loaded", "weighted")
+BACKENDS = ("gemini", "genai", "ollama")
+DEFAULT_OLLAMA_HOST = "http://localhost:11434"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+
+class BackendHTTPError(RuntimeError):
+    """Risposta HTTP di errore di un backend; `code` e `headers` come nei client ufficiali (vedi `classify_error`)."""
+
+    def __init__(self, code: int, message: str, headers: dict | None = None):
+        """Errore HTTP `code` con gli header della risposta (es. `Retry-After`)."""
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.headers = headers or {}
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _post_json(url: str, payload: dict, headers: dict | None = None, timeout: float = 120.0) -> dict:
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json", **(headers or {})})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+    except urllib.error.HTTPError as e:
+        detail = e.read().decode("utf-8", "replace")[:300]
+        raise BackendHTTPError(e.code, detail or str(e.reason), dict(e.headers or {})) from None
+    except urllib.error.URLError as e:
+        # server non raggiungibile: errore di disponibilità, non irreversibile
+        raise ConnectionError(f"{url}: {e.reason}") from None
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise MalformedResponseError(f"risposta non JSON da {url}: {body[:200]!r}") from None
+
+
+def _temperature(generation_config: Any, default: float) -> float:
+    """Temperatura richiesta per una singola chiamata (dict o GenerationConfig), altrimenti quella del modello."""
+    if generation_config is None:
+        return default
+    if isinstance(generation_config, dict):
+        return float(generation_config.get("temperature", default))
+    return float(getattr(generation_config, "temperature", default))
+
+
+class OllamaModel:
+    """Backend locale compatibile con l'API HTTP di Ollama (`POST /api/generate`, output JSON)."""
+
+    def __init__(self, model_name: str, host: str = DEFAULT_OLLAMA_HOST, temperature: float = 0.0,
+                 timeout: float = 120.0):
+        """Modello `model_name` servito da Ollama su `host`."""
+        self.model_name = model_name
+        # OLLAMA_HOST può essere indicato senza schema (es. "127.0.0.1:11434")
+        self.host = (host if "://" in host else f"http://{host}").rstrip("/")
+        self.temperature = temperature
+        self.timeout = timeout
+
+    def generate_content(self, prompt: str, generation_config: Any = None) -> _Response:
+        """Genera una risposta JSON con `/api/generate`."""
+        data = _post_json(f"{self.host}/api/generate",
+                          {"model": self.model_name, "prompt": prompt, "stream": False, "format": "json",
+                           "options": {"temperature": _temperature(generation_config, self.temperature)}},
+                          timeout=self.timeout)
+        if data.get("error"):
+            raise BackendHTTPError(500, str(data["error"]))
+        return _Response(data.get("response", ""))
+
+
+class GeminiRestModel:
+    """Gemini tramite l'API REST `generateContent`, con una chiave propria (più chiavi nello stesso processo)."""
+
+    def __init__(self, model_name: str, api_key: str, base_url: str | None = None, temperature: float = 0.0,
+                 timeout: float = 120.0):
+        """Modello Gemini `model_name` chiamato via REST con `api_key`."""
+        self.model_name = model_name
+        self._api_key = api_key
+        self.base_url = (base_url or GEMINI_BASE_URL).rstrip("/")
+        self.temperature = temperature
+        self.timeout = timeout
+
+    def generate_content(self, prompt: str, generation_config: Any = None) -> _Response:
+        """Genera una risposta JSON con `generateContent`."""
+        model = self.model_name if self.model_name.startswith("models/") else f"models/{self.model_name}"
+        data = _post_json(f"{self.base_url}/{model}:generateContent",
+                          {"contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                           "generationConfig": {"temperature": _temperature(generation_config, self.temperature),
+                                                "responseMimeType": "application/json"}},
+                          headers={"x-goog-api-key": self._api_key}, timeout=self.timeout)
+        try:
+            parts = data["candidates"][0]["content"]["parts"]
+        except (KeyError, IndexError, TypeError):
+            raise MalformedResponseError(f"risposta senza candidati: {str(data)[:200]}") from None
+        return _Response("".join(part.get("text", "") for part in parts))
+
+
+class PoolEndpoint:
+    """Un endpoint del pool: modello, peso, quote e stato di salute (aggiornato dal pool)."""
+
+    def __init__(self, name: str, model: Any, weight: float = 1.0, max_in_flight: int = 0,
+                 requests_per_minute: float | None = None, tokens_per_minute: float | None = None):
+        """Endpoint `name` con peso, limite di chiamate in volo e limiti per minuto."""
+        if weight <= 0:
+            raise ValueError(f"endpoint '{name}': il peso deve essere positivo")
+        self.name = name
+        self.model = model
+        self.weight = float(weight)
+        self.max_in_flight = max(0, int(max_in_flight))
+        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.limiter = limiter if limiter.enabled else None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.disabled: str | None = None
+        self.calls = 0
+        self.errors = 0
+        self.latency_seconds = 0.0
+        self._current = 0.0  # stato del round-robin pesato
+
+    @property
+    def model_name(self) -> str:
+        """Nome del modello servito dall'endpoint."""
+        return getattr(self.model, "model_name", "") or self.name
+
+    def stats(self) -> dict:
+        """Contatori dell'endpoint."""
+        return {
+            "name": self.name,
+            "model": self.model_name,
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_latency_seconds": round(self.latency_seconds / self.calls, 4) if self.calls else 0.0,
+            "peak_in_flight": self.peak_in_flight,
+            "ejections": self.ejections,
+            "disabled": self.disabled,
+            "quota_wait_seconds": round(self.limiter.waited_seconds, 3) if self.limiter else 0.0,
+        }
+
+
+class JudgePool:
+    """Modello composto che distribuisce le chiamate sugli endpoint e passa al successivo se uno fallisce."""
+
+    def __init__(self, endpoints: list[PoolEndpoint], strategy: str = "least_loaded", failure_threshold: int = 3,
+                 cooldown: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        """Pool su `endpoints` con la strategia di scelta `strategy`."""
+        if not endpoints:
+            raise ValueError("il pool del giudice non ha endpoint")
+        names = [ep.name for ep in endpoints]
+        if len(set(names)) != len(names):
+            raise ValueError("i nomi degli endpoint del pool devono essere unici")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategia del pool sconosciuta: '{strategy}' (disponibili: {', '.join(STRATEGIES)})")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = max(0.0, float(cooldown))
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._fatal_error: BaseException | None = None
+        self.failovers = 0
+        # stesso insieme di modelli, stessa chiave di cache, qualunque endpoint risponda
+        self.model_name = "pool:" + "+".join(sorted({ep.model_name for ep in self.endpoints}))
+
+    def _choose(self, free: list[PoolEndpoint], tokens: int) -> PoolEndpoint:
+        if self.strategy == "weighted":
+            total = sum(ep.weight for ep in free)
+            for ep in free:
+                ep._current += ep.weight
+            chosen = max(free, key=lambda ep: ep._current)
+            chosen._current -= total
+            return chosen
+        # least_loaded: prima chi non deve attendere la propria quota, poi il carico relativo al peso
+        return min(free, key=lambda ep: (ep.limiter.wait_estimate(tokens) if ep.limiter else 0.0,
+                                         (ep.in_flight + 1) / ep.weight))
+
+    def _acquire(self, tokens: int, tried: set[str]) -> PoolEndpoint | None:
+        """Riserva un endpoint non ancora provato; None se non ne restano. Attende se sono tutti pieni."""
+        with self._cond:
+            while True:
+                live = [ep for ep in self.endpoints if ep.disabled is None and ep.name not in tried]
+                if not live:
+                    return None
+                now = self._clock()
+                # se sono tutti esclusi si riprova quello che rientra per primo
+                healthy = [ep for ep in live if ep.ejected_until <= now] or [min(live, key=lambda ep: ep.ejected_until)]
+                free = [ep for ep in healthy if not ep.max_in_flight or ep.in_flight < ep.max_in_flight]
+                if free:
+                    break
+                self._cond.wait(1.0)
+            endpoint = self._choose(free, tokens)
+            endpoint.in_flight += 1
+            endpoint.peak_in_flight = max(endpoint.peak_in_flight, endpoint.in_flight)
+            return endpoint
+
+    def _release(self, endpoint: PoolEndpoint, elapsed: float, error: BaseException | None) -> None:
+        kind = classify_error(error) if error is not None else None
+        with self._cond:
+            endpoint.in_flight -= 1
+            endpoint.calls += 1
+            endpoint.latency_seconds += elapsed
+            if error is None:
+                endpoint.failures = 0
+            else:
+                endpoint.errors += 1
+                if kind == FATAL:
+                    endpoint.disabled = str(error)
+                    self._fatal_error = error
+                elif kind not in (MALFORMED, REJECTED):
+                    endpoint.failures += 1
+                    hint = retry_after(error) if kind == RATE_LIMITED else None
+                    if hint or endpoint.failures >= self.failure_threshold:
+                        # dopo il cooldown basta un altro errore per escluderlo di nuovo
+                        endpoint.ejected_until = self._clock() + (hint or self.cooldown)
+                        endpoint.ejections += 1
+            self._cond.notify_all()
+
+    def generate_content(self, prompt: str, **kwargs: Any) -> Any:
+        """Esegue la chiamata su un endpoint; in caso di errore prova gli altri, poi solleva l'ultimo errore.
+
+        Gli argomenti aggiuntivi (es. `generation_config`) passano invariati al modello dell'endpoint.
+        """
+        tokens = estimate_tokens(prompt)
+        tried: set[str] = set()
+        last_error: BaseException | None = None
+        while True:
+            endpoint = self._acquire(tokens, tried)
+            if endpoint is None:
+                if last_error is None:
+                    # tutti gli endpoint sono stati disattivati da errori irreversibili
+                    raise self._fatal_error or RuntimeError("nessun endpoint disponibile nel pool del giudice")
+                raise last_error
+            if tried:
+                with self._cond:
+                    self.failovers += 1
+            tried.add(endpoint.name)
+            start = time.perf_counter()
+            try:
+                if endpoint.limiter is not None:
+                    endpoint.limiter.acquire(tokens)
+                response = endpoint.model.generate_content(prompt, **kwargs)
+            except Exception as e:
+                self._release(endpoint, time.perf_counter() - start, e)
+                last_error = e
+                continue
+            self._release(endpoint, time.perf_counter() - start, None)
+            if endpoint.limiter is not None:
+                endpoint.limiter.record_tokens(estimate_tokens(getattr(response, "text", "")))
+            return response
+
+    def stats(self) -> list[dict]:
+        """Contatori di ogni endpoint."""
+        with self._cond:
+            return [ep.stats() for ep in self.endpoints]
+
+    def summary(self) -> str:
+        """Riepilogo di una riga per endpoint."""
+        parts = []
+        for entry in self.stats():
+            state = f", disattivato: {entry['disabled'][:80]}" if entry["disabled"] else ""
+            parts.append(f"{entry['name']} {entry['calls']} chiamate ({entry['errors']} errori, "
+                         f"{entry['avg_latency_seconds'] * 1000:.0f} ms medi, max {entry['peak_in_flight']} in volo, "
+                         f"escluso {entry['ejections']} volte{state})")
+        return f"{self.failovers} passaggi a un altro endpoint; " + "; ".join(parts)
+
+
+def load_pool(config: dict, genai_factory: Callable[[str], Any] | None = None) -> JudgePool:
+    """Costruisce il pool dalla configurazione JSON (vedi `config/judge_pool.example.json`).
+
+    `genai_factory(model_name)` crea i modelli del backend `genai`. Le chiavi
+    dei backend `gemini` vengono lette dalle variabili d'ambiente indicate in
+    `api_key_env`, mai dal file.
+    """
+    if not isinstance(config, dict) or not isinstance(config.get("endpoints"), list):
+        raise ValueError("la configurazione del pool deve essere un oggetto con un array 'endpoints'")
+    endpoints = []
+    for n, spec in enumerate(config["endpoints"], start=1):
+        if not isinstance(spec, dict) or not spec.get("model"):
+            raise ValueError(f"endpoint {n}: manca 'model'")
+        backend = spec.get("backend", "gemini")
+        model_name = spec["model"]
+        name = spec.get("name") or f"{backend}:{model_name}#{n}"
+        timeout = float(spec.get("timeout", 120.0))
+        if backend == "ollama":
+            host = spec.get("host") or os.getenv("OLLAMA_HOST") or DEFAULT_OLLAMA_HOST
+            model = OllamaModel(model_name, host=host, timeout=timeout)
+        elif backend == "gemini":
+            key_env = spec.get("api_key_env", "GOOGLE_API_KEY")
+            api_key = os.getenv(key_env)
+            if not api_key:
+                raise ValueError(f"endpoint '{name}': variabile d'ambiente {key_env} non impostata")
+            model = GeminiRestModel(model_name, api_key.strip(), base_url=spec.get("base_url"), timeout=timeout)
+        elif backend == "genai":
+            if genai_factory is None:
+                raise ValueError(f"endpoint '{name}': backend 'genai' non disponibile")
+            model = genai_factory(model_name)
+        else:
+            raise ValueError(f"endpoint '{name}': backend sconosciuto '{backend}' (disponibili: {', '.join(BACKENDS)})")
+        endpoints.append(PoolEndpoint(name, model, weight=float(spec.get("weight", 1.0)),
+                                      max_in_flight=int(spec.get("max_in_flight", 0)),
+                                      requests_per_minute=spec.get("rpm"), tokens_per_minute=spec.get("tpm")))
+    return JudgePool(endpoints, strategy=config.get("strategy", "least_loaded"),
+                     failure_threshold=int(config.get("failure_threshold", 3)),
+                     cooldown=float(config.get("cooldown_seconds", 30.0)))
@@ -0,0 +1,263 @@
+"""Piano dei prompt precompilato per il giudice.
+
+Tutto ciò che non dipende dalla conversazione (system prompt serializzato,
+blocco di ogni metrica con i criteri già in JSON, tabelle di applicabilità
+per approccio) viene calcolato una sola volta all'avvio da
+`config_judge.json` e `config_metrics.json`. Per ogni conversazione si
+costruisce una volta il contesto (ground truth, trascrizione, persona) e
+ogni prompt è la semplice concatenazione contesto + blocco della metrica:
+system prompt e contesto formano un prefisso identico per tutte le metriche
+della conversazione, che può essere registrato nella cache di contesto del
+provider (vedi `evaluation.context_cache`).
+
+`PromptStats` registra dimensione in byte e token stimati di ogni richiesta,
+suddivisi per componente, per capire dove vanno i token di input.
+"""
+
+import json
+import threading
+from dataclasses import dataclass, field, replace
+
+from .consistency import SamplingSpec
+from .gating import Gate, gate_levels
+from .transcript import TranscriptOptions, refit_transcript
+
+# Il prompt utente storico era un f-string indentato: manteniamo gli stessi
+# byte così le risposte già in cache restano valide.
+_INDENT = " " * 16
+
+COMPONENTS = ("system", "ground_truth", "transcript", "persona", "metric", "template")
+
+
+def metric_applies(metric: dict, approach: str) -> bool:
+    """Applicabilità: default = "all". Se configurato diversamente, rispettalo."""
+    applicable = metric.get("applicable_to", "all")
+    if isinstance(applicable, str):
+        return (applicable.lower() == "all") or (applicable.upper() == approach)
+    if isinstance(applicable, list):
+        return ("all" in [a.lower() for a in applicable]) or (approach in applicable)
+    return False
+
+
+def _estimate_tokens(chars: int) -> int:
+    return chars // 4 + 1 if chars else 0
+
+
+@dataclass(frozen=True)
+class MetricPlan:
+    """Parti statiche del prompt di una metrica."""
+
+    index: int
+    name: str
+    metric: dict
+    batch_group: str
+    single_block: str
+    batch_block: str
+    relevance_keywords: tuple[str, ...] = ()
+    # autoconsistenza: None se la metrica usa una sola chiamata
+    sampling: SamplingSpec | None = None
+    # grafo condizionale: dipendenze, condizioni di salto e livello nel DAG
+    gate: Gate | None = None
+    level: int = 0
+
+
+@dataclass
+class ConversationContext:
+    """Parte del prompt specifica di una conversazione, costruita una sola volta."""
+
+    head: str
+    sizes: dict[str, int]
+    # varianti con finestre di rilevanza, per insieme di parole chiave
+    variants: dict[tuple[str, ...], "ConversationContext"] = field(default_factory=dict)
+    # report di riduzione della trascrizione, solo per le varianti
+    report: dict | None = None
+
+
+@dataclass
+class _Counter:
+    requests: int = 0
+    bytes: int = 0
+    chars: int = 0
+    components: dict[str, int] = field(default_factory=lambda: dict.fromkeys(COMPONENTS, 0))
+
+
+class PromptStats:
+    """Statistiche thread-safe sulle dimensioni dei prompt, per etichetta (metrica o batch)."""
+
+    def __init__(self):
+        """Contatori vuoti."""
+        self._lock = threading.Lock()
+        self._by_label: dict[str, _Counter] = {}
+
+    def record(self, label: str, prompt_bytes: int, prompt_chars: int, components: dict[str, int]) -> None:
+        """Registra dimensioni e componenti di un prompt con etichetta `label`."""
+        with self._lock:
+            counter = self._by_label.setdefault(label, _Counter())
+            counter.requests += 1
+            counter.bytes += prompt_bytes
+            counter.chars += prompt_chars
+            for name, chars in components.items():
+                counter.components[name] += chars
+
+    def to_dict(self) -> dict:
+        """Dimensioni medie e totali dei prompt per etichetta."""
+        with self._lock:
+            labels = {
+                label: {
+                    "requests": c.requests,
+                    "bytes": c.bytes,
+                    "avg_bytes": round(c.bytes / c.requests) if c.requests else 0,
+                    "est_tokens": _estimate_tokens(c.chars),
+                    "avg_est_tokens": round(_estimate_tokens(c.chars) / c.requests) if c.requests else 0,
+                    "components_est_tokens": {k: _estimate_tokens(v) for k, v in c.components.items()},
+                }
+                for label, c in self._by_label.items()
+            }
+        totals = dict.fromkeys(COMPONENTS, 0)
+        for entry in labels.values():
+            for k, v in entry["components_est_tokens"].items():
+                totals[k] += v
+        return {
+            "requests": sum(e["requests"] for e in labels.values()),
+            "bytes": sum(e["bytes"] for e in labels.values()),
+            "est_tokens": sum(e["est_tokens"] for e in labels.values()),
+            "components_est_tokens": totals,
+            "by_label": labels,
+        }
+
+
+class PromptPlan:
+    """Prompt precompilati per una coppia di configurazioni giudice/metriche."""
+
+    def __init__(self, judge_config: dict, metrics_config: list[dict],
+                 transcript_options: TranscriptOptions | None = None):
+        """Compila i prompt delle metriche e ne calcola i livelli del grafo condizionale."""
+        self.transcript_options = transcript_options
+        self.system_prompt = json.dumps(judge_config["system_prompt"], ensure_ascii=False)
+        metrics = [self._compile_metric(idx, metric) for idx, metric in enumerate(metrics_config)]
+        # livelli del grafo condizionale (ValueError per dipendenze sconosciute o cicliche)
+        levels = gate_levels({mp.name: mp.gate for mp in metrics})
+        self.metrics = [replace(mp, level=levels[mp.name]) for mp in metrics]
+        self.stats = PromptStats()
+        self._applicability: dict[str, tuple[MetricPlan, ...]] = {}
+        self._lock = threading.Lock()
+        for approach in ("A", "B"):
+            self.applicable(approach)
+
+    @staticmethod
+    def _compile_metric(idx: int, metric: dict) -> MetricPlan:
+        criteria = json.dumps(metric.get("scoring_criteria", {}), ensure_ascii=False, indent=2)
+        single_block = (
+            f"{_INDENT}**METRICA DA VALUTARE**\n"
+            f"{_INDENT}- Nome Metrica: \"{metric.get('metric_name', 'N/A')}\n"
+            f"{_INDENT}- Descrizione: {metric.get('description', 'N/A')}\n"
+            "\n"
+            f"{_INDENT}**CRITERI DI VALUTAZIONE**\n"
+            f"{_INDENT}{criteria}\n"
+            "\n"
+            f"{_INDENT}Per favore, valuta la conversazione SOLO in base alla metrica e ai criteri forniti.\n"
+            f"{_INDENT}"
+        )
+        batch_block = (
+            f"Nome Metrica: \"{metric.get('metric_name', 'N/A')}\"\n"
+            f"- Descrizione: {metric.get('description', 'N/A')}\n"
+            f"- Criteri di valutazione:\n{criteria}"
+        )
+        return MetricPlan(
+            index=idx,
+            name=metric.get("metric_name", "UNKNOWN_METRIC"),
+            metric=metric,
+            batch_group=str(metric.get("batch_group", "default")),
+            single_block=single_block,
+            batch_block=batch_block,
+            relevance_keywords=tuple(str(k) for k in metric.get("relevance_keywords", []) or []),
+            sampling=SamplingSpec.from_metric(metric),
+            gate=Gate.from_metric(metric),
+        )
+
+    def applicable(self, approach: str) -> tuple[MetricPlan, ...]:
+        """Metriche applicabili a un approccio (tabella calcolata una volta per approccio)."""
+        plans = self._applicability.get(approach)
+        if plans is None:
+            plans = tuple(mp for mp in self.metrics if metric_applies(mp.metric, approach))
+            with self._lock:
+                self._applicability[approach] = plans
+        return plans
+
+    def batch_groups(self, plans: list[MetricPlan]) -> list[list[MetricPlan]]:
+        """Raggruppa le metriche per `batch_group` (default: un unico gruppo), mantenendo l'ordine.
+
+        Le metriche campionate restano in un gruppo a sé: ogni campione è una chiamata singola.
+        """
+        groups: dict[object, list[MetricPlan]] = {}
+        for mp in plans:
+            groups.setdefault(mp.batch_group if mp.sampling is None else mp.index, []).append(mp)
+        return list(groups.values())
+
+    def context(self, conv: dict) -> ConversationContext:
+        """Costruisce la parte del prompt che dipende solo dalla conversazione."""
+        return self._build_context(conv["ground_truth"], conv["transcript"], conv["persona_section"])
+
+    @staticmethod
+    def _build_context(ground_truth: str, transcript: str, persona: str) -> ConversationContext:
+        head = (
+            "\n"
+            f"{_INDENT}**CONTESTO DELLA CONVERSAZIONE**\n"
+            f"{_INDENT}- Ground Truth (Obiettivi Segreti Agente B): {ground_truth}\n"
+            f"{_INDENT}- Trascrizione Completa:\n{transcript}\n"
+            f"{_INDENT}{persona}\n"
+            "\n"
+        )
+        sizes = {"ground_truth": len(ground_truth), "transcript": len(transcript), "persona": len(persona)}
+        return ConversationContext(head=head, sizes=sizes)
+
+    def shared_prefix(self, ctx: ConversationContext) -> str:
+        """Inizio comune a tutti i prompt costruiti su `ctx` (system prompt e contesto), per la cache di contesto."""
+        return f"{self.system_prompt}\n\n{ctx.head}"
+
+    def metric_context(self, ctx: ConversationContext, conv: dict, mp: MetricPlan) -> ConversationContext:
+        """Contesto con la finestra di rilevanza della metrica, se configurata; altrimenti `ctx`.
+
+        Richiede la strategia `relevance` e i turni formattati in `conv["transcript_turns"]`.
+        """
+        turns = conv.get("transcript_turns")
+        if not mp.relevance_keywords or turns is None or self.transcript_options is None:
+            return ctx
+        variant = ctx.variants.get(mp.relevance_keywords)
+        if variant is None:
+            transcript, report = refit_transcript(turns, self.transcript_options, mp.relevance_keywords)
+            variant = self._build_context(conv["ground_truth"], transcript, conv["persona_section"])
+            variant.report = report
+            ctx.variants[mp.relevance_keywords] = variant
+        return variant
+
+    def _record(self, label: str, user_prompt: str, ctx: ConversationContext, metric_chars: int) -> None:
+        full_chars = len(self.system_prompt) + 2 + len(user_prompt)
+        full_bytes = len(self.system_prompt.encode("utf-8")) + 2 + len(user_prompt.encode("utf-8"))
+        components = dict(ctx.sizes)
+        components["system"] = len(self.system_prompt)
+        components["metric"] = metric_chars
+        components["template"] = full_chars - sum(components.values())
+        self.stats.record(label, full_bytes, full_chars, components)
+
+    def single_prompt(self, ctx: ConversationContext, mp: MetricPlan) -> str:
+        """Prompt utente per una singola metrica."""
+        user_prompt = ctx.head + mp.single_block
+        self._record(mp.name, user_prompt, ctx, len(mp.single_block))
+        return user_prompt
+
+    def batch_prompt(self, ctx: ConversationContext, plans: list[MetricPlan]) -> str:
+        """Prompt utente che chiede di valutare più metriche in una sola risposta JSON."""
+        blocks = "\n\n".join(f"### {n}. {mp.batch_block}" for n, mp in enumerate(plans, start=1))
+        names = ", ".join(f'"{mp.metric.get("metric_name", "N/A")}"' for mp in plans)
+        user_prompt = (
+            ctx.head
+            + f"{_INDENT}**METRICHE DA VALUTARE**\n"
+            + blocks
+            + "\n\n**FORMATO DELLA RISPOSTA**\n"
+            f"Rispondi con un unico oggetto JSON le cui chiavi sono esattamente i nomi delle metriche ({names}). "
+            "Il valore di ogni chiave deve essere un oggetto con le chiavi 'Score' e 'Justification'.\n"
+            "Valuta ogni metrica in modo indipendente, SOLO in base alla sua descrizione e ai suoi criteri.\n"
+        )
+        self._record(f"batch:{plans[0].batch_group}", user_prompt, ctx, len(blocks))
+        return user_prompt
@@ -0,0 +1,400 @@
+"""Politica di retry per le chiamate al giudice.
+
+- Backoff esponenziale con jitter tra un tentativo e l'altro.
+- Per i rate limit (429) e i servizi non disponibili (503) si rispetta il
+  `Retry-After` suggerito dal server, quando presente.
+- Un circuit breaker per modello sospende il traffico dopo troppi errori
+  consecutivi invece di continuare a martellare un endpoint che fallisce:
+  le chiamate attendono il `cooldown` e poi una sola richiesta di prova
+  decide se riaprire il traffico.
+- Gli errori irreversibili (modello inesistente, permessi, chiave non
+  valida) sollevano `FatalJudgeError`: è il chiamante a decidere se
+  interrompere l'esecuzione o passare esplicitamente a un fallback.
+- Le richieste rifiutate (400, `invalid_argument`: prompt troppo grande o
+  bloccato) non vengono ripetute e sollevano `RequestRejectedError`: fallisce
+  solo quella richiesta, non l'esecuzione.
+
+Senza stato HTTP l'errore viene classificato dal testo, con parole e codici
+interi (`1404 ms` non è un 404) e controllando prima i rate limit e gli errori
+temporanei, poi quelli irreversibili.
+"""
+
+import email.utils
+import json
+import random
+import re
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+# Classi di errore
+RATE_LIMITED = "rate_limited"
+UNAVAILABLE = "unavailable"
+MALFORMED = "malformed"
+FATAL = "fatal"
+REJECTED = "rejected"
+TRANSIENT = "transient"
+
+_STATUS_KINDS = {
+    429: RATE_LIMITED,
+    408: UNAVAILABLE, 500: UNAVAILABLE, 502: UNAVAILABLE, 503: UNAVAILABLE, 504: UNAVAILABLE,
+    400: REJECTED, 401: FATAL, 403: FATAL, 404: FATAL, 405: FATAL, 501: FATAL,
+}
+# Credenziali non valide: Google risponde 400 INVALID_ARGUMENT anche per una chiave sbagliata
+_INVALID_KEY_RE = re.compile(r"\bapi[ _]key not valid\b|\bunauthenticated\b")
+# Ripiego sul testo dell'errore per i client che non espongono lo stato HTTP, nell'ordine in cui
+# vengono provati: solo parole e codici interi, così un numero qualunque non diventa uno stato HTTP.
+_MESSAGE_KINDS = (
+    (RATE_LIMITED, re.compile(r"\bresource[_ ]exhausted\b|\bquota\b|\brate[ -]limit|\btoo many requests\b"
+                              r"|\b429\b")),
+    (UNAVAILABLE, re.compile(r"\bunavailable\b|\bdeadline\b|\btimed out\b|\btimeout\b|\bconnection\b"
+                             r"|\binternal error\b|\b50[0234]\b")),
+    (FATAL, re.compile(r"\bnot found\b|\bnot supported\b|\bpermission[_ ]denied\b|\bapi[ _]key not valid\b"
+                       r"|\bunauthenticated\b|\b40[134]\b")),
+    (REJECTED, re.compile(r"\binvalid[_ ]argument\b|\b400\b")),
+)
+_RETRY_IN_RE = re.compile(r"retry (?:in|after)\s*([\d.]+)\s*s", re.IGNORECASE)
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE)
+
+
+class JudgeError(RuntimeError):
+    """Errore di una chiamata al giudice dopo l'applicazione della politica di retry."""
+
+    def __init__(self, message: str, model_name: str, cause: BaseException | None = None):
+        """Errore del modello `model_name` causato da `cause`."""
+        super().__init__(message)
+        self.model_name = model_name
+        self.cause = cause
+
+
+class FatalJudgeError(JudgeError):
+    """Errore irreversibile: ripetere la chiamata non serve."""
+
+
+class CircuitOpenError(JudgeError):
+    """Il circuit breaker si è aperto troppe volte di seguito: l'endpoint sembra irraggiungibile."""
+
+
+class RetriesExhaustedError(JudgeError):
+    """Tutti i tentativi sono falliti con errori temporanei."""
+
+    def __init__(self, message: str, model_name: str, cause: BaseException | None, kind: str, attempts: int):
+        """Errore di tipo `kind` dopo `attempts` tentativi."""
+        super().__init__(message, model_name, cause)
+        self.kind = kind
+        self.attempts = attempts
+
+
+class RequestRejectedError(RetriesExhaustedError):
+    """Il modello ha rifiutato la richiesta (400): ripeterla non serve, ma l'errore riguarda solo questa."""
+
+
+class MalformedResponseError(ValueError):
+    """Il giudice ha risposto, ma non con un oggetto JSON valido (classe `MALFORMED`)."""
+
+
+def _status_code(exc: BaseException) -> int | None:
+    for candidate in (getattr(exc, "status_code", None), getattr(exc, "code", None), getattr(exc, "status", None),
+                      getattr(getattr(exc, "response", None), "status_code", None)):
+        if isinstance(candidate, int) and not isinstance(candidate, bool):
+            return candidate
+        value = getattr(candidate, "value", None)  # enum (es. http.HTTPStatus)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def classify_error(exc: BaseException) -> str:
+    """Classifica un'eccezione in una delle classi di errore del modulo."""
+    status = _status_code(exc)
+    message = str(exc).lower()
+    if status in _STATUS_KINDS:
+        kind = _STATUS_KINDS[status]
+        if kind == REJECTED and _INVALID_KEY_RE.search(message):
+            return FATAL
+        return kind
+    if isinstance(exc, (MalformedResponseError, json.JSONDecodeError)):
+        # il giudice ha risposto, ma non con un oggetto JSON valido: il testo della risposta non va classificato
+        return MALFORMED
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return UNAVAILABLE
+    for kind, pattern in _MESSAGE_KINDS:
+        if pattern.search(message):
+            return kind
+    return TRANSIENT
+
+
+def _seconds(value: Any) -> float | None:
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if hasattr(value, "seconds"):  # es. protobuf Duration
+        return float(value.seconds) + float(getattr(value, "nanos", 0)) / 1e9
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(text)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=UTC)
+    return (when - datetime.now(UTC)).total_seconds()
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """Attesa suggerita dal server (header `Retry-After`, attributi o testo dell'errore), se presente."""
+    for attr in ("retry_after", "retry_delay"):
+        seconds = _seconds(getattr(exc, attr, None))
+        if seconds is not None:
+            return max(0.0, seconds)
+    headers = getattr(getattr(exc, "response", None), "headers", None) or getattr(exc, "headers", None)
+    if headers:
+        try:
+            seconds = _seconds(headers.get("Retry-After") or headers.get("retry-after"))
+        except Exception:
+            seconds = None
+        if seconds is not None:
+            return max(0.0, seconds)
+    message = str(exc)
+    match = _RETRY_IN_RE.search(message) or _RETRY_DELAY_RE.search(message)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Numero di tentativi e ritardi tra un tentativo e l'altro."""
+
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    multiplier: float = 2.0
+    # frazione del ritardo resa casuale (1.0 = "full jitter", 0 = nessun jitter)
+    jitter: float = 1.0
+    # limite superiore al Retry-After del server
+    max_retry_after: float = 300.0
+
+    def __post_init__(self):
+        """Valida tentativi e jitter."""
+        if self.max_attempts < 1:
+            raise ValueError("max_attempts deve essere almeno 1")
+        if not 0.0 <= self.jitter <= 1.0:
+            raise ValueError("jitter deve essere compreso tra 0 e 1")
+
+    def delay(self, attempt: int, kind: str, server_hint: float | None, rng: random.Random) -> float:
+        """Attesa prima del tentativo `attempt + 1` (attempt parte da 0)."""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        delay = delay * (1 - self.jitter) + rng.uniform(0, delay * self.jitter)
+        if server_hint is not None and kind in (RATE_LIMITED, UNAVAILABLE):
+            delay = max(delay, min(server_hint, self.max_retry_after))
+        return delay
+
+
+class CircuitBreaker:
+    """Circuit breaker thread-safe per un singolo modello.
+
+    Dopo `failure_threshold` errori consecutivi il circuito si apre e
+    `before_call()` blocca i chiamanti per `cooldown` secondi; poi passa
+    una sola chiamata di prova (half-open): se riesce il circuito si chiude,
+    altrimenti si riapre. Dopo `max_trips` aperture consecutive senza
+    nessuna chiamata riuscita `before_call()` solleva `CircuitOpenError`
+    invece di attendere ancora (0 = attende indefinitamente).
+    `failure_threshold=0` disattiva il breaker.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown: float = 30.0, max_trips: int = 10,
+                 clock: Callable[[], float] = time.monotonic):
+        """Interruttore del modello `name`, aperto dopo `failure_threshold` errori consecutivi."""
+        self.name = name
+        self.failure_threshold = max(0, int(failure_threshold))
+        self.cooldown = max(0.0, float(cooldown))
+        self.max_trips = max(0, int(max_trips))
+        self._trips = 0
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.times_opened = 0
+        self.paused_seconds = 0.0
+
+    @property
+    def state(self) -> str:
+        """Stato corrente: `closed`, `open` o `half_open`."""
+        return self._state
+
+    def before_call(self) -> float:
+        """Attende finché il circuito lascia passare la chiamata. Ritorna i secondi di attesa."""
+        if not self.failure_threshold:
+            return 0.0
+        start = self._clock()
+        with self._cond:
+            while True:
+                if self._state == "closed":
+                    break
+                if self.max_trips and self._trips >= self.max_trips:
+                    raise CircuitOpenError(f"circuit breaker del modello '{self.name}' aperto {self._trips} volte "
+                                           f"di seguito: endpoint non raggiungibile", self.name)
+                if self._state == "open":
+                    remaining = self._opened_at + self.cooldown - self._clock()
+                    if remaining <= 0:
+                        self._state = "half_open"
+                        self._probing = False
+                        continue
+                    self._cond.wait(remaining)
+                    continue
+                # half-open: passa una sola chiamata di prova alla volta
+                if not self._probing:
+                    self._probing = True
+                    break
+                self._cond.wait(self.cooldown or 1.0)
+            waited = self._clock() - start
+            self.paused_seconds += waited
+        return waited
+
+    def release_probe(self) -> None:
+        """Libera la chiamata di prova interrotta senza un esito (es. KeyboardInterrupt)."""
+        with self._cond:
+            if self._probing:
+                self._probing = False
+                self._cond.notify_all()
+
+    def record_success(self) -> None:
+        """Chiude l'interruttore e azzera gli errori."""
+        with self._cond:
+            self._failures = 0
+            self._trips = 0
+            self._probing = False
+            if self._state != "closed":
+                self._state = "closed"
+                self._cond.notify_all()
+
+    def record_failure(self) -> None:
+        """Conta un errore, aprendo l'interruttore oltre la soglia."""
+        if not self.failure_threshold:
+            return
+        with self._cond:
+            self._failures += 1
+            self._probing = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self.times_opened += 1
+                    self._trips += 1
+                self._state = "open"
+                self._opened_at = self._clock()
+                self._cond.notify_all()
+
+
+class JudgeRetrier:
+    """Esegue le chiamate al giudice applicando `RetryPolicy` e un circuit breaker per modello."""
+
+    def __init__(self, policy: RetryPolicy | None = None, failure_threshold: int = 5, cooldown: float = 30.0,
+                 max_trips: int = 10, seed: int | None = None, sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic):
+        """Ritentativi secondo `policy` con un interruttore per modello."""
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self._sleep = sleep
+        self._clock = clock
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self.errors: dict[str, int] = {}
+
+    def breaker(self, model_name: str) -> CircuitBreaker:
+        """Interruttore del modello, creato al primo uso."""
+        with self._lock:
+            breaker = self._breakers.get(model_name)
+            if breaker is None:
+                breaker = CircuitBreaker(model_name, self.failure_threshold, self.cooldown, self.max_trips,
+                                         clock=self._clock)
+                self._breakers[model_name] = breaker
+            return breaker
+
+    def call(self, model_name: str, fn: Callable[[], Any],
+             on_retry: Callable[[int, str, BaseException, float], None] | None = None) -> Any:
+        """Esegue `fn()` fino a `max_attempts` volte.
+
+        Solleva `FatalJudgeError` per gli errori irreversibili (anche quando il
+        circuit breaker supera `max_trips`), `RequestRejectedError` al primo
+        rifiuto della richiesta e `RetriesExhaustedError` se tutti i tentativi
+        falliscono.
+        `on_retry(tentativo, classe, errore, attesa)` viene chiamata prima di ogni attesa.
+        """
+        breaker = self.breaker(model_name)
+        attempts = self.policy.max_attempts
+        for attempt in range(attempts):
+            try:
+                breaker.before_call()
+            except CircuitOpenError as e:
+                raise FatalJudgeError(str(e), model_name, e) from e
+            settled = False
+            try:
+                result = fn()
+                settled = True
+            except Exception as e:
+                settled = True
+                kind = classify_error(e)
+                with self._lock:
+                    self.errors[kind] = self.errors.get(kind, 0) + 1
+                if kind == FATAL:
+                    breaker.record_success()  # l'endpoint risponde: non è un problema di disponibilità
+                    raise FatalJudgeError(f"errore irreversibile dal modello '{model_name}': {e}", model_name, e) from e
+                if kind == REJECTED:
+                    breaker.record_success()
+                    raise RequestRejectedError(f"richiesta rifiutata dal modello '{model_name}': {e}", model_name, e,
+                                               kind, attempt + 1) from e
+                if kind == MALFORMED:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise RetriesExhaustedError(f"{attempts} tentativi falliti per il modello '{model_name}': {e}",
+                                                model_name, e, kind, attempts) from e
+                with self._lock:
+                    delay = self.policy.delay(attempt, kind, retry_after(e), self._rng)
+                    self.retries += 1
+                    self.backoff_seconds += delay
+                if on_retry is not None:
+                    on_retry(attempt, kind, e, delay)
+                if delay > 0:
+                    self._sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+            finally:
+                if not settled:
+                    # interruzione (KeyboardInterrupt, SystemExit) durante la chiamata: la prova non resta occupata
+                    breaker.release_probe()
+        raise AssertionError("unreachable")
+
+    @property
+    def breaker_paused_seconds(self) -> float:
+        """Secondi complessivi di pausa per interruttori aperti."""
+        with self._lock:
+            return sum(b.paused_seconds for b in self._breakers.values())
+
+    def summary(self) -> str:
+        """Riepilogo di una riga di ritentativi, errori e interruttori."""
+        errors = ", ".join(f"{kind} {count}" for kind, count in sorted(self.errors.items())) or "nessuno"
+        with self._lock:
+            breakers = list(self._breakers.values())
+        opened = sum(b.times_opened for b in breakers)
+        paused = sum(b.paused_seconds for b in breakers)
+        return (f"{self.retries} ritentativi, errori: {errors}; "
+                f"circuit breaker aperto {opened} volte ({paused:.1f}s di pausa)")
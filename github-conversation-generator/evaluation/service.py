@@ -0,0 +1,314 @@
+"""Servizio HTTP locale di valutazione, con micro-batch delle richieste.
+
+`python valut.py --serve [HOST:]PORT` espone lo stesso motore della CLI:
+
+- `POST /evaluate?name=<scenario>&profile=<profilo>`: il corpo è il
+  contenuto di un file di log (oggetto con `conversation` e `agents`) oppure
+  direttamente la lista dei turni, in uno qualunque degli schemi di
+  `format_transcript()`. `name` e `profile` (facoltativi) prendono il posto
+  di nome del file e cartella, da cui si ricavano Sim_ID e approccio.
+  Risponde con i punteggi per metrica, come nel CSV, e le valutazioni complete.
+- `GET /status`: richieste, errori, profondità della coda, micro-batch e
+  latenze (p50/p95/max) delle ultime richieste.
+- `GET /metrics`: metriche del giudice nel formato testuale di Prometheus.
+
+`MicroBatcher` raccoglie le richieste concorrenti: la prima apre una finestra
+di `window` secondi, chiusa prima se arrivano `max_batch` richieste, e il
+batch viene valutato in una volta sola. Nel batch le conversazioni identiche
+vengono valutate una volta; tutti i batch condividono limitatore, cache e
+pool del giudice del processo.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+from .ingest import prepare_payload_record
+from .transcript import TranscriptOptions
+
+MAX_BODY_BYTES = 32 * 1024 * 1024
+# latenze conservate per i quantili di /status
+LATENCY_WINDOW = 2048
+_NAME_RE = re.compile(r"^[\w.-]{1,200}$")
+
+
+class PayloadError(ValueError):
+    """Richiesta non valutabile (corpo non valido, parametri errati): risposta HTTP 400."""
+
+
+class MicroBatcher:
+    """Raggruppa gli elementi inviati da più thread e li passa a `process` a blocchi.
+
+    `process(items)` ritorna un risultato per elemento, nello stesso ordine.
+    Fino a `concurrency` batch possono essere in elaborazione insieme: mentre
+    uno attende il giudice, le nuove richieste formano il successivo.
+    """
+
+    def __init__(self, process: Callable[[list], list], window: float = 0.02, max_batch: int = 16,
+                 concurrency: int = 4):
+        """Raccoglie le richieste per `window` secondi (al più `max_batch`) e le passa a `process`."""
+        self._process = process
+        self.window = max(0.0, float(window))
+        self.max_batch = max(1, int(max_batch))
+        self._queue: deque[tuple[Any, Future, float]] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(concurrency)), thread_name_prefix="microbatch")
+        self.batches = 0
+        self.items = 0
+        self.max_queue_depth = 0
+        self.largest_batch = 0
+        self._thread = threading.Thread(target=self._run, name="microbatcher", daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Richieste in attesa di un batch."""
+        with self._cond:
+            return len(self._queue)
+
+    def submit(self, item: Any) -> Future:
+        """Accoda `item` e ritorna il Future del suo risultato."""
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("il servizio è in chiusura")
+            self._queue.append((item, future, time.monotonic()))
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self) -> list[tuple[Any, Future, float]] | None:
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            # la finestra parte dalla richiesta più vecchia in coda
+            deadline = self._queue[0][2] + self.window
+            while len(self._queue) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._pool.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: list[tuple[Any, Future, float]]) -> None:
+        try:
+            results = list(self._process([item for item, _, _ in batch]))
+        except BaseException as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            future.set_result((result, len(batch)))
+        if len(results) < len(batch):
+            # un risultato mancante non deve lasciare la richiesta in attesa per sempre
+            error = RuntimeError(f"il batch ha prodotto {len(results)} risultati per {len(batch)} richieste")
+            for _, future, _ in batch[len(results):]:
+                future.set_exception(error)
+
+    def close(self) -> None:
+        """Smette di accettare richieste, completa quelle in coda e ferma i thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+
+
+class EvaluationService:
+    """Prepara le richieste, le valuta a micro-batch e tiene le statistiche per /status.
+
+    `evaluate_batch(convs)` ritorna, per ogni conversazione preparata da
+    `prepare_payload_record()`, il dizionario della risposta.
+    """
+
+    def __init__(self, evaluate_batch: Callable[[list[dict]], list[dict]],
+                 transcript_options: TranscriptOptions | None = None, window: float = 0.02, max_batch: int = 16,
+                 concurrency: int = 4, metrics_text: Callable[[], str] | None = None,
+                 status_extra: Callable[[], dict] | None = None):
+        """Servizio che valuta i batch con `evaluate_batch`."""
+        self.transcript_options = transcript_options
+        self.metrics_text = metrics_text
+        self._status_extra = status_extra
+        self._batcher = MicroBatcher(self._evaluate_unique(evaluate_batch), window=window, max_batch=max_batch,
+                                     concurrency=concurrency)
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.requests = 0
+        self.errors: dict[str, int] = {}
+        self.in_flight = 0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    @staticmethod
+    def _evaluate_unique(evaluate_batch: Callable[[list[dict]], list[dict]]) -> Callable[[list[dict]], list[dict]]:
+        def process(convs: list[dict]) -> list[dict]:
+            # richieste identiche nello stesso batch (stesso contenuto e stesso Sim_ID) valutate una volta
+            unique: dict[tuple, dict] = {}
+            for conv in convs:
+                unique.setdefault((conv["log_hash"], conv["sim_id"], conv["profile"]), conv)
+            results = dict(zip(unique, evaluate_batch(list(unique.values()))))
+            return [results[(conv["log_hash"], conv["sim_id"], conv["profile"])] for conv in convs]
+        return process
+
+    def _record_error(self, kind: str) -> None:
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def evaluate(self, payload: bytes, name: str | None = None, profile: str | None = None) -> dict:
+        """Valuta un log ricevuto in memoria; `PayloadError` se la richiesta non è valutabile."""
+        start = time.perf_counter()
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+        try:
+            for value in (name, profile):
+                if value is not None and not _NAME_RE.match(value):
+                    raise PayloadError(f"nome non valido: {value!r} (ammessi lettere, cifre, '_', '-', '.')")
+            # indice fisso: il Sim_ID dipende solo da `name`, così richieste identiche coincidono
+            record = prepare_payload_record(payload, name or "request", profile, 0, self.transcript_options)
+            if record["conv"] is None:
+                raise PayloadError("; ".join(record["messages"]) or "conversazione non valida")
+            result, batch_size = self._batcher.submit(record["conv"]).result()
+        except PayloadError:
+            self._record_error("invalid_request")
+            raise
+        except Exception:
+            self._record_error("evaluation")
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._latencies.append(elapsed)
+        return {**result, "batch_size": batch_size, "latency_seconds": round(elapsed, 4)}
+
+    def status(self) -> dict:
+        """Contatori, latenze e micro-batch per `/status`."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            status = {
+                "uptime_seconds": round(time.time() - self._started, 1),
+                "requests": self.requests,
+                "errors": dict(self.errors),
+                "in_flight": self.in_flight,
+            }
+
+        def quantile(q: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 4) if latencies else 0.0
+
+        batcher = self._batcher
+        status["queue"] = {"depth": batcher.queue_depth, "max_depth": batcher.max_queue_depth}
+        status["micro_batches"] = {
+            "batches": batcher.batches,
+            "avg_size": round(batcher.items / batcher.batches, 2) if batcher.batches else 0.0,
+            "max_size": batcher.largest_batch,
+            "window_ms": round(batcher.window * 1000, 1),
+            "max_batch": batcher.max_batch,
+        }
+        status["latency_seconds"] = {"samples": len(latencies), "p50": quantile(0.5), "p95": quantile(0.95),
+                                     "max": round(latencies[-1], 4) if latencies else 0.0}
+        if self._status_extra is not None:
+            status.update(self._status_extra())
+        return status
+
+    def close(self) -> None:
+        """Completa le richieste in coda e ferma il micro-batcher."""
+        self._batcher.close()
+
+
+def _make_handler(service: EvaluationService) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "valut-service/1.0"
+
+        def _send(self, code: int, body: str, content_type: str = "application/json; charset=utf-8") -> None:
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, code: int, obj: Any) -> None:
+            self._send(code, json.dumps(obj, ensure_ascii=False))
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == "/status":
+                self._send_json(200, service.status())
+            elif path == "/metrics" and service.metrics_text is not None:
+                self._send(200, service.metrics_text(), "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                self._send_json(404, {"error": f"percorso sconosciuto: {path}"})
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != "/evaluate":
+                self._send_json(404, {"error": f"percorso sconosciuto: {url.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", ""))
+            except ValueError:
+                self._send_json(411, {"error": "Content-Length mancante o non valido"})
+                return
+            if length < 0:
+                self._send_json(400, {"error": f"Content-Length non valido: {length}"})
+                return
+            if length > MAX_BODY_BYTES:
+                self._send_json(413, {"error": f"corpo troppo grande (massimo {MAX_BODY_BYTES} byte)"})
+                return
+            body = self.rfile.read(length)
+            query = parse_qs(url.query)
+            try:
+                result = service.evaluate(body, (query.get("name") or [None])[0], (query.get("profile") or [None])[0])
+            except PayloadError as e:
+                self._send_json(400, {"error": str(e)})
+            except Exception as e:
+                self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            else:
+                self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            # le richieste sono contate in /status: niente log di accesso sullo stderr
+            pass
+
+    return Handler
+
+
+def make_server(service: EvaluationService, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    """Server HTTP (un thread per connessione) per `service`; con `port=0` la porta è scelta dal sistema."""
+    server = ThreadingHTTPServer((host, port), _make_handler(service))
+    server.daemon_threads = True
+    return server
+
+
+def parse_address(value: str) -> tuple[str, int]:
+    """`PORT` o `HOST:PORT` (default host 127.0.0.1)."""
+    host, _, port = value.rpartition(":")
+    try:
+        port_number = int(port)
+    except ValueError:
+        raise ValueError(f"indirizzo non valido: '{value}' (atteso PORT o HOST:PORT)") from None
+    if not 0 <= port_number <= 65535:
+        raise ValueError(f"porta non valida: {port_number}")
+    return host.strip("[]") or "127.0.0.1", port_number
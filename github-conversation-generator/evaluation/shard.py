@@ -0,0 +1,213 @@
+"""Suddivisione di un corpus tra più macchine e unione dei risultati.
+
+Con `--shard i/N` ogni macchina valuta solo i log per cui l'hash stabile
+del percorso relativo (rispetto alla cartella di input) cade nella partizione
+`i`: aggiungere o togliere log non sposta gli altri da uno shard all'altro.
+Il `Sim_ID` resta quello dell'indice nell'elenco ordinato completo dei log,
+quindi è lo stesso qualunque shard abbia valutato la conversazione. Fanno
+eccezione i log aggiunti durante `--watch`, che ricevono Sim_ID in append.
+
+`merge_shards` unisce le cartelle di output degli shard (`results_summary.csv`,
+`details/`, file riepilogativo dei dettagli) in un unico insieme di risultati,
+ordinato per `Sim_ID`, con un solo passaggio in streaming: ogni shard scrive i
+risultati nell'ordine dei log e gli input vengono fusi con un merge a k vie.
+"""
+
+import csv
+import hashlib
+import heapq
+import json
+import os
+import re
+import shutil
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack
+from dataclasses import dataclass
+from pathlib import Path
+
+from .sink import iter_detail_records, write_details
+
+MANIFEST_NAME = "shard.json"
+_SIM_INDEX_RE = re.compile(r"^Sim_(\d+)_")
+
+
+@dataclass(frozen=True)
+class ShardSpec:
+    """Partizione `index` (da 1) di `count`."""
+
+    index: int
+    count: int
+
+    def __post_init__(self):
+        """Valida indice e numero di shard."""
+        if self.count < 1 or not 1 <= self.index <= self.count:
+            raise ValueError(f"shard non valido: {self.index}/{self.count} (atteso i/N con 1 <= i <= N)")
+
+    @classmethod
+    def parse(cls, value: str) -> "ShardSpec":
+        """Shard da una stringa `i/N` (ValueError se non valida)."""
+        try:
+            index, count = (int(part) for part in value.split("/"))
+        except ValueError:
+            raise ValueError(f"shard non valido: '{value}' (atteso i/N, es. 2/4)") from None
+        return cls(index, count)
+
+    def __str__(self) -> str:
+        """Forma `i/N`."""
+        return f"{self.index}/{self.count}"
+
+    def owns(self, relative_path: str) -> bool:
+        """Vero se il log `relative_path` appartiene a questo shard."""
+        return shard_of(relative_path, self.count) == self.index
+
+    def select(self, log_files: list[Path], logs_dir: Path) -> list[tuple[int, Path]]:
+        """`(indice nell'elenco completo, file)` dei log di questo shard."""
+        return [(i, f) for i, f in enumerate(log_files) if self.owns(f.relative_to(logs_dir).as_posix())]
+
+
+def shard_of(relative_path: str, count: int) -> int:
+    """Shard (da 1) di un log: hash SHA-256 del percorso relativo in formato posix."""
+    digest = hashlib.sha256(relative_path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def write_manifest(output_dir: Path, shard: ShardSpec, total_logs: int, selected_logs: int,
+                   metric_names: list[str]) -> None:
+    """Scrive il manifest dello shard in `output_dir`."""
+    manifest = {"shard": str(shard), "total_logs": total_logs, "selected_logs": selected_logs, "metrics": metric_names}
+    with open(Path(output_dir) / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def read_manifest(shard_dir: Path) -> dict | None:
+    """Manifest dello shard in `shard_dir`, oppure None se manca."""
+    path = Path(shard_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def sim_index(sim_id: str) -> tuple[int, int]:
+    """Chiave d'ordine di un Sim_ID: indice del file e posizione della conversazione nel file (-1 se unica)."""
+    match = _SIM_INDEX_RE.match(sim_id or "")
+    if not match:
+        raise ValueError(f"Sim_ID non riconosciuto: '{sim_id}'")
+    # come in `log_key()`: solo un `#k` finale numerico indica la k-esima conversazione del file,
+    # un `#` nello scenario non conta
+    _, sep, sub = sim_id[match.end():].rpartition("#")
+    return int(match.group(1)), int(sub) if sep and sub.isdecimal() else -1
+
+
+def _ordered(items: Iterable, key, source: Path) -> Iterator[tuple[tuple[int, int], object]]:
+    """Etichetta gli elementi con `(indice Sim, elemento)` controllando che siano in ordine."""
+    previous = (-1, -1)
+    for item in items:
+        idx = key(item)
+        if idx < previous:
+            raise ValueError(f"'{source}' non è ordinato per Sim_ID: è stato scritto da valut.py?")
+        previous = idx
+        yield idx, item
+
+
+def _merge_last_wins(streams: list[Iterator[tuple[tuple[int, int], object]]]) -> Iterator[object]:
+    """Fonde flussi ordinati; a parità di Sim_ID vince l'ultimo shard indicato."""
+    tagged = [((idx, n, item) for idx, item in stream) for n, stream in enumerate(streams)]
+    pending = None
+    for idx, _, item in heapq.merge(*tagged, key=lambda entry: entry[:2]):
+        if pending is not None and pending[0] != idx:
+            yield pending[1]
+        pending = (idx, item)
+    if pending is not None:
+        yield pending[1]
+
+
+def _details_file(shard_dir: Path) -> Path | None:
+    for name in ("results_details.jsonl", "results_details.json"):
+        if (shard_dir / name).exists():
+            return shard_dir / name
+    return None
+
+
+def merge_shards(shard_dirs: list[Path], output_dir: Path, details_format: str = "json") -> dict:
+    """Unisce le cartelle di output degli shard in `output_dir`.
+
+    Ritorna un riepilogo con righe, dettagli e file copiati e gli eventuali
+    avvisi (shard mancanti, manifest incoerenti).
+    """
+    shard_dirs = [Path(d) for d in shard_dirs]
+    output_dir = Path(output_dir)
+    warnings: list[str] = []
+
+    manifests = [read_manifest(d) for d in shard_dirs]
+    counts = {m["shard"].split("/")[1] for m in manifests if m}
+    if len(counts) > 1:
+        raise ValueError(f"gli shard provengono da suddivisioni diverse (N = {', '.join(sorted(counts))})")
+    if counts:
+        count = int(counts.pop())
+        present = {int(m["shard"].split("/")[0]) for m in manifests if m}
+        missing = sorted(set(range(1, count + 1)) - present)
+        if missing:
+            warnings.append(f"shard mancanti: {', '.join(f'{i}/{count}' for i in missing)}")
+        totals = {m["total_logs"] for m in manifests if m}
+        if len(totals) > 1:
+            warnings.append("gli shard hanno visto corpus di dimensioni diverse "
+                            f"({', '.join(map(str, sorted(totals)))} log)")
+    for shard_dir, manifest in zip(shard_dirs, manifests):
+        if manifest is None:
+            warnings.append(f"'{shard_dir}' non contiene {MANIFEST_NAME}: non è stato eseguito con --shard?")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    details_dir = output_dir / "details"
+    details_dir.mkdir(parents=True, exist_ok=True)
+
+    # results_summary.csv: stesso header per tutti gli shard, righe fuse per Sim_ID
+    header = None
+    row_streams = []
+    with ExitStack() as csv_files:
+        for shard_dir in shard_dirs:
+            csv_path = shard_dir / "results_summary.csv"
+            if not csv_path.exists():
+                warnings.append(f"'{csv_path}' mancante")
+                continue
+            reader = csv.reader(csv_files.enter_context(open(csv_path, newline="", encoding="utf-8")))
+            shard_header = next(reader, None)
+            if shard_header is None:
+                continue
+            if header is None:
+                header = shard_header
+            elif shard_header != header:
+                raise ValueError(f"'{csv_path}' ha colonne diverse dagli altri shard (metriche diverse?)")
+            row_streams.append(_ordered(reader, lambda row: sim_index(row[0]), csv_path))
+
+        rows = 0
+        tmp_csv = output_dir / "results_summary.csv.tmp"
+        with open(tmp_csv, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out)
+            if header is not None:
+                writer.writerow(header)
+            for row in _merge_last_wins(row_streams):
+                writer.writerow(row)
+                rows += 1
+        os.replace(tmp_csv, output_dir / "results_summary.csv")
+
+    # file riepilogativo dei dettagli, nello stesso layout di valut.py
+    detail_streams = []
+    for shard_dir in shard_dirs:
+        source = _details_file(shard_dir)
+        if source is None:
+            warnings.append(f"'{shard_dir}' non contiene results_details.json(l)")
+            continue
+        detail_streams.append(_ordered(iter_detail_records(source), lambda item: sim_index(item.get("Sim_ID", "")),
+                                       source))
+    details_name = "results_details.jsonl" if details_format == "jsonl" else "results_details.json"
+    details = write_details(_merge_last_wins(detail_streams), output_dir / details_name, output_format=details_format)
+
+    # details/: un file per simulazione, gli shard successivi sovrascrivono i precedenti
+    copied = 0
+    for shard_dir in shard_dirs:
+        for path in sorted((shard_dir / "details").glob("*__details.json")):
+            shutil.copyfile(path, details_dir / path.name)
+            copied += 1
+
+    return {"rows": rows, "details": details, "detail_files": copied, "warnings": warnings}
@@ -0,0 +1,252 @@
+"""Scrittura in streaming dei dettagli di valutazione e compattazione.
+
+Invece di accumulare in memoria tutti i `detail_obj` e riscrivere alla fine
+`results_details.json`, ogni simulazione completata viene aggiunta come
+riga JSON compatta a un file JSONL. La compattazione (`compact_details`)
+deduplica poi per `log_file` (vince l'ultima occorrenza) leggendo i file
+in streaming: in memoria resta solo un indice chiave -> posizione.
+`compact_summary` fa lo stesso per Sim_ID sulle righe di `results_summary.csv`
+scritte in append (`--resume`, `--watch`).
+"""
+
+import csv
+import json
+import os
+import textwrap
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import IO, Any
+
+
+def detail_key(item: dict) -> str | None:
+    """Chiave di deduplicazione di un dettaglio: il file di log, in mancanza il Sim_ID."""
+    return item.get("log_file") or item.get("Sim_ID")
+
+
+class JsonlDetailsSink:
+    """Appende un dettaglio per riga, con fsync ogni `fsync_every` record."""
+
+    def __init__(self, path: Path, append: bool = True, fsync_every: int = 50):
+        """Apre `path` in append (o lo riscrive se `append` è falso)."""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync_every = max(0, int(fsync_every))
+        self.written = 0
+        self._unsynced = 0
+        self._file = open(self.path, "a" if append else "w", encoding="utf-8")  # noqa: SIM115 (chiuso da close())
+
+    def write(self, detail: dict) -> None:
+        """Scrive un dettaglio su una riga."""
+        self._file.write(json.dumps(detail, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self.written += 1
+        self._unsynced += 1
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        """Forza su disco le righe scritte."""
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        """Sincronizza e chiude il file (idempotente)."""
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+    def __enter__(self) -> "JsonlDetailsSink":
+        """Ritorna il sink stesso."""
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Chiude il sink."""
+        self.close()
+
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Itera gli elementi di un array JSON leggendo il file a blocchi.
+
+    La memoria occupata è proporzionale all'elemento più grande, non al file.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+
+    def fill(min_size: int) -> bool:
+        nonlocal buf, pos, eof
+        data = f.read(max(chunk_size, min_size))
+        if not data:
+            eof = True
+            return False
+        buf = buf[pos:] + data
+        pos = 0
+        return True
+
+    while True:
+        # salta spazi e separatori
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or not fill(chunk_size):
+                break
+        if pos >= len(buf):
+            if not started:
+                return
+            raise ValueError("array JSON non terminato")
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("il file non contiene un array JSON")
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # elemento spezzato tra due blocchi: leggiamo di più (crescita geometrica)
+            if not fill(len(buf) - pos):
+                raise
+            continue
+        # un numero potrebbe proseguire nel blocco successivo
+        if end == len(buf) and not isinstance(value, (dict, list)) and not eof and fill(chunk_size):
+            continue
+        pos = end
+        yield value
+
+
+def iter_detail_records(path: Path) -> Iterator[dict]:
+    """Itera i dettagli di un file `.jsonl` (uno per riga) o `.json` (array)."""
+    path = Path(path)
+    with open(path, encoding="utf-8") as f:
+        if path.suffix.lower() == ".jsonl":
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # riga troncata da un'interruzione: la ignoriamo
+                    continue
+        else:
+            yield from iter_json_array(f)
+
+
+def compact_details(sources: list[Path], dest: Path, output_format: str = "json",
+                    keep_position: bool = False) -> tuple[int, int]:
+    """Unisce e deduplica per `log_file` i dettagli di `sources` in `dest`.
+
+    A parità di chiave vince l'ultima occorrenza (i sorgenti successivi
+    sovrascrivono i precedenti). Il primo passaggio registra solo la
+    posizione vincente di ogni chiave, il secondo scrive i soli record
+    vincenti nell'ordine in cui compaiono. La scrittura è atomica (file temporaneo + replace).
+    Con `keep_position` il record vincente prende il posto della prima
+    occorrenza, come in `compact_summary`: serve quando i Sim_ID sono stabili
+    (log rivalutati con --resume o --watch) e tiene in memoria i soli record
+    ripetuti. Ritorna `(record letti, record scritti)`.
+    """
+    sources = [Path(p) for p in sources if Path(p).exists()]
+    winners: dict[str, tuple[int, int]] = {}
+    # con keep_position: ultima occorrenza delle chiavi ripetute
+    latest: dict[str, dict] = {}
+    read = 0
+    for source_idx, source in enumerate(sources):
+        for record_idx, item in enumerate(iter_detail_records(source)):
+            read += 1
+            key = detail_key(item) if isinstance(item, dict) else None
+            if key:
+                if keep_position and key in winners:
+                    latest[key] = item
+                winners[key] = (source_idx, record_idx)
+
+    def winning_records() -> Iterator[dict]:
+        replaced: set[str] = set()
+        for source_idx, source in enumerate(sources):
+            for record_idx, item in enumerate(iter_detail_records(source)):
+                key = detail_key(item) if isinstance(item, dict) else None
+                if not key or key in replaced:
+                    continue
+                if key in latest:
+                    replaced.add(key)
+                    yield latest.pop(key)
+                elif winners.get(key) == (source_idx, record_idx):
+                    yield item
+
+    return read, write_details(winning_records(), dest, output_format=output_format)
+
+
+def compact_summary(path: Path) -> tuple[int, int]:
+    """Deduplica per Sim_ID le righe di un `results_summary.csv` scritto in append.
+
+    A parità di Sim_ID vince l'ultima riga, scritta al posto della prima: i
+    Sim_ID restano nell'ordine delle prime valutazioni, come nell'archivio dei
+    risultati. Il primo passaggio tiene in memoria solo le righe ripetute; il
+    file viene riscritto (in modo atomico) solo se ce ne sono.
+    Ritorna `(righe lette, righe scritte)`, intestazione esclusa.
+    """
+    path = Path(path)
+    seen: set[str] = set()
+    latest: dict[str, list[str]] = {}
+    read = 0
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            read += 1
+            if row[0] in seen:
+                latest[row[0]] = row
+            seen.add(row[0])
+    if not latest:
+        return read, read
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    replaced: set[str] = set()
+    written = 0
+    with open(path, newline="", encoding="utf-8") as f, open(tmp_path, "w", newline="", encoding="utf-8") as out:
+        reader = csv.reader(f)
+        writer = csv.writer(out)
+        writer.writerow(next(reader))
+        for row in reader:
+            if not row or row[0] in replaced:
+                continue
+            if row[0] in latest:
+                replaced.add(row[0])
+                row = latest.pop(row[0])
+            writer.writerow(row)
+            written += 1
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+    return read, written
+
+
+def write_details(items: Iterable[dict], dest: Path, output_format: str = "json") -> int:
+    """Scrive i dettagli in `dest` (array JSON indentato o JSONL) in modo atomico. Ritorna quanti ne ha scritti."""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest.with_name(dest.name + ".tmp")
+    written = 0
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        if output_format == "json":
+            out.write("[")
+        for item in items:
+            if output_format == "json":
+                # stesso layout di json.dump(lista, indent=2)
+                out.write(",\n" if written else "\n")
+                out.write(textwrap.indent(json.dumps(item, ensure_ascii=False, indent=2), "  "))
+            else:
+                out.write(json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n")
+            written += 1
+        if output_format == "json":
+            out.write("\n]" if written else "]")
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, dest)
+    return written
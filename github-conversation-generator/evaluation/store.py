@@ -0,0 +1,251 @@
+"""Archivio dei risultati in un unico file SQLite, al posto dei file `details/`.
+
+Con `--results-store` ogni simulazione valutata finisce in `results.sqlite`
+(WAL) invece che in un file `details/<Sim_ID>__details.json`:
+
+- `sims`: una riga per simulazione (Sim_ID, log, approccio, profilo,
+  scenario, asimmetria, ground truth, trascrizione, persona, riduzione
+  della trascrizione, data), indicizzata per Sim_ID, approccio e profilo;
+- `evaluations`: una riga per (Sim_ID, metrica) con il valore scritto nel
+  CSV, il punteggio del giudice, la giustificazione, la risposta grezza e gli
+  altri campi della valutazione (`Samples`, `SkipReason`, ...), indicizzata
+  per metrica;
+- `meta`: l'header del CSV (ordine delle metriche).
+
+Le simulazioni vengono inserite a blocchi in un'unica transazione; i
+callback `on_commit` (la registrazione nel journal) partono solo dopo il
+commit, così una simulazione risulta completata solo quando è su disco. Una
+simulazione rivalutata con lo stesso Sim_ID sostituisce la precedente,
+mantenendone la posizione.
+
+`export_store()` (`python -m evaluation export`) rigenera da un archivio lo
+stesso layout dei file di `valut.py`: `results_summary.csv`, il file
+riepilogativo dei dettagli e `details/`.
+"""
+
+import csv
+import json
+import sqlite3
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
+from .sink import write_details
+
+STORE_NAME = "results.sqlite"
+# Campi della valutazione con una colonna propria; gli altri finiscono in `extra` (JSON)
+_EVALUATION_FIELDS = ("Score", "Justification", "RawResponse")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS sims (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    sim_id TEXT NOT NULL UNIQUE,
+    log_file TEXT,
+    approach TEXT,
+    profile TEXT,
+    scenario TEXT,
+    asymmetry TEXT,
+    ground_truth TEXT,
+    transcript TEXT,
+    persona TEXT,
+    transcript_trimming TEXT,
+    evaluated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS sims_approach_profile ON sims (approach, profile);
+CREATE INDEX IF NOT EXISTS sims_profile ON sims (profile);
+CREATE TABLE IF NOT EXISTS evaluations (
+    sim_id TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT,
+    score TEXT,
+    justification TEXT,
+    raw_response TEXT,
+    extra TEXT,
+    PRIMARY KEY (sim_id, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS evaluations_metric ON evaluations (metric, value);
+"""
+_SIM_COLUMNS = ("sim_id", "log_file", "approach", "profile", "scenario", "asymmetry", "ground_truth", "transcript",
+                "persona", "transcript_trimming", "evaluated_at")
+_UPSERT_SIM = (
+    f"INSERT INTO sims ({', '.join(_SIM_COLUMNS)}) VALUES ({', '.join('?' * len(_SIM_COLUMNS))})"
+    f" ON CONFLICT (sim_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in _SIM_COLUMNS[1:])}"
+)
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class ResultsStore:
+    """Archivio SQLite dei risultati, con inserimenti a blocchi di `batch_size` simulazioni.
+
+    Va usato da un solo thread (quello che scrive gli output). Senza `resume`
+    il contenuto esistente viene cancellato, come il CSV. Oltre che ogni
+    `batch_size` simulazioni, il blocco viene scritto se sono passati più di
+    `max_delay` secondi dal commit precedente e con `flush()`.
+    """
+
+    def __init__(self, path: Path, header: list[str] | None = None, resume: bool = False, batch_size: int = 200,
+                 max_delay: float = 5.0, clock: Callable[[], float] = time.monotonic):
+        """Apre (o crea) l'archivio in `path` e vi salva l'intestazione `header`."""
+        self.path = Path(path)
+        self.batch_size = max(1, int(batch_size))
+        self.max_delay = max_delay
+        self._clock = clock
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        with self._conn:
+            if not resume:
+                self._conn.execute("DELETE FROM evaluations")
+                self._conn.execute("DELETE FROM sims")
+            if header is not None:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('header', ?)", (_dumps(header),))
+        self._pending: list[tuple[list, dict]] = []
+        self._callbacks: list[Callable[[], None]] = []
+        self._last_commit = clock()
+        self.written = 0
+
+    def add(self, row: list, detail: dict, on_commit: Callable[[], None] | None = None) -> None:
+        """Accoda una simulazione: riga del CSV e oggetto di dettaglio come in `details/`."""
+        self._pending.append((row, detail))
+        if on_commit is not None:
+            self._callbacks.append(on_commit)
+        if len(self._pending) >= self.batch_size or self._clock() - self._last_commit >= self.max_delay:
+            self.flush()
+
+    def flush(self) -> None:
+        """Scrive in una transazione le simulazioni accodate, poi esegue i loro callback."""
+        if self._pending:
+            sims = []
+            evaluations = []
+            for row, detail in self._pending:
+                sim_id = detail["Sim_ID"]
+                trimming = detail.get("transcript_trimming")
+                sims.append((sim_id, detail.get("log_file"), row[1], row[2], row[3], row[4], detail.get("ground_truth"),
+                             detail.get("transcript"), _dumps(detail.get("agent2_persona")),
+                             None if trimming is None else _dumps(trimming), detail.get("evaluated_at")))
+                for position, (metric, evaluation) in enumerate(detail["evaluations"].items()):
+                    extra = {k: v for k, v in evaluation.items() if k not in _EVALUATION_FIELDS}
+                    evaluations.append((sim_id, metric, position,
+                                        row[5 + position] if 5 + position < len(row) else None,
+                                        _dumps(evaluation.get("Score")), evaluation.get("Justification"),
+                                        evaluation.get("RawResponse"), _dumps(extra) if extra else None))
+            with self._conn:
+                # una simulazione rivalutata (stesso Sim_ID) sostituisce la precedente ma ne conserva `seq`,
+                # così l'export resta nell'ordine dei Sim_ID
+                self._conn.executemany("DELETE FROM evaluations WHERE sim_id = ?", [(s[0],) for s in sims])
+                self._conn.executemany(_UPSERT_SIM, sims)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO evaluations (sim_id, metric, position, value, score, justification,"
+                    " raw_response, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", evaluations)
+            self.written += len(self._pending)
+            self._pending.clear()
+        self._last_commit = self._clock()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self) -> None:
+        """Scrive le righe in attesa e chiude la connessione (idempotente)."""
+        if self._conn is None:
+            return
+        self.flush()
+        self._conn.close()
+        self._conn = None
+
+    def __enter__(self) -> "ResultsStore":
+        """Ritorna l'archivio stesso."""
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Chiude l'archivio."""
+        self.close()
+
+
+def iter_store(path: Path) -> Iterator[tuple[list, dict]]:
+    """`(riga del CSV, dettaglio)` di ogni simulazione dell'archivio, nell'ordine di scrittura."""
+    conn = sqlite3.connect(f"file:{Path(path)}?mode=ro", uri=True)
+    try:
+        sims = conn.execute("SELECT sim_id, log_file, approach, profile, scenario, asymmetry, ground_truth, transcript,"
+                            " persona, transcript_trimming, evaluated_at FROM sims ORDER BY seq")
+        for (sim_id, log_file, approach, profile, scenario, asymmetry, ground_truth, transcript, persona, trimming,
+             evaluated_at) in sims:
+            row = [sim_id, approach, profile, scenario, asymmetry]
+            evaluations = {}
+            for metric, value, score, justification, raw_response, extra in conn.execute(
+                    "SELECT metric, value, score, justification, raw_response, extra FROM evaluations"
+                    " WHERE sim_id = ? ORDER BY position", (sim_id,)):
+                row.append(value)
+                evaluation = {"Score": json.loads(score), "Justification": justification, "RawResponse": raw_response}
+                if extra:
+                    evaluation.update(json.loads(extra))
+                evaluations[metric] = evaluation
+            detail = {
+                "Sim_ID": sim_id,
+                "log_file": log_file,
+                "evaluations": evaluations,
+                "ground_truth": ground_truth,
+                "transcript": transcript,
+                "agent2_persona": json.loads(persona) if persona else None,
+                "evaluated_at": evaluated_at,
+            }
+            if trimming is not None:
+                detail["transcript_trimming"] = json.loads(trimming)
+            yield row, detail
+    finally:
+        conn.close()
+
+
+def store_header(path: Path) -> list[str]:
+    """Intestazione del CSV salvata nell'archivio `path`."""
+    conn = sqlite3.connect(f"file:{Path(path)}?mode=ro", uri=True)
+    try:
+        entry = conn.execute("SELECT value FROM meta WHERE key = 'header'").fetchone()
+    finally:
+        conn.close()
+    if entry is None:
+        raise ValueError(f"'{path}' non contiene l'header dei risultati: non è un archivio di valut.py?")
+    return json.loads(entry[0])
+
+
+def export_store(path: Path, output_dir: Path, details_format: str = "json", details_files: bool = True) -> dict:
+    """Rigenera da un archivio `results_summary.csv`, il file dei dettagli e (con `details_files`) `details/`.
+
+    Ritorna il numero di righe, dettagli e file scritti.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise ValueError(f"archivio '{path}' non trovato")
+    header = store_header(path)
+    output_dir = Path(output_dir)
+    details_dir = output_dir / "details"
+    if details_files:
+        details_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    files = 0
+
+    def details() -> Iterator[dict]:
+        nonlocal rows, files
+        with open(output_dir / "results_summary.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row, detail in iter_store(path):
+                writer.writerow(row)
+                rows += 1
+                if details_files:
+                    with open(details_dir / f"{detail['Sim_ID']}__details.json", "w", encoding="utf-8") as df:
+                        json.dump(detail, df, ensure_ascii=False, indent=2)
+                    files += 1
+                yield detail
+
+    details_name = "results_details.jsonl" if details_format == "jsonl" else "results_details.json"
+    written = write_details(details(), output_dir / details_name, output_format=details_format)
+    return {"rows": rows, "details": written, "detail_files": files}
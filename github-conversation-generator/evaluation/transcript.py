@@ -0,0 +1,219 @@
+"""Costruzione della trascrizione con un budget di token.
+
+Per le simulazioni molto lunghe la trascrizione completa può superare il
+contesto del giudice o costare molto più del necessario. Qui i turni
+vengono formattati come in `format_transcript` e poi ridotti con strategie
+configurabili:
+
+- `whitespace`: comprime spazi e righe vuote ripetute dentro ogni turno;
+- `dedupe`: sostituisce i turni identici già visti con un rimando al primo;
+- `headtail`: se si supera il budget tiene l'inizio e la fine della
+  conversazione e segnala i turni omessi;
+- `relevance`: per le metriche con `relevance_keywords` in
+  `config_metrics.json` tiene prima i turni che contengono le parole chiave
+  (con `relevance_window` turni di contesto), poi inizio e fine.
+
+Le funzioni sono pure e deterministiche (stesso log e stesse opzioni, stessa
+trascrizione: la cache del giudice resta valida) e lineari nel numero di
+turni. I token sono stimati come in `estimate_tokens` (circa 4 caratteri per token).
+"""
+
+import re
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from .turns import format_turns, iter_turns
+
+STRATEGIES = ("whitespace", "dedupe", "headtail", "relevance")
+DEFAULT_STRATEGIES = ("whitespace", "dedupe", "headtail")
+
+_CHARS_PER_TOKEN = 4
+# Turni più corti di così non vengono deduplicati: il rimando non farebbe risparmiare nulla
+_MIN_DEDUPE_CHARS = 48
+# Quota di budget tenuta da parte per i marcatori dei turni omessi
+_MARKER_RESERVE = 0.05
+_SPACES_RE = re.compile(r"[ \t\f\v]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+
+def _tokens(chars: int) -> int:
+    return chars // _CHARS_PER_TOKEN + 1 if chars else 0
+
+
+@dataclass(frozen=True)
+class TranscriptOptions:
+    """Budget e strategie di riduzione della trascrizione (budget None = trascrizione completa)."""
+
+    budget_tokens: int | None = None
+    strategies: tuple[str, ...] = DEFAULT_STRATEGIES
+    head_ratio: float = 0.4
+    relevance_window: int = 1
+
+    def __post_init__(self):
+        """Valida strategie e rapporto di testa."""
+        unknown = [s for s in self.strategies if s not in STRATEGIES]
+        if unknown:
+            raise ValueError(f"strategie di trascrizione sconosciute: {', '.join(unknown)} "
+                             f"(disponibili: {', '.join(STRATEGIES)})")
+        if not 0.0 <= self.head_ratio <= 1.0:
+            raise ValueError("head_ratio deve essere compreso tra 0 e 1")
+
+    @classmethod
+    def from_cli(cls, budget_tokens: int | None,
+                 strategies: str | Iterable[str] = DEFAULT_STRATEGIES) -> "TranscriptOptions":
+        """Opzioni da `--transcript-budget` e `--transcript-strategy` (lista separata da virgole)."""
+        if isinstance(strategies, str):
+            strategies = [s.strip().lower() for s in strategies.split(",") if s.strip()]
+        return cls(budget_tokens=budget_tokens if budget_tokens and budget_tokens > 0 else None,
+                   strategies=tuple(dict.fromkeys(strategies)))
+
+    @property
+    def enabled(self) -> bool:
+        """Vero se è impostato un budget."""
+        return self.budget_tokens is not None
+
+    @property
+    def budget_chars(self) -> int:
+        """Budget in caratteri (stima di caratteri per token)."""
+        return (self.budget_tokens or 0) * _CHARS_PER_TOKEN
+
+
+def transcript_lines(conversation_log: list[dict], options: TranscriptOptions) -> tuple[list[str], dict]:
+    """Formatta i turni applicando le strategie senza perdita di turni (`whitespace`, `dedupe`).
+
+    Senza budget i turni restano identici a quelli di `format_transcript`.
+    """
+    collapse = options.enabled and "whitespace" in options.strategies
+    dedupe = options.enabled and "dedupe" in options.strategies
+    stats = {"whitespace_saved_chars": 0, "deduplicated_turns": 0}
+    if not (collapse or dedupe):
+        lines = format_turns(conversation_log)
+        stats["original_chars"] = sum(len(line) for line in lines) + max(0, len(lines) - 1)
+        return lines, stats
+    lines: list[str] = []
+    seen: dict[tuple[str, str], int] = {}
+    original_chars = 0
+    for agent, content in iter_turns(conversation_log):
+        original_chars += len(agent) + len(content) + 3
+        if collapse:
+            collapsed = _BLANK_LINES_RE.sub("\n", _SPACES_RE.sub(" ", content)).strip()
+            stats["whitespace_saved_chars"] += len(content) - len(collapsed)
+            content = collapsed
+        if dedupe and len(content) >= _MIN_DEDUPE_CHARS:
+            first = seen.get((agent, content))
+            if first is not None:
+                stats["deduplicated_turns"] += 1
+                lines.append(f"{agent}: [ripete il turno {first}]")
+                continue
+            seen[(agent, content)] = len(lines) + 1
+        lines.append(f"{agent}: {content}")
+    # lunghezza della trascrizione non ridotta (righe + separatori)
+    stats["original_chars"] = max(0, original_chars - 1)
+    return lines, stats
+
+
+def _relevant_indices(lines: list[str], keywords: Iterable[str], window: int) -> list[int]:
+    needles = [k.lower() for k in keywords if k]
+    hits: dict[int, None] = {}
+    for idx, line in enumerate(lines):
+        low = line.lower()
+        if any(k in low for k in needles):
+            for j in range(max(0, idx - window), min(len(lines), idx + window + 1)):
+                hits[j] = None
+    return list(hits)
+
+
+def fit_transcript(lines: list[str], options: TranscriptOptions,
+                   keywords: Iterable[str] = ()) -> tuple[str, dict]:
+    """Riduce i turni entro il budget. Ritorna `(trascrizione, report)`.
+
+    Senza `headtail` (né `relevance` con parole chiave) la trascrizione non
+    viene tagliata anche se supera il budget: il report lo segnala.
+    """
+    total_chars = sum(len(line) for line in lines) + max(0, len(lines) - 1)
+    budget = options.budget_chars
+    keywords = tuple(keywords) if "relevance" in options.strategies else ()
+    windowing = "headtail" in options.strategies or bool(keywords)
+
+    if not options.enabled or total_chars <= budget or not windowing or not lines:
+        text = "\n".join(lines)
+        return text, {"kept_turns": len(lines), "omitted_turns": 0,
+                      "over_budget": options.enabled and total_chars > budget}
+
+    available = int(budget * (1 - _MARKER_RESERVE))
+    selected: dict[int, str] = {}
+    used = 0
+
+    def take(idx: int, allowance: int) -> bool:
+        nonlocal used
+        if idx in selected:
+            return True
+        cost = len(lines[idx]) + 1
+        if used + cost <= allowance:
+            selected[idx] = lines[idx]
+            used += cost
+            return True
+        return False
+
+    if keywords:
+        for idx in _relevant_indices(lines, keywords, max(0, options.relevance_window)):
+            take(idx, int(available * 0.6))
+
+    # inizio e fine della conversazione con il budget rimasto
+    head_limit = used + int((available - used) * options.head_ratio)
+    head_end = 0
+    while head_end < len(lines) and take(head_end, head_limit):
+        head_end += 1
+    if not selected and lines:
+        # il primo turno da solo supera il budget: lo tronchiamo
+        selected[0] = lines[0][:max(0, available - 8)] + " [...]"
+        used = len(selected[0]) + 1
+    tail = len(lines) - 1
+    while tail > head_end and take(tail, available):
+        tail -= 1
+
+    out: list[str] = []
+    previous = -1
+    omitted = 0
+    for idx in sorted(selected):
+        gap = idx - previous - 1
+        if gap:
+            omitted += gap
+            out.append(f"[... {gap} turni omessi ...]")
+        out.append(selected[idx])
+        previous = idx
+    gap = len(lines) - previous - 1
+    if gap:
+        omitted += gap
+        out.append(f"[... {gap} turni omessi ...]")
+    return "\n".join(out), {"kept_turns": len(selected), "omitted_turns": omitted, "over_budget": False}
+
+
+def build_transcript(conversation_log: list[dict], options: TranscriptOptions,
+                     keywords: Iterable[str] = ()) -> tuple[str, list[str], dict]:
+    """Trascrizione entro il budget. Ritorna `(trascrizione, turni formattati, report)`."""
+    lines, stats = transcript_lines(conversation_log, options)
+    original_chars = stats.pop("original_chars")
+    text, report = fit_transcript(lines, options, keywords)
+    return text, lines, _report(options, lines, original_chars, text, stats, report)
+
+
+def refit_transcript(lines: list[str], options: TranscriptOptions, keywords: Iterable[str]) -> tuple[str, dict]:
+    """Variante per una metrica con parole chiave, a partire dai turni già formattati."""
+    text, report = fit_transcript(lines, options, keywords)
+    original_chars = sum(len(line) for line in lines) + max(0, len(lines) - 1)
+    return text, _report(options, lines, original_chars, text, {}, report) | {"keywords": list(keywords)}
+
+
+def _report(options: TranscriptOptions, lines: list[str], original_chars: int, text: str,
+            stats: dict, fit: dict) -> dict:
+    return {
+        "budget_tokens": options.budget_tokens,
+        "strategies": list(options.strategies),
+        "turns": len(lines),
+        "original_est_tokens": _tokens(original_chars),
+        "final_est_tokens": _tokens(len(text)),
+        "trimmed_est_tokens": max(0, _tokens(original_chars) - _tokens(len(text))),
+        **stats,
+        **fit,
+    }
@@ -0,0 +1,84 @@
+"""Adattatori per lo schema dei turni di conversazione.
+
+I log usano chiavi diverse per chi parla e per il testo (`agent`/`content`,
+`speaker`/`message`, `role`/`text`, ...). Invece di normalizzare ogni turno
+in fase di lettura e poi riformattarlo, lo schema viene riconosciuto una
+volta per conversazione dal primo turno: i turni che hanno esattamente le
+due chiavi rilevate vengono formattati leggendole direttamente, tutti gli
+altri passano per la catena di fallback storica.
+
+Il risultato è identico a quello della catena di `format_transcript`.
+"""
+
+from collections.abc import Iterable, Iterator
+
+# Ordine di priorità storico di format_transcript
+AGENT_KEYS = ("agent", "speaker", "speaker_name", "from", "role")
+CONTENT_KEYS = ("content", "message", "text", "utterance", "body")
+
+
+def _text(value: object) -> str:
+    if type(value) is str:
+        return value
+    try:
+        return str(value)
+    except Exception:
+        return ""
+
+
+def turn_parts(turn: dict) -> tuple[str, str]:
+    """`(agente, testo)` di un turno con la catena di fallback completa."""
+    get = turn.get
+    agent = get("agent") or get("speaker") or get("speaker_name") or get("from") or get("role") or "Unknown"
+    content = get("content") or get("message") or get("text") or get("utterance") or get("body") or ""
+    return _text(agent), _text(content)
+
+
+def detect_schema(conversation_log: Iterable) -> tuple[str | None, str | None]:
+    """Chiavi di agente e contenuto usate dal primo turno valido, es. `("speaker", "message")`."""
+    for turn in conversation_log:
+        if isinstance(turn, dict):
+            agent = next((k for k in AGENT_KEYS if k in turn), None)
+            content = next((k for k in CONTENT_KEYS if k in turn), None)
+            return agent, content
+    return None, None
+
+
+def _schema(conversation_log: list) -> tuple[str, str] | None:
+    """Chiavi del primo turno se sono esattamente una di agente e una di contenuto."""
+    for turn in conversation_log:
+        if isinstance(turn, dict):
+            agent, content = detect_schema((turn,))
+            return (agent, content) if len(turn) == 2 and agent and content else None
+    return None
+
+
+def format_turns(conversation_log: list) -> list[str]:
+    """Righe `agente: testo` dei turni validi (i turni che non sono oggetti vengono saltati)."""
+    schema = _schema(conversation_log)
+    try:
+        if schema is None or schema == (AGENT_KEYS[0], CONTENT_KEYS[0]):
+            # chiavi canoniche o turni con altri campi: catena completa, inline
+            return [
+                f"{t.get('agent') or t.get('speaker') or t.get('speaker_name') or t.get('from') or t.get('role') or 'Unknown'}: "  # noqa: E501
+                f"{t.get('content') or t.get('message') or t.get('text') or t.get('utterance') or t.get('body') or ''}"
+                for t in conversation_log if isinstance(t, dict)
+            ]
+        a, c = schema
+        # turni con esattamente le due chiavi dello schema: nessun'altra chiave candidata
+        return [
+            f"{t[a] or 'Unknown'}: {t[c] or ''}"
+            if type(t) is dict and len(t) == 2 and a in t and c in t
+            else ": ".join(turn_parts(t))
+            for t in conversation_log if isinstance(t, dict)
+        ]
+    except Exception:
+        # valori il cui str() fallisce: la catena completa li tratta come testo vuoto
+        return [": ".join(turn_parts(t)) for t in conversation_log if isinstance(t, dict)]
+
+
+def iter_turns(conversation_log: Iterable) -> Iterator[tuple[str, str]]:
+    """Itera `(agente, testo)` dei turni validi (i turni che non sono oggetti vengono saltati)."""
+    for turn in conversation_log:
+        if isinstance(turn, dict):
+            yield turn_parts(turn)
@@ -0,0 +1,227 @@
+"""Osservazione della cartella dei log per la modalità `--watch`.
+
+`LogWatcher` segnala i file `.json` e `.jsonl` nuovi o modificati sotto la cartella dei
+log. Su Linux usa inotify (tramite ctypes, senza dipendenze aggiuntive) e
+controlla solo i percorsi segnalati dal kernel; altrove, o se inotify non è
+disponibile (limite di watch esaurito, filesystem di rete), ripiega su una
+scansione periodica delle firme `(mtime, dimensione)` dei file.
+
+Un file viene restituito solo quando la sua firma resta invariata per
+`settle_seconds`: i log scritti a pezzi dal generatore non vengono letti a metà.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+# Costanti di <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")
+
+Signature = tuple[int, int]
+
+
+def _signature(path: Path) -> Signature | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _is_log(path: Path) -> bool:
+    return path.suffix in (".json", ".jsonl")
+
+
+class _Inotify:
+    """Watch inotify ricorsivo su una cartella; `read()` ritorna i percorsi toccati, o None se la coda è traboccata."""
+
+    def __init__(self, root: Path):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 fallita")
+        self.fd = fd
+        self._dirs: dict[int, Path] = {}
+        try:
+            self.add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, root: Path) -> list[Path]:
+        """Aggiunge i watch a `root` e alle sue sottocartelle; ritorna i log già presenti."""
+        logs = []
+        for dirpath, _, filenames in os.walk(root):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dirpath), _WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch '{dirpath}': {os.strerror(errno)}")
+            self._dirs[wd] = Path(dirpath)
+            logs.extend(Path(dirpath) / name for name in filenames if _is_log(Path(name)))
+        return logs
+
+    def read(self, timeout: float | None) -> list[Path] | None:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += _EVENT_HEADER.size + length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & _IN_ISDIR:
+                # cartella nuova (o spostata qui): i file scritti prima del watch non generano eventi
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    try:
+                        paths.extend(self.add_tree(path))
+                    except OSError:
+                        return None
+            elif _is_log(path):
+                paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class LogWatcher:
+    """Log nuovi o modificati sotto `logs_dir`, restituiti solo quando smettono di cambiare.
+
+    I file presenti alla creazione sono considerati già noti (li valuta il
+    primo passaggio completo). `backend` vale `"inotify"` o `"polling"`.
+    """
+
+    def __init__(self, logs_dir: Path, settle_seconds: float = 2.0, poll_interval: float = 1.0,
+                 use_inotify: bool = True, clock: Callable[[], float] = time.monotonic):
+        """Osserva `logs_dir`; un file è pronto dopo `settle_seconds` senza modifiche."""
+        self.logs_dir = Path(logs_dir)
+        self.settle_seconds = max(0.0, float(settle_seconds))
+        self.poll_interval = max(0.05, float(poll_interval))
+        self._clock = clock
+        self._known: dict[Path, Signature] = {}
+        # file cambiati in attesa che si stabilizzino: firma vista e da quando
+        self._pending: dict[Path, tuple[Signature, float]] = {}
+        self._inotify: _Inotify | None = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify(self.logs_dir)
+            except (OSError, AttributeError):
+                self._inotify = None
+        # la scansione iniziale segue i watch: un file creato nel frattempo genera comunque un evento
+        self._known = self._scan()
+        self.backend = "polling" if self._inotify is None else "inotify"
+
+    def _scan(self) -> dict[Path, Signature]:
+        signatures = {}
+        for dirpath, _, filenames in os.walk(self.logs_dir):
+            for name in filenames:
+                path = Path(dirpath) / name
+                if _is_log(path):
+                    signature = _signature(path)
+                    if signature is not None:
+                        signatures[path] = signature
+        return signatures
+
+    def _changes(self, timeout: float | None) -> Iterable[Path]:
+        if self._inotify is not None:
+            paths = self._inotify.read(timeout)
+            if paths is not None:
+                return paths
+        else:
+            time.sleep(self.poll_interval if timeout is None else max(0.0, min(timeout, self.poll_interval)))
+        # polling, o coda inotify traboccata: confronto completo delle firme
+        current = self._scan()
+        for path in set(self._known) - set(current):
+            del self._known[path]
+        return [path for path, signature in current.items() if self._known.get(path) != signature]
+
+    def _observe(self, path: Path, now: float) -> None:
+        signature = _signature(path)
+        if signature is None:
+            self._pending.pop(path, None)
+            self._known.pop(path, None)
+            return
+        pending = self._pending.get(path)
+        if pending is not None and pending[0] == signature:
+            return
+        if pending is None and self._known.get(path) == signature:
+            return
+        self._pending[path] = (signature, now)
+
+    def _settled(self, now: float) -> list[Path]:
+        ready = []
+        for path, (signature, since) in list(self._pending.items()):
+            if now - since < self.settle_seconds:
+                continue
+            current = _signature(path)
+            if current is None:
+                del self._pending[path]
+                self._known.pop(path, None)
+            elif current != signature:
+                self._pending[path] = (current, now)
+            else:
+                del self._pending[path]
+                self._known[path] = current
+                ready.append(path)
+        return sorted(ready)
+
+    def wait(self, timeout: float | None = None) -> list[Path]:
+        """Attende log nuovi o modificati e stabili; lista vuota se scade `timeout` (secondi)."""
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            now = self._clock()
+            ready = self._settled(now)
+            if ready:
+                return ready
+            if deadline is not None and now >= deadline:
+                return []
+            # si attende fino al prossimo file da ricontrollare, al polling o alla scadenza
+            waits = []
+            if self._pending:
+                oldest = min(since for _, since in self._pending.values())
+                waits.append(max(0.05, oldest + self.settle_seconds - now))
+            if deadline is not None:
+                waits.append(deadline - now)
+            for path in self._changes(min(waits) if waits else None):
+                self._observe(path, self._clock())
+
+    def close(self) -> None:
+        """Chiude il descrittore inotify, se aperto."""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def __enter__(self) -> "LogWatcher":
+        """Ritorna il watcher stesso."""
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Chiude il watcher."""
+        self.close()
@@ -4,38 +4,376 @@ This stub provides:
 - configure(api_key=...)
 - GenerationConfig: simple dataclass-like container
 - GenerativeModel: simple class with generate_content(prompt) that returns a JSON string
+- caching.CachedContent / GenerativeModel.from_cached_content: context caching,
+  with `usage_metadata.cached_content_token_count` on the responses
 
 This allows the rest of the project to run in a dry-run mode without the official
 `google-generativeai` package. Replace or remove this shim when you install the
 official client.
+
+The stub can also act as a *simulated judge* for load testing: with
+`configure_simulation(...)` (or the `GENAI_SIM_*` environment variables, read
+on first use) every call waits for a sampled latency and can fail with
+server errors, 429s, 404s or malformed JSON, and per-minute quotas are enforced.
+Without a simulation config the stub answers instantly with a fixed payload.
+
+Environment variables:
+- GENAI_SIM_LATENCY_MS: mean latency in milliseconds (default 0)
+- GENAI_SIM_LATENCY_DIST: fixed | uniform | exponential | lognormal (default lognormal)
+- GENAI_SIM_LATENCY_SIGMA: spread of the lognormal distribution (default 0.5)
+- GENAI_SIM_LATENCY_PER_1K_TOKENS_MS: extra latency per 1000 uncached input tokens (default 0)
+- GENAI_SIM_ERROR_RATE / GENAI_SIM_429_RATE / GENAI_SIM_MALFORMED_RATE / GENAI_SIM_404_RATE: probabilities 0..1
+- GENAI_SIM_RPM / GENAI_SIM_TPM: per-minute request / token quotas (0 = unlimited)
+- GENAI_SIM_SEED: seed for reproducible runs
 """
 
 import json
-from dataclasses import dataclass
+import math
+import os
+import random
+import re
+import threading
+import time
+import types
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
 from typing import Any
 
 _api_key = None
 
 def configure(api_key: str | None = None):
+    """Store the API key (unused by the stub)."""
     global _api_key
     _api_key = api_key
 
 @dataclass
 class GenerationConfig:
+    """Subset of the real generation config read by the project."""
+
     temperature: float = 0.0
     response_mime_type: str = "application/json"
 
+
+class SimulatedAPIError(Exception):
+    """Error raised by the simulated judge; mirrors the `code` / `retry_after` of real client errors."""
+
+    def __init__(self, code: int, message: str, retry_after: float | None = None):
+        """Error with HTTP-like `code` and optional `retry_after` seconds."""
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.retry_after = retry_after
+
+
+@dataclass
+class SimulationConfig:
+    """Simulated judge settings, read from the `GENAI_SIM_*` environment variables."""
+
+    latency_ms: float = 0.0
+    latency_dist: str = "lognormal"
+    latency_sigma: float = 0.5
+    latency_per_1k_tokens_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    malformed_rate: float = 0.0
+    not_found_rate: float = 0.0
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+    seed: int | None = None
+
+    @classmethod
+    def from_env(cls) -> "SimulationConfig | None":
+        """Settings from the environment, or None when no `GENAI_SIM_*` variable is set."""
+        if not any(k.startswith("GENAI_SIM_") for k in os.environ):
+            return None
+        env = os.environ.get
+        seed = env("GENAI_SIM_SEED")
+        return cls(
+            latency_ms=float(env("GENAI_SIM_LATENCY_MS", 0)),
+            latency_dist=env("GENAI_SIM_LATENCY_DIST", "lognormal"),
+            latency_sigma=float(env("GENAI_SIM_LATENCY_SIGMA", 0.5)),
+            latency_per_1k_tokens_ms=float(env("GENAI_SIM_LATENCY_PER_1K_TOKENS_MS", 0)),
+            error_rate=float(env("GENAI_SIM_ERROR_RATE", 0)),
+            rate_limit_rate=float(env("GENAI_SIM_429_RATE", 0)),
+            malformed_rate=float(env("GENAI_SIM_MALFORMED_RATE", 0)),
+            not_found_rate=float(env("GENAI_SIM_404_RATE", 0)),
+            requests_per_minute=int(float(env("GENAI_SIM_RPM", 0))),
+            tokens_per_minute=int(float(env("GENAI_SIM_TPM", 0))),
+            seed=int(seed) if seed else None,
+        )
+
+
+@dataclass
+class SimulationStats:
+    """Counters of the simulated calls."""
+
+    calls: int = 0
+    ok: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    quota_rejected: int = 0
+    malformed: int = 0
+    not_found: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        """Counters without the raw latency samples."""
+        return {k: v for k, v in vars(self).items() if k != "latencies"}
+
+
+class _Simulator:
+    """Shared state of the simulated judge (one per process, like a remote endpoint)."""
+
+    def __init__(self, config: SimulationConfig):
+        self.config = config
+        self.stats = SimulationStats()
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._window: deque[tuple[float, int]] = deque()
+
+    def _latency(self, uncached_tokens: int = 0) -> float:
+        # input processing time: cached tokens are not re-read by the model
+        per_token = self.config.latency_per_1k_tokens_ms / 1000.0 * uncached_tokens / 1000.0
+        return per_token + self._base_latency()
+
+    def _base_latency(self) -> float:
+        mean = self.config.latency_ms / 1000.0
+        if mean <= 0:
+            return 0.0
+        dist = self.config.latency_dist
+        if dist == "fixed":
+            return mean
+        if dist == "uniform":
+            return self._rng.uniform(0, 2 * mean)
+        if dist == "exponential":
+            return self._rng.expovariate(1 / mean)
+        # lognormal with the requested mean
+        sigma = self.config.latency_sigma
+        return self._rng.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+
+    def _check_quota(self, now: float, tokens: int) -> float | None:
+        """Registers the call in the 60s window; returns seconds to wait if a quota is exceeded."""
+        while self._window and now - self._window[0][0] >= 60:
+            self._window.popleft()
+        rpm, tpm = self.config.requests_per_minute, self.config.tokens_per_minute
+        over_rpm = rpm and len(self._window) >= rpm
+        over_tpm = tpm and sum(t for _, t in self._window) + tokens > tpm
+        if over_rpm or over_tpm:
+            return max(0.0, 60 - (now - self._window[0][0])) if self._window else 60.0
+        self._window.append((now, tokens))
+        return None
+
+    def call(self, prompt: str, cached_tokens: int = 0) -> str:
+        """Simulated call; `prompt` is the full input, of which `cached_tokens` come from a context cache."""
+        tokens = _count_tokens(prompt)
+        with self._lock:
+            self.stats.calls += 1
+            self.stats.prompt_tokens += tokens
+            self.stats.cached_tokens += cached_tokens
+            roll = self._rng.random()
+            latency = self._latency(tokens - cached_tokens)
+            retry_after = self._check_quota(time.monotonic(), tokens)
+        start = time.perf_counter()
+        if latency and retry_after is None:
+            # quota rejections come back immediately, like a real front end
+            time.sleep(latency)
+        outcome = "ok"
+        try:
+            if retry_after is not None:
+                outcome = "quota_rejected"
+                raise SimulatedAPIError(429, "Resource has been exhausted (e.g. check quota).", retry_after=retry_after)
+            cfg = self.config
+            if roll < cfg.error_rate:
+                outcome = "errors"
+                raise SimulatedAPIError(503, "The service is currently unavailable.")
+            if roll < cfg.error_rate + cfg.rate_limit_rate:
+                outcome = "rate_limited"
+                raise SimulatedAPIError(429, "Resource has been exhausted (e.g. check quota).", retry_after=1.0)
+            if roll < cfg.error_rate + cfg.rate_limit_rate + cfg.malformed_rate:
+                outcome = "malformed"
+                return '{"Score": "3", "Justification": "truncated'
+            if roll < cfg.error_rate + cfg.rate_limit_rate + cfg.malformed_rate + cfg.not_found_rate:
+                outcome = "not_found"
+                raise SimulatedAPIError(404, "models/simulated is not found for API version v1beta.")
+            return _stub_payload(prompt)
+        finally:
+            with self._lock:
+                setattr(self.stats, outcome, getattr(self.stats, outcome) + 1)
+                self.stats.latencies.append(time.perf_counter() - start)
+
+
+_simulator: _Simulator | None = None
+_simulator_loaded = False
+_simulator_lock = threading.Lock()
+
+
+def configure_simulation(config: SimulationConfig | None = None, **kwargs: Any) -> None:
+    """Enable (or with no arguments disable) the simulated judge for all models."""
+    global _simulator, _simulator_loaded
+    if config is None and kwargs:
+        config = SimulationConfig(**kwargs)
+    with _simulator_lock:
+        _simulator = _Simulator(config) if config is not None else None
+        _simulator_loaded = True
+
+
+def create_simulator(config: SimulationConfig | None = None, **kwargs: Any) -> _Simulator:
+    """Independent simulated endpoint with its own quota window and stats (e.g. behind a local HTTP stand-in)."""
+    return _Simulator(config or SimulationConfig(**kwargs))
+
+
+def simulation_stats() -> SimulationStats | None:
+    """Stats of the process-wide simulated judge, or None when it is disabled."""
+    return _get_simulator().stats if _get_simulator() is not None else None
+
+
+def _get_simulator() -> _Simulator | None:
+    global _simulator, _simulator_loaded
+    if not _simulator_loaded:
+        with _simulator_lock:
+            if not _simulator_loaded:
+                config = SimulationConfig.from_env()
+                _simulator = _Simulator(config) if config is not None else None
+                _simulator_loaded = True
+    return _simulator
+
+
+# Batched judge prompts list metrics as `### n. Nome Metrica: "<name>"`
+_BATCH_METRIC_RE = re.compile(r'^### \d+\. Nome Metrica: "([^"]+)"', re.MULTILINE)
+
+
+def _count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _stub_payload(prompt: str) -> str:
+    # Produce a safe stubbed JSON that evaluation expects (Score, Justification)
+    stub = {"Score": "STUB", "Justification": "This is a stub response from local generativeai shim."}
+    names = _BATCH_METRIC_RE.findall(prompt)
+    if names:
+        return json.dumps({name: stub for name in names}, ensure_ascii=False)
+    return json.dumps(stub, ensure_ascii=False)
+
+
+@dataclass
+class UsageMetadata:
+    """Token counts of a response, as in the real client."""
+
+    prompt_token_count: int = 0
+    cached_content_token_count: int = 0
+    candidates_token_count: int = 0
+    total_token_count: int = 0
+
+
+class GenerateContentResponse:
+    """Response with a .text attribute (a JSON string evaluation can parse) and token usage."""
+
+    def __init__(self, text: str, prompt_tokens: int, cached_tokens: int = 0):
+        """Response `text` with usage computed from the prompt and cached token counts."""
+        self.text = text
+        candidates = _count_tokens(text)
+        self.usage_metadata = UsageMetadata(prompt_token_count=prompt_tokens, cached_content_token_count=cached_tokens,
+                                            candidates_token_count=candidates,
+                                            total_token_count=prompt_tokens + candidates)
+
+
+class CachedContent:
+    """Context cache entry: `contents` (and an optional system instruction) stored server side until `expire_time`.
+
+    Mirrors `google.generativeai.caching.CachedContent`; the shim keeps entries in
+    a process-wide registry and rejects models that reference expired or deleted ones.
+    """
+
+    _registry: dict[str, "CachedContent"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, name: str, model: str, text: str, expire_time: datetime, display_name: str | None = None):
+        """Entry `name` for `model` holding `text` until `expire_time`."""
+        self.name = name
+        self.model = model
+        self.display_name = display_name
+        self.expire_time = expire_time
+        self.create_time = datetime.now(UTC)
+        self._text = text
+        self.usage_metadata = types.SimpleNamespace(total_token_count=_count_tokens(text))
+
+    @classmethod
+    def create(cls, model: str, *, contents: list[str] | str | None = None, system_instruction: str | None = None,
+               ttl: timedelta | float | None = None, display_name: str | None = None) -> "CachedContent":
+        """Store `contents` for `ttl` (default one hour) and return the new entry."""
+        if isinstance(contents, str):
+            contents = [contents]
+        text = "".join(filter(None, [system_instruction, *(contents or [])]))
+        if not text:
+            raise SimulatedAPIError(400, "Cached content must not be empty.")
+        if not isinstance(ttl, timedelta):
+            ttl = timedelta(seconds=3600 if ttl is None else ttl)
+        if not model.startswith("models/"):
+            model = f"models/{model}"
+        entry = cls(f"cachedContents/{uuid.uuid4().hex[:16]}", model, text, datetime.now(UTC) + ttl,
+                    display_name)
+        with cls._registry_lock:
+            cls._registry[entry.name] = entry
+        return entry
+
+    @classmethod
+    def get(cls, name: str) -> "CachedContent":
+        """Live entry `name`; raises a 403 error if it is missing or expired."""
+        with cls._registry_lock:
+            entry = cls._registry.get(name)
+        if entry is None or entry.expire_time <= datetime.now(UTC):
+            raise SimulatedAPIError(403, f"CachedContent not found (or permission denied): {name}")
+        return entry
+
+    @classmethod
+    def list(cls) -> list["CachedContent"]:
+        """All registered entries, including expired ones."""
+        with cls._registry_lock:
+            return list(cls._registry.values())
+
+    def update(self, *, ttl: timedelta | float | None = None) -> None:
+        """Move `expire_time` to `ttl` from now."""
+        if ttl is not None:
+            self.expire_time = datetime.now(UTC) + (ttl if isinstance(ttl, timedelta) else timedelta(seconds=ttl))
+
+    def delete(self) -> None:
+        """Remove the entry."""
+        with self._registry_lock:
+            self._registry.pop(self.name, None)
+
+
+# `genai.caching.CachedContent`, as in the official client
+caching = types.SimpleNamespace(CachedContent=CachedContent)
+
+
 class GenerativeModel:
+    """Stand-in for `genai.GenerativeModel`, backed by the stub payload or the simulated judge."""
+
     def __init__(self, model_name: str, generation_config: GenerationConfig | None = None):
+        """Model `model_name` with an optional default generation config."""
         self.model_name = model_name
         self.generation_config = generation_config or GenerationConfig()
+        self.cached_content: str | None = None
+
+    @classmethod
+    def from_cached_content(cls, cached_content: CachedContent | str,
+                            generation_config: GenerationConfig | None = None) -> "GenerativeModel":
+        """Model whose requests are appended to the contents of a context cache entry."""
+        if isinstance(cached_content, str):
+            cached_content = CachedContent.get(cached_content)
+        model = cls(cached_content.model, generation_config=generation_config)
+        model.cached_content = cached_content.name
+        return model
 
-    def generate_content(self, prompt: str) -> Any:
-        # Return an object that has a .text attribute (like some clients do),
-        # containing a valid JSON string that evaluation.py can parse.
-        class Resp:
-            def __init__(self, text: str):
-                self.text = text
-        # Produce a safe stubbed JSON that evaluation expects (Score, Justification)
-        stub = {"Score": "STUB", "Justification": "This is a stub response from local generativeai shim."}
-        return Resp(json.dumps(stub, ensure_ascii=False))
+    def generate_content(self, prompt: str, generation_config: GenerationConfig | dict | None = None) -> Any:
+        """Return a response for `prompt`, prefixed by the cached content if any."""
+        # `generation_config` overrides the model config per call, as in the real client; the shim ignores it.
+        cached_text = CachedContent.get(self.cached_content)._text if self.cached_content else ""
+        full_prompt = cached_text + prompt
+        cached_tokens = _count_tokens(cached_text) if cached_text else 0
+        simulator = _get_simulator()
+        text = simulator.call(full_prompt, cached_tokens) if simulator is not None else _stub_payload(full_prompt)
+        return GenerateContentResponse(text, _count_tokens(full_prompt), cached_tokens)
@@ -4,69 +4,71 @@ This module re-exports commonly used symbols from submodules and, when
 available, exposes selected helpers from google.generativeai (configure,
 GenerationConfig, GenerativeModel) so callers can import them from
 `llm_conversation`.
-"""
 
-from pathlib import Path
+Exports are resolved lazily (PEP 562): `import llm_conversation` does not
+import any submodule or google.generativeai, which are only loaded the first
+time one of their symbols is accessed.
+"""
 
-# Submodules may depend on optional third-party packages. Import them
-# lazily / defensively so `import llm_conversation` works even when some
-# optional deps are missing (e.g. when running only evaluation scripts
-# that rely on `google.generativeai`).
-try:
-	from .ai_agent import AIAgent
-except Exception:  # pragma: no cover - optional dependency missing
-	AIAgent = None
+import importlib
 
-try:
-	from .color import generate_distinct_colors, rgb_to_ansi16, rgb_to_ansi256
-except Exception:  # pragma: no cover - optional dependency missing
-	generate_distinct_colors = None
-	rgb_to_ansi16 = None
-	rgb_to_ansi256 = None
+# Exported name -> (module, attribute). Submodules may depend on optional
+# third-party packages: a symbol whose module cannot be imported resolves
+# to None, so `import llm_conversation` works even when some optional deps
+# are missing (e.g. when running only evaluation scripts that rely on
+# `google.generativeai`).
+_LAZY_EXPORTS = {
+    "AIAgent": (".ai_agent", "AIAgent"),
+    "generate_distinct_colors": (".color", "generate_distinct_colors"),
+    "rgb_to_ansi16": (".color", "rgb_to_ansi16"),
+    "rgb_to_ansi256": (".color", "rgb_to_ansi256"),
+    "AgentConfig": (".config", "AgentConfig"),
+    "get_available_models": (".config", "get_available_models"),
+    "load_config": (".config", "load_config"),
+    "ConversationManager": (".conversation_manager", "ConversationManager"),
+    "TurnOrder": (".conversation_manager", "TurnOrder"),
+    "get_logger": (".logging_config", "get_logger"),
+    "setup_logging": (".logging_config", "setup_logging"),
+    # Optional: google.generativeai helpers if the package is installed.
+    "genai": ("google.generativeai", None),
+    "configure": ("google.generativeai", "configure"),
+    "GenerationConfig": ("google.generativeai", "GenerationConfig"),
+    "GenerativeModel": ("google.generativeai", "GenerativeModel"),
+}
 
-try:
-	from .config import AgentConfig, get_available_models, load_config
-except Exception:  # pragma: no cover - optional dependency missing
-	AgentConfig = None
-	get_available_models = None
-	load_config = None
 
-try:
-	from .conversation_manager import ConversationManager, TurnOrder
-except Exception:  # pragma: no cover - optional dependency missing
-	ConversationManager = None
-	TurnOrder = None
+def __getattr__(name):
+    try:
+        module_name, attr = _LAZY_EXPORTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    try:
+        module = importlib.import_module(module_name, __name__)
+        value = module if attr is None else getattr(module, attr, None)
+    except Exception:  # pragma: no cover - optional dependency missing
+        value = None
+    # Cache the result: later accesses no longer go through __getattr__
+    globals()[name] = value
+    return value
 
-try:
-	from .logging_config import get_logger, setup_logging
-except Exception:  # pragma: no cover - optional dependency missing
-	get_logger = None
-	setup_logging = None
 
-# Optional: expose google.generativeai helpers if the package is installed.
-try:
-	import google.generativeai as genai  # type: ignore
-except Exception:
-	genai = None
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_EXPORTS))
 
-configure = getattr(genai, "configure", None)
-GenerationConfig = getattr(genai, "GenerationConfig", None)
-GenerativeModel = getattr(genai, "GenerativeModel", None)
 
 __all__ = [
-	"AIAgent",
-	"generate_distinct_colors",
-	"rgb_to_ansi16",
-	"rgb_to_ansi256",
-	"AgentConfig",
-	"get_available_models",
-	"load_config",
-	"ConversationManager",
-	"TurnOrder",
-	"get_logger",
-	"setup_logging",
-	"configure",
-	"GenerationConfig",
-	"GenerativeModel",
+    "AIAgent",
+    "generate_distinct_colors",
+    "rgb_to_ansi16",
+    "rgb_to_ansi256",
+    "AgentConfig",
+    "get_available_models",
+    "load_config",
+    "ConversationManager",
+    "TurnOrder",
+    "get_logger",
+    "setup_logging",
+    "configure",
+    "GenerationConfig",
+    "GenerativeModel",
 ]
-
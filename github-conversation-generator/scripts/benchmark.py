@@ -0,0 +1,402 @@
+"""Benchmark di carico di `valut.py` con un giudice simulato (nessuna rete).
+
+Genera un corpus sintetico di conversazioni in `conversation_logs/`, attiva
+il giudice simulato dello shim `google/generativeai.py` (latenza, errori,
+429, JSON malformati, quote al minuto) ed esegue `valut.main()`. Alla fine
+riporta throughput (valutazioni/s), latenza p50/p95 delle chiamate al
+giudice, picco di RSS e tempo totale, e salva il report in JSON.
+Con `--ingest-only` misura solo la fase di ingest (lettura, parsing,
+trascrizione) in un singolo processo, senza giudice. Con `--pool-endpoints N`
+il giudice è un pool di N server HTTP locali compatibili con Ollama, ognuno
+con il proprio giudice simulato e le proprie quote (`--quota-rpm` per endpoint).
+
+Esempio:
+    python scripts/benchmark.py --logs 200 --turns 40 --latency-ms 300 --workers 8
+    python scripts/benchmark.py --ingest-only --logs 2000 --turns 60 --prefixed-rate 0.1
+    python scripts/benchmark.py --logs 100 --pool-endpoints 3 --quota-rpm 120 --workers 12
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+_WORDS = ("macchina", "errore", "fusibile", "pressione", "sensore", "pompa", "manutenzione", "verifica",
+          "allarme", "motore", "valvola", "temperatura", "cliente", "ricambio", "diagnosi", "procedura",
+          "controllo", "segnale", "ciclo", "reset", "tecnico", "linea", "guasto", "intervento")
+_PROFILES = ("novice", "intermediate", "expert")
+_LEVELS = ("low", "medium", "high")
+
+
+def generate_corpus(corpus_dir: Path, logs: int, turns: int, turn_chars: int, seed: int = 0,
+                    prefixed_rate: float = 0.0) -> int:
+    """Scrive `logs` conversazioni sintetiche con la stessa struttura dei log reali. Ritorna i byte scritti.
+
+    Una frazione `prefixed_rate` dei file ha del testo prima del JSON, per esercitare il recupero.
+    """
+    rng = random.Random(seed)
+    if corpus_dir.exists():
+        shutil.rmtree(corpus_dir)
+    written = 0
+    for i in range(logs):
+        profile = _PROFILES[i % len(_PROFILES)]
+        approach = "a" if i % 2 == 0 else "b"
+        level = _LEVELS[i % len(_LEVELS)]
+        root_cause = f"{rng.choice(_WORDS)} {rng.randint(1, 99)}"
+        persona = {"persona_configuration": {"profile_name": profile, "agent_name": f"Tecnico_{i}"},
+                   "expertise": profile, "traits": rng.sample(_WORDS, 3)}
+        conversation = []
+        for t in range(turns):
+            words = []
+            size = 0
+            while size < turn_chars:
+                word = rng.choice(_WORDS)
+                words.append(word)
+                size += len(word) + 1
+            conversation.append({"speaker": "Agent_1" if t % 2 == 0 else "Agent_2", "message": " ".join(words)})
+        log = {
+            "agents": [
+                {"name": "Agent_1", "system_prompt": {"root_cause": root_cause, "ticket": f"ticket {i}"}},
+                {"name": "Agent_2", "system_prompt": f"Sei un tecnico. {json.dumps(persona, ensure_ascii=False)}"},
+            ],
+            "conversation": conversation,
+        }
+        path = corpus_dir / profile / f"scenario{i:05d}_approach_{approach}_{level}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(log, ensure_ascii=False, indent=2)
+        if prefixed_rate and rng.random() < prefixed_rate:
+            data = f"Log generato il {i}: {{sessione}}\n" + data
+        path.write_text(data, encoding="utf-8")
+        written += len(data.encode("utf-8"))
+    return written
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        headers = {}
+        try:
+            text = self.server.simulator.call(body.get("prompt", ""))
+            status, payload = 200, {"model": body.get("model"), "response": text, "done": True}
+        except Exception as e:  # SimulatedAPIError: stesso codice e Retry-After di un server vero
+            status, payload = getattr(e, "code", 500), {"error": str(e)}
+            if getattr(e, "retry_after", None) is not None:
+                headers["Retry-After"] = f"{e.retry_after:.3f}"
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class OllamaStandIn(ThreadingHTTPServer):
+    """Server locale compatibile con `POST /api/generate` di Ollama, risposto da un giudice simulato dello shim."""
+
+    daemon_threads = True
+
+    def __init__(self, simulator):
+        """Avvia il server su una porta libera di 127.0.0.1 in un thread demone."""
+        super().__init__(("127.0.0.1", 0), _OllamaHandler)
+        self.simulator = simulator
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        """URL base del server."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _peak_rss_mb() -> dict:
+    if resource is None:
+        return {"self": None, "children": None}
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def run_ingest_benchmark(args: argparse.Namespace) -> dict:
+    """Throughput della fase di ingest in un singolo processo (nessun pool, nessun giudice)."""
+    corpus_dir = args.corpus_dir or (PROJECT_DIR / "conversation_logs" / f"benchmark_{args.logs}x{args.turns}")
+    corpus_bytes = generate_corpus(corpus_dir, args.logs, args.turns, args.turn_chars, seed=args.seed,
+                                   prefixed_rate=args.prefixed_rate)
+    from evaluation import ingest
+
+    log_files = sorted(corpus_dir.rglob("*.json"))
+    runs = []
+    for _ in range(max(1, args.repeat)):
+        skipped = 0
+        start = time.perf_counter()
+        for i, log_file in enumerate(log_files):
+            record = ingest.prepare_log_record(str(log_file), str(corpus_dir), i)
+            skipped += record["conv"] is None
+        runs.append(time.perf_counter() - start)
+    best = min(runs)
+    if not args.keep_corpus:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+    return {
+        "corpus": {"logs": args.logs, "turns": args.turns, "turn_chars": args.turn_chars, "bytes": corpus_bytes,
+                   "prefixed_rate": args.prefixed_rate},
+        "json_backend": getattr(ingest, "JSON_BACKEND", "json"),
+        "runs_seconds": [round(r, 4) for r in runs],
+        "best_seconds": round(best, 4),
+        "logs_per_second": round(len(log_files) / best, 1) if best else 0.0,
+        "mb_per_second": round(corpus_bytes / 1e6 / best, 2) if best else 0.0,
+        "skipped": skipped,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    """Genera il corpus, esegue valut.py con il giudice simulato e ritorna il report."""
+    corpus_dir = args.corpus_dir or (PROJECT_DIR / "conversation_logs" / f"benchmark_{args.logs}x{args.turns}")
+    corpus_bytes = generate_corpus(corpus_dir, args.logs, args.turns, args.turn_chars, seed=args.seed,
+                                   prefixed_rate=args.prefixed_rate)
+
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    import google.generativeai as genai
+
+    genai.configure_simulation(
+        latency_ms=args.latency_ms,
+        latency_dist=args.latency_dist,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        malformed_rate=args.malformed_rate,
+        requests_per_minute=args.quota_rpm,
+        tokens_per_minute=args.quota_tpm,
+        seed=args.seed,
+    )
+
+    import valut
+    from evaluation import FatalJudgeError, RetryPolicy
+
+    if args.quiet:
+        valut.console = valut.Console(quiet=True)
+
+    # Pool di endpoint locali: ognuno ha il proprio simulatore (latenza, errori, quote)
+    stand_ins = []
+    pool_path = None
+    if args.pool_endpoints:
+        for n in range(args.pool_endpoints):
+            stand_ins.append(OllamaStandIn(genai.create_simulator(
+                latency_ms=args.latency_ms, latency_dist=args.latency_dist, error_rate=args.error_rate,
+                rate_limit_rate=args.rate_limit_rate, malformed_rate=args.malformed_rate,
+                requests_per_minute=args.quota_rpm, tokens_per_minute=args.quota_tpm, seed=args.seed + n)))
+        pool_path = Path(tempfile.mkstemp(prefix="judge_pool_", suffix=".json")[1])
+        pool_path.write_text(json.dumps({"strategy": args.pool_strategy, "endpoints": [
+            {"name": f"standin{n + 1}", "backend": "ollama", "model": "bench-judge", "host": server.url,
+             "rpm": args.quota_rpm or None}
+            for n, server in enumerate(stand_ins)]}), encoding="utf-8")
+
+    # Latenza vista da valut.py per ogni richiesta al giudice (retry e attese del limitatore inclusi)
+    latencies: list[float] = []
+    lock = threading.Lock()
+    original_request = valut.request_judge_json
+
+    def timed_request(*args, **kwargs):
+        # stessa firma di valut.request_judge_json, qualunque parametro venga aggiunto
+        start = time.perf_counter()
+        try:
+            return original_request(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    valut.request_judge_json = timed_request
+
+    output_dir = args.output_dir or Path(tempfile.mkdtemp(prefix="valut_bench_"))
+    if output_dir.exists() and args.output_dir is None:
+        shutil.rmtree(output_dir)
+    aborted = None
+    start = time.perf_counter()
+    try:
+        valut.main(
+            logs_dir=corpus_dir,
+            output_dir=output_dir,
+            judge_config_path=PROJECT_DIR / "config" / "config_judge.json",
+            metrics_config_path=PROJECT_DIR / "config" / "config_metrics.json",
+            options=valut.RunOptions(
+                workers=args.workers,
+                requests_per_minute=args.rpm,
+                tokens_per_minute=args.tpm,
+                batch_metrics=args.batch_metrics,
+                use_cache=False,
+                ingest_workers=args.ingest_workers,
+                retry_policy=RetryPolicy(max_attempts=args.max_attempts),
+                judge_pool=pool_path,
+            ),
+        )
+    except FatalJudgeError as e:
+        aborted = str(e)
+    wall = time.perf_counter() - start
+    valut.request_judge_json = original_request
+    pool_stats = valut.gemini_model.stats() if isinstance(valut.gemini_model, valut.JudgePool) else None
+    for server in stand_ins:
+        server.shutdown()
+        server.server_close()
+    if pool_path is not None:
+        pool_path.unlink(missing_ok=True)
+
+    evaluations = 0
+    failed = 0
+    csv_path = output_dir / "results_summary.csv"
+    if csv_path.exists():
+        import csv
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            for row in list(csv.reader(f))[1:]:
+                for cell in row[5:]:
+                    if cell != "N/A":
+                        evaluations += 1
+                        failed += cell == "EVALUATION_FAILED"
+
+    sim = genai.simulation_stats()
+    report = {
+        "corpus": {"logs": args.logs, "turns": args.turns, "turn_chars": args.turn_chars, "bytes": corpus_bytes},
+        "settings": {
+            "workers": args.workers, "batch_metrics": args.batch_metrics, "ingest_workers": args.ingest_workers,
+            "rpm": args.rpm, "tpm": args.tpm, "latency_ms": args.latency_ms, "latency_dist": args.latency_dist,
+            "error_rate": args.error_rate, "rate_limit_rate": args.rate_limit_rate,
+            "malformed_rate": args.malformed_rate, "quota_rpm": args.quota_rpm, "quota_tpm": args.quota_tpm,
+            "seed": args.seed, "pool_endpoints": args.pool_endpoints, "pool_strategy": args.pool_strategy,
+        },
+        "wall_seconds": round(wall, 3),
+        "judge_requests": len(latencies),
+        "evaluations": evaluations,
+        "failed_evaluations": failed,
+        "evaluations_per_second": round(evaluations / wall, 2) if wall else 0.0,
+        "request_latency_seconds": {
+            "p50": round(_percentile(latencies, 50), 4),
+            "p95": round(_percentile(latencies, 95), 4),
+            "max": round(max(latencies), 4) if latencies else 0.0,
+        },
+        "simulated_judge": sim.to_dict() if sim and not stand_ins else None,
+        "pool": [dict(entry, simulated=server.simulator.stats.to_dict())
+                 for entry, server in zip(pool_stats, stand_ins)] if pool_stats else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "aborted": aborted,
+    }
+
+    if not args.keep_corpus:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+    if args.output_dir is None:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Parser delle opzioni del benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark di carico di valut.py con un giudice simulato.")
+    corpus = parser.add_argument_group("corpus sintetico")
+    corpus.add_argument("--logs", type=int, default=50, help="Numero di conversazioni da generare.")
+    corpus.add_argument("--turns", type=int, default=20, help="Turni per conversazione.")
+    corpus.add_argument("--turn-chars", type=int, default=200,
+                        help="Lunghezza approssimativa di ogni turno, in caratteri.")
+    corpus.add_argument("--corpus-dir", type=Path, default=None,
+                        help="Cartella del corpus (default: conversation_logs/benchmark_<logs>x<turns>).")
+    corpus.add_argument("--prefixed-rate", type=float, default=0.0, help="Frazione di file con testo prima del JSON.")
+    corpus.add_argument("--keep-corpus", action="store_true", help="Non cancella il corpus generato alla fine.")
+
+    judge = parser.add_argument_group("giudice simulato")
+    judge.add_argument("--latency-ms", type=float, default=200, help="Latenza media di una chiamata, in millisecondi.")
+    judge.add_argument("--latency-dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="lognormal",
+                       help="Distribuzione della latenza.")
+    judge.add_argument("--error-rate", type=float, default=0.0, help="Probabilità di un errore 503.")
+    judge.add_argument("--rate-limit-rate", type=float, default=0.0, help="Probabilità di un 429 casuale.")
+    judge.add_argument("--malformed-rate", type=float, default=0.0, help="Probabilità di una risposta JSON troncata.")
+    judge.add_argument("--quota-rpm", type=int, default=0,
+                       help="Quota di richieste al minuto del giudice (0 = nessuna).")
+    judge.add_argument("--quota-tpm", type=int, default=0, help="Quota di token al minuto del giudice (0 = nessuna).")
+    judge.add_argument("--seed", type=int, default=0, help="Seme per corpus e giudice simulato.")
+    judge.add_argument("--pool-endpoints", type=int, default=0,
+                       help="Usa un pool di N server locali compatibili con Ollama, ognuno con le proprie quote (0 = "
+                            "un solo modello simulato).")
+    judge.add_argument("--pool-strategy", choices=["least_loaded", "weighted"], default="least_loaded",
+                       help="Strategia di instradamento del pool.")
+
+    run = parser.add_argument_group("esecuzione di valut.py")
+    run.add_argument("-w", "--workers", type=int, default=4, help="Chiamate al giudice in parallelo.")
+    run.add_argument("--rpm", type=float, default=0, help="Limite di richieste al minuto di valut.py (0 = nessuno).")
+    run.add_argument("--tpm", type=float, default=0, help="Limite di token al minuto di valut.py (0 = nessuno).")
+    run.add_argument("--batch-metrics", action="store_true", help="Valuta le metriche in batch.")
+    run.add_argument("--ingest-workers", type=int, default=None, help="Processi di ingest (default: numero di core).")
+    run.add_argument("--max-attempts", type=int, default=3, help="Tentativi per chiamata.")
+    run.add_argument("-o", "--output-dir", type=Path, default=None,
+                     help="Cartella di output di valut.py (default: temporanea, cancellata).")
+    run.add_argument("--report", type=Path, default=None, help="File JSON in cui salvare il report.")
+    run.add_argument("--ingest-only", action="store_true",
+                     help="Misura solo la fase di ingest, in un singolo processo.")
+    run.add_argument("--repeat", type=int, default=3,
+                     help="Ripetizioni della misura di ingest (si riporta la migliore).")
+    run.add_argument("-q", "--quiet", action="store_true", help="Nasconde l'output di valut.py.")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Esegue il benchmark richiesto e ne stampa il riepilogo."""
+    args = build_parser().parse_args(argv)
+    if args.ingest_only:
+        report = run_ingest_benchmark(args)
+        print(f"Ingest di {args.logs} log x {args.turns} turni ({report['corpus']['bytes'] / 1e6:.1f} MB), "
+              f"backend JSON '{report['json_backend']}': {report['logs_per_second']} log/s, "
+              f"{report['mb_per_second']} MB/s (migliore di {len(report['runs_seconds'])}: {report['best_seconds']}s)")
+        if args.report:
+            args.report.parent.mkdir(parents=True, exist_ok=True)
+            args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        return 0
+    report = run_benchmark(args)
+    latency = report["request_latency_seconds"]
+    print(f"Log: {args.logs} x {args.turns} turni ({report['corpus']['bytes'] / 1e6:.1f} MB)")
+    print(f"Tempo totale: {report['wall_seconds']:.2f}s")
+    print(f"Valutazioni: {report['evaluations']} ({report['failed_evaluations']} fallite), "
+          f"{report['evaluations_per_second']:.2f} valutazioni/s")
+    print(f"Richieste al giudice: {report['judge_requests']}, latenza p50 {latency['p50'] * 1000:.0f} ms, "
+          f"p95 {latency['p95'] * 1000:.0f} ms")
+    print(f"Picco RSS: {report['peak_rss_mb']['self']} MB (processi figli {report['peak_rss_mb']['children']} MB)")
+    if report["simulated_judge"]:
+        print(f"Giudice simulato: {report['simulated_judge']}")
+    for entry in report["pool"] or []:
+        print(f"Endpoint {entry['name']}: {entry['calls']} chiamate, {entry['errors']} errori, "
+              f"max {entry['peak_in_flight']} in volo, simulatore {entry['simulated']}")
+    if report["aborted"]:
+        print(f"Valutazione interrotta: {report['aborted']}")
+    if args.report:
+        args.report.parent.mkdir(parents=True, exist_ok=True)
+        args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Report salvato in: {args.report}")
+    return 1 if report["aborted"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
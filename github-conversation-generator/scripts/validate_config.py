@@ -1,3 +1,5 @@
+"""Check that the judge and metrics config files load as valid JSON."""
+
 import json
 import sys
 from pathlib import Path
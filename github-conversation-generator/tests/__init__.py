@@ -0,0 +1 @@
+"""Test di `evaluation` e `valut.py` contro il giudice simulato locale (nessuna chiamata di rete esterna)."""
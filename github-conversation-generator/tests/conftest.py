@@ -0,0 +1,27 @@
+"""Fixture comuni: orologio manuale per retry, circuit breaker e pool senza attese reali."""
+
+import pytest
+
+
+class FakeClock:
+    """Orologio manuale: `sleep` lo fa avanzare invece di attendere."""
+
+    def __init__(self, start: float = 1000.0):
+        """Parte da `start` secondi, senza attese registrate."""
+        self.now = start
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        """Istante corrente, come `time.monotonic`."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Registra l'attesa e fa avanzare l'orologio."""
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    """Orologio manuale nuovo per ogni test."""
+    return FakeClock()
@@ -0,0 +1,32 @@
+"""Esecuzione di prova di `scripts/benchmark.py`: un cambio di firma in `valut.py` non deve romperlo."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("rich", reason="valut.py richiede rich")
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.mark.parametrize("extra", [[], ["--pool-endpoints", "2", "--batch-metrics"]], ids=["modello", "pool-batch"])
+def test_benchmark_smoke(tmp_path, extra):
+    """Un corpus minimo viene valutato per intero dal giudice simulato, senza valutazioni fallite."""
+    report_path = tmp_path / "report.json"
+    env = {k: v for k, v in os.environ.items() if not k.startswith("GENAI_SIM_")}
+    result = subprocess.run(
+        [sys.executable, str(PROJECT_DIR / "scripts" / "benchmark.py"), "--logs", "3", "--turns", "4",
+         "--latency-ms", "0", "--quiet", "--corpus-dir", str(tmp_path / "corpus"), "-o", str(tmp_path / "out"),
+         "--report", str(report_path), *extra],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    assert report["aborted"] is None
+    assert report["evaluations"] == 30
+    assert report["failed_evaluations"] == 0
+    assert report["judge_requests"] > 0
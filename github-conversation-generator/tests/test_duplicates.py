@@ -0,0 +1,61 @@
+"""Deduplicazione esatta in `valut.py`: le chiamate evitate sono quelle inviate davvero per la prima copia."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("rich", reason="valut.py richiede rich")
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def write_log(path: Path, root_cause: str) -> None:
+    """Scrive un log minimo (due agenti, quattro turni) con la struttura dei log reali."""
+    persona = {"persona_configuration": {"profile_name": path.parent.name}}
+    log = {
+        "agents": [
+            {"name": "Agent_1", "system_prompt": {"root_cause": root_cause, "ticket": "la macchina si ferma"}},
+            {"name": "Agent_2", "system_prompt": f"Sei un tecnico. {json.dumps(persona)}"},
+        ],
+        "conversation": [{"speaker": f"Agent_{t % 2 + 1}", "message": f"turno {t} su {root_cause}"}
+                         for t in range(4)],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(log), encoding="utf-8")
+
+
+def calls_saved(logs_dir: Path, output_dir: Path, config_dir: Path, *extra: str) -> int:
+    """Esegue valut.py con il modello stub e ritorna le chiamate evitate riportate in `run_report.json`."""
+    env = {k: v for k, v in os.environ.items() if not k.startswith("GENAI_SIM_")}
+    env["GOOGLE_API_KEY"] = "test"
+    result = subprocess.run(
+        [sys.executable, str(PROJECT_DIR / "valut.py"), "-i", str(logs_dir), "-o", str(output_dir),
+         "-c", str(config_dir), "--rpm", "0", "--no-cache", *extra],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    report = json.loads((output_dir / "run_report.json").read_text(encoding="utf-8"))
+    return report["counters"]["duplicate_calls_saved"]
+
+
+def test_incremental_counts_only_recomputed_calls_as_saved(tmp_path):
+    """Con `--incremental` il duplicato evita solo la chiamata della metrica modificata, non quelle riusate."""
+    logs_dir = tmp_path / "logs"
+    write_log(logs_dir / "expert" / "scen1_approach_a_high.json", "fusibile 1")
+    write_log(logs_dir / "expert" / "scen2_approach_a_high.json", "fusibile 1")
+    config_dir = tmp_path / "config"
+    shutil.copytree(PROJECT_DIR / "config", config_dir)
+    output_dir = tmp_path / "out"
+
+    assert calls_saved(logs_dir, output_dir, config_dir) > 1
+
+    metrics_path = config_dir / "config_metrics.json"
+    metrics = json.loads(metrics_path.read_text(encoding="utf-8"))
+    metrics[0]["description"] += " (rivista)"
+    metrics_path.write_text(json.dumps(metrics, ensure_ascii=False), encoding="utf-8")
+    assert calls_saved(logs_dir, output_dir, config_dir, "--incremental") == 1
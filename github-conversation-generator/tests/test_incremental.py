@@ -0,0 +1,24 @@
+"""Chiavi dei log per l'esecuzione incrementale."""
+
+import pytest
+
+from evaluation.incremental import log_key
+
+
+@pytest.mark.parametrize(("log_file", "expected"), [
+    ("prof/scen.json", "prof/scen.json"),
+    ("prof/scen.json#2", "prof/scen.json#2"),
+    ("prof/scen#v2.json", "prof/scen#v2.json"),
+    ("prof/scen#v2.json#0", "prof/scen#v2.json#0"),
+    ("prof#1/scen.json", "prof#1/scen.json"),
+    ("prof#1/scen.json#3", "prof#1/scen.json#3"),
+])
+def test_log_key_relative_to_logs_dir(tmp_path, log_file, expected):
+    """Solo un `#k` numerico finale è l'indice della conversazione; gli altri `#` fanno parte del percorso."""
+    assert log_key(str(tmp_path / log_file), tmp_path) == expected
+
+
+def test_log_key_same_for_relative_and_absolute_paths(tmp_path, monkeypatch):
+    """La chiave non dipende da come è stata indicata la cartella dei log."""
+    monkeypatch.chdir(tmp_path)
+    assert log_key("logs/a#b.json#1", tmp_path / "logs") == log_key(str(tmp_path / "logs/a#b.json#1"), "logs")
@@ -0,0 +1,227 @@
+"""`JudgePool` contro server HTTP locali compatibili con Ollama: strategie, failover, esclusione e validazione."""
+
+import json
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from evaluation.pool import BackendHTTPError, JudgePool, OllamaModel, PoolEndpoint, load_pool
+from evaluation.retry import FATAL, classify_error
+
+OK = (200, {"response": json.dumps({"Score": "4", "Justification": "ok"})}, {})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        status, payload, headers = self.server.next_response(body)
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class OllamaStandIn(ThreadingHTTPServer):
+    """Server locale `POST /api/generate` che restituisce le risposte in coda, poi risposte valide."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        """Server su una porta libera di 127.0.0.1, avviato in un thread."""
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.responses: deque[tuple[int, dict | bytes, dict]] = deque()
+        self.requests: list[dict] = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    @property
+    def host(self) -> str:
+        """Indirizzo da passare a `OllamaModel`."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def fail(self, status: int, times: int = 1, headers: dict | None = None, message: str = "errore simulato"):
+        """Accoda `times` risposte di errore `status`."""
+        for _ in range(times):
+            self.responses.append((status, {"error": message}, headers or {}))
+
+    def next_response(self, body: dict) -> tuple[int, dict | bytes, dict]:
+        """Registra la richiesta e ritorna la prossima risposta in coda."""
+        with self._lock:
+            self.requests.append(body)
+            return self.responses.popleft() if self.responses else OK
+
+
+@pytest.fixture
+def stand_ins():
+    """Fabbrica di server locali, chiusi alla fine del test."""
+    servers = []
+
+    def make() -> OllamaStandIn:
+        server = OllamaStandIn()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def endpoint(server: OllamaStandIn, name: str, **kwargs) -> PoolEndpoint:
+    """Endpoint del pool sul server `server`."""
+    return PoolEndpoint(name, OllamaModel(f"llama-{name}", host=server.host, timeout=5.0), **kwargs)
+
+
+def test_least_loaded_prefers_weight_and_free_quota(stand_ins):
+    """`least_loaded` sceglie il peso maggiore, ma non un endpoint che deve attendere la quota."""
+    a, b = stand_ins(), stand_ins()
+    pool = JudgePool([endpoint(a, "a", weight=1.0), endpoint(b, "b", weight=3.0, requests_per_minute=1)])
+    for _ in range(4):
+        assert json.loads(pool.generate_content("prompt").text)["Score"] == "4"
+    assert len(b.requests) == 1
+    assert len(a.requests) == 3
+
+
+def test_weighted_round_robin(stand_ins):
+    """`weighted` distribuisce le chiamate in proporzione ai pesi, alternandole."""
+    a, b = stand_ins(), stand_ins()
+    pool = JudgePool([endpoint(a, "a", weight=3.0), endpoint(b, "b", weight=1.0)], strategy="weighted")
+    order = []
+    for _ in range(8):
+        served = len(a.requests)
+        pool.generate_content("prompt")
+        order.append("a" if len(a.requests) > served else "b")
+    assert order == ["a", "a", "b", "a"] * 2
+
+
+def test_failover_to_next_endpoint(stand_ins, clock):
+    """Un errore su un endpoint passa subito la chiamata al successivo."""
+    a, b = stand_ins(), stand_ins()
+    a.fail(503)
+    pool = JudgePool([endpoint(a, "a"), endpoint(b, "b")], clock=clock)
+    assert json.loads(pool.generate_content("prompt").text)["Score"] == "4"
+    assert pool.failovers == 1
+    assert (len(a.requests), len(b.requests)) == (1, 1)
+    assert pool.endpoints[0].errors == 1
+    assert pool.endpoints[0].ejections == 0
+
+
+def test_ejection_after_failure_threshold(stand_ins, clock):
+    """Dopo `failure_threshold` errori consecutivi l'endpoint resta escluso per `cooldown` secondi."""
+    a, b = stand_ins(), stand_ins()
+    a.fail(503, times=2)
+    pool = JudgePool([endpoint(a, "a"), endpoint(b, "b")], failure_threshold=2, cooldown=30.0, clock=clock)
+    pool.generate_content("prompt")
+    assert pool.endpoints[0].ejections == 0
+    pool.generate_content("prompt")
+    assert pool.endpoints[0].ejections == 1
+    assert pool.endpoints[0].ejected_until == clock.now + 30.0
+    pool.generate_content("prompt")
+    assert len(a.requests) == 2
+    clock.now += 30.0
+    pool.generate_content("prompt")
+    assert len(a.requests) == 3
+
+
+def test_retry_after_cooldown(stand_ins, clock):
+    """Un 429 con `Retry-After` esclude subito l'endpoint per il tempo indicato."""
+    a, b = stand_ins(), stand_ins()
+    a.fail(429, headers={"Retry-After": "12"}, message="Resource has been exhausted")
+    pool = JudgePool([endpoint(a, "a"), endpoint(b, "b")], failure_threshold=5, cooldown=30.0, clock=clock)
+    pool.generate_content("prompt")
+    assert pool.endpoints[0].ejected_until == clock.now + 12.0
+    clock.now += 11.0
+    pool.generate_content("prompt")
+    assert len(a.requests) == 1
+    clock.now += 1.0
+    pool.generate_content("prompt")
+    assert len(a.requests) == 2
+
+
+def test_fatal_error_disables_endpoint(stand_ins, clock):
+    """Un errore irreversibile (404) disattiva l'endpoint per il resto dell'esecuzione."""
+    a, b = stand_ins(), stand_ins()
+    a.fail(404, message="model 'llama-a' not found")
+    pool = JudgePool([endpoint(a, "a"), endpoint(b, "b")], clock=clock)
+    pool.generate_content("prompt")
+    assert pool.endpoints[0].disabled
+    clock.now += 3600.0
+    for _ in range(3):
+        pool.generate_content("prompt")
+    assert len(a.requests) == 1
+    assert len(b.requests) == 4
+
+
+def test_all_endpoints_disabled_raises_fatal(stand_ins, clock):
+    """Con tutti gli endpoint disattivati la chiamata solleva l'errore irreversibile."""
+    a = stand_ins()
+    a.fail(404, message="model not found")
+    pool = JudgePool([endpoint(a, "a")], clock=clock)
+    with pytest.raises(BackendHTTPError) as info:
+        pool.generate_content("prompt")
+    assert classify_error(info.value) == FATAL
+    with pytest.raises(BackendHTTPError):
+        pool.generate_content("prompt")
+    assert len(a.requests) == 1
+
+
+def test_malformed_response_is_not_a_failure(stand_ins, clock):
+    """Una risposta non JSON passa all'endpoint successivo ma non conta per l'esclusione."""
+    a, b = stand_ins(), stand_ins()
+    a.responses.append((200, b"<html>proxy error</html>", {}))
+    pool = JudgePool([endpoint(a, "a"), endpoint(b, "b")], failure_threshold=1, clock=clock)
+    pool.generate_content("prompt")
+    assert pool.endpoints[0].errors == 1
+    assert pool.endpoints[0].ejections == 0
+
+
+@pytest.mark.parametrize(("config", "message"), [
+    ([], "array 'endpoints'"),
+    ({"endpoints": {}}, "array 'endpoints'"),
+    ({"endpoints": []}, "non ha endpoint"),
+    ({"endpoints": [{"backend": "ollama"}]}, "manca 'model'"),
+    ({"endpoints": [{"backend": "vllm", "model": "m"}]}, "backend sconosciuto"),
+    ({"endpoints": [{"backend": "genai", "model": "m"}]}, "backend 'genai' non disponibile"),
+    ({"endpoints": [{"backend": "gemini", "model": "m", "api_key_env": "POOL_TEST_MISSING_KEY"}]},
+     "POOL_TEST_MISSING_KEY non impostata"),
+    ({"endpoints": [{"backend": "ollama", "model": "m", "weight": 0}]}, "peso deve essere positivo"),
+    ({"endpoints": [{"backend": "ollama", "model": "m", "name": "x"},
+                    {"backend": "ollama", "model": "n", "name": "x"}]}, "devono essere unici"),
+    ({"strategy": "random", "endpoints": [{"backend": "ollama", "model": "m"}]}, "strategia del pool sconosciuta"),
+])
+def test_load_pool_validation(monkeypatch, config, message):
+    """Configurazioni non valide sollevano ValueError con un messaggio chiaro."""
+    monkeypatch.delenv("POOL_TEST_MISSING_KEY", raising=False)
+    with pytest.raises(ValueError, match=message):
+        load_pool(config)
+
+
+def test_load_pool_builds_endpoints(monkeypatch, stand_ins):
+    """Una configurazione valida crea gli endpoint con backend, pesi e parametri del pool."""
+    server = stand_ins()
+    monkeypatch.setenv("POOL_TEST_KEY", "chiave")
+    pool = load_pool({
+        "strategy": "weighted", "failure_threshold": 4, "cooldown_seconds": 12,
+        "endpoints": [
+            {"backend": "ollama", "model": "llama3", "host": server.host.removeprefix("http://"), "weight": 2},
+            {"backend": "gemini", "model": "gemini-x", "api_key_env": "POOL_TEST_KEY", "rpm": 60},
+        ],
+    })
+    assert pool.strategy == "weighted"
+    assert (pool.failure_threshold, pool.cooldown) == (4, 12.0)
+    ollama, gemini = pool.endpoints
+    assert ollama.model.host == server.host
+    assert ollama.weight == 2.0
+    assert gemini.limiter is not None
+    assert pool.model_name == "pool:gemini-x+llama3"
+    assert json.loads(ollama.model.generate_content("prompt").text)["Score"] == "4"
+    assert server.requests[0]["model"] == "llama3"
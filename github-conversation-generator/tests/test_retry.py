@@ -0,0 +1,299 @@
+"""Politica di retry, circuit breaker e `JudgeRetrier` contro il giudice simulato con guasti iniettati."""
+
+import email.utils
+import json
+import random
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from evaluation.retry import (
+    FATAL,
+    MALFORMED,
+    RATE_LIMITED,
+    REJECTED,
+    TRANSIENT,
+    UNAVAILABLE,
+    CircuitBreaker,
+    CircuitOpenError,
+    FatalJudgeError,
+    JudgeRetrier,
+    MalformedResponseError,
+    RequestRejectedError,
+    RetriesExhaustedError,
+    RetryPolicy,
+    classify_error,
+    retry_after,
+)
+from google.generativeai import SimulatedAPIError, SimulationConfig, create_simulator
+
+
+class StatusError(Exception):
+    """Errore con lo stato HTTP in `code`, come i client ufficiali."""
+
+    def __init__(self, code: int, message: str = "errore"):
+        """Errore `code` con il testo `message`."""
+        super().__init__(message)
+        self.code = code
+
+
+@pytest.mark.parametrize(("status", "kind"), [
+    (429, RATE_LIMITED), (503, UNAVAILABLE), (500, UNAVAILABLE), (408, UNAVAILABLE),
+    (404, FATAL), (403, FATAL), (401, FATAL), (400, REJECTED), (418, TRANSIENT),
+])
+def test_classify_error_by_status(status, kind):
+    """Lo stato HTTP, se presente, decide la classe."""
+    assert classify_error(StatusError(status)) == kind
+
+
+@pytest.mark.parametrize(("message", "kind"), [
+    ("Deadline exceeded after 1404 ms", UNAVAILABLE),
+    ("processed 4040 rows", TRANSIENT),
+    ("HTTP 404: models/gemini-x is not found", FATAL),
+    ("Resource has been exhausted (e.g. check quota).", RATE_LIMITED),
+    ("429 Too Many Requests", RATE_LIMITED),
+    ("503 Service Unavailable", UNAVAILABLE),
+    ("connection reset by peer", UNAVAILABLE),
+    ("PERMISSION_DENIED: caller does not have permission", FATAL),
+    ("400 API key not valid. Please pass a valid API key.", FATAL),
+    ("INVALID_ARGUMENT: request payload size exceeds the limit", REJECTED),
+    ("qualcosa è andato storto", TRANSIENT),
+])
+def test_classify_error_by_message(message, kind):
+    """Senza stato HTTP conta il testo, solo per parole e codici interi."""
+    assert classify_error(RuntimeError(message)) == kind
+
+
+def test_classify_error_by_type():
+    """Risposte non JSON e timeout di rete hanno una classe propria."""
+    assert classify_error(json.JSONDecodeError("x", "{", 0)) == MALFORMED
+    assert classify_error(MalformedResponseError("risposta non JSON: model not found")) == MALFORMED
+    assert classify_error(TimeoutError("read")) == UNAVAILABLE
+    assert classify_error(ConnectionRefusedError()) == UNAVAILABLE
+
+
+@pytest.mark.parametrize(("message", "kind"), [
+    ("API key not valid. Please pass a valid API key.", FATAL),
+    ("403 Permission denied on resource", FATAL),
+    ("models/gemini-x is not found for API version v1beta", FATAL),
+    ("invalid literal for int() with base 10: 'x'", TRANSIENT),
+])
+def test_classify_value_error_by_message(message, kind):
+    """Un ValueError qualunque (non una risposta malformata) viene classificato dal testo, come gli altri errori."""
+    assert classify_error(ValueError(message)) == kind
+
+
+def test_classify_error_invalid_key_with_status_400():
+    """Una chiave non valida resta irreversibile anche se arriva come 400."""
+    assert classify_error(StatusError(400, "API key not valid. Please pass a valid API key.")) == FATAL
+    assert classify_error(StatusError(400, "prompt blocked")) == REJECTED
+
+
+def test_retry_after_from_attribute_and_headers():
+    """Il suggerimento del server arriva da attributi o dall'header `Retry-After`."""
+    assert retry_after(SimulatedAPIError(429, "quota", retry_after=2.5)) == 2.5
+    error = RuntimeError("429")
+    error.headers = {"Retry-After": "7"}
+    assert retry_after(error) == 7.0
+    error = RuntimeError("429")
+    error.response = SimpleNamespace(status_code=429, headers={"retry-after": "3"})
+    assert retry_after(error) == 3.0
+
+
+def test_retry_after_http_date():
+    """`Retry-After` come data HTTP: secondi mancanti, mai negativi."""
+    when = datetime.now(UTC) + timedelta(seconds=30)
+    error = RuntimeError("503")
+    error.headers = {"Retry-After": email.utils.format_datetime(when, usegmt=True)}
+    assert 25 <= retry_after(error) <= 30
+    error.headers = {"Retry-After": email.utils.format_datetime(when - timedelta(hours=1), usegmt=True)}
+    assert retry_after(error) == 0.0
+
+
+def test_retry_after_from_message():
+    """Senza header si legge il testo dell'errore ("retry in Ns", `retry_delay`)."""
+    assert retry_after(RuntimeError("Quota exceeded. Please retry in 12.5s.")) == 12.5
+    assert retry_after(RuntimeError("429 quota retry_delay { seconds: 40 }")) == 40.0
+    assert retry_after(RuntimeError("503 unavailable")) is None
+
+
+def test_retry_policy_delay_bounds():
+    """Il jitter resta tra 0 e il ritardo esponenziale, limitato da `max_delay`."""
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0, multiplier=2.0, jitter=1.0)
+    rng = random.Random(1)
+    for attempt in range(8):
+        ceiling = min(10.0, 2.0 ** attempt)
+        for _ in range(50):
+            assert 0.0 <= policy.delay(attempt, UNAVAILABLE, None, rng) <= ceiling
+
+
+def test_retry_policy_without_jitter_and_server_hint():
+    """Senza jitter il ritardo è esatto; il Retry-After vale solo per 429/503 ed è limitato."""
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0, jitter=0.0, max_retry_after=60.0)
+    rng = random.Random(0)
+    assert [policy.delay(a, UNAVAILABLE, None, rng) for a in range(5)] == [1.0, 2.0, 4.0, 8.0, 10.0]
+    assert policy.delay(0, RATE_LIMITED, 30.0, rng) == 30.0
+    assert policy.delay(0, RATE_LIMITED, 600.0, rng) == 60.0
+    assert policy.delay(0, MALFORMED, 30.0, rng) == 1.0
+
+
+def test_retry_policy_validation():
+    """Parametri fuori intervallo vengono rifiutati."""
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
+    with pytest.raises(ValueError):
+        RetryPolicy(jitter=1.5)
+
+
+def test_circuit_breaker_transitions(clock):
+    """Il circuito si apre dopo la soglia, passa a half_open dopo il cooldown e si chiude se la prova riesce."""
+    breaker = CircuitBreaker("m", failure_threshold=2, cooldown=30.0, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.times_opened == 1
+    clock.now += 30.0
+    assert breaker.before_call() == 0.0
+    assert breaker.state == "half_open"
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_circuit_breaker_failed_probe_reopens(clock):
+    """Una prova fallita riapre subito il circuito."""
+    breaker = CircuitBreaker("m", failure_threshold=3, cooldown=10.0, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 10.0
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+
+
+def test_circuit_breaker_max_trips(clock):
+    """Dopo `max_trips` aperture consecutive senza successi il breaker rinuncia."""
+    breaker = CircuitBreaker("m", failure_threshold=1, cooldown=5.0, max_trips=2, clock=clock)
+    breaker.record_failure()
+    clock.now += 5.0
+    breaker.before_call()
+    breaker.record_failure()
+    clock.now += 5.0
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_circuit_breaker_disabled(clock):
+    """`failure_threshold=0` disattiva il breaker."""
+    breaker = CircuitBreaker("m", failure_threshold=0, clock=clock)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.before_call() == 0.0
+
+
+def faulty(simulator, failures: int):
+    """Chiamata al simulatore che fallisce con il guasto configurato per le prime `failures` volte, poi risponde."""
+    fault = simulator.config
+
+    def call() -> dict:
+        simulator.config = fault if simulator.stats.calls < failures else SimulationConfig()
+        return json.loads(simulator.call("valuta la conversazione"))
+
+    return call
+
+
+def make_retrier(clock, **kwargs) -> JudgeRetrier:
+    """Retrier senza jitter, con attese e circuit breaker sull'orologio manuale."""
+    policy = kwargs.pop("policy", RetryPolicy(max_attempts=3, base_delay=0.5, jitter=0.0))
+    return JudgeRetrier(policy, sleep=clock.sleep, clock=clock, seed=0, **kwargs)
+
+
+@pytest.mark.parametrize(("fault", "kind", "sleeps"), [
+    ({"error_rate": 1.0}, UNAVAILABLE, [0.5, 1.0]),
+    ({"rate_limit_rate": 1.0}, RATE_LIMITED, [1.0, 1.0]),
+    ({"malformed_rate": 1.0}, MALFORMED, [0.5, 1.0]),
+])
+def test_retrier_recovers_from_transient_faults(clock, fault, kind, sleeps):
+    """503, 429 (con Retry-After) e JSON troncato vengono ripetuti finché il giudice risponde."""
+    simulator = create_simulator(**fault)
+    retrier = make_retrier(clock)
+    result = retrier.call("simulated", faulty(simulator, failures=2))
+    assert result["Score"] == "STUB"
+    assert simulator.stats.calls == 3
+    assert retrier.retries == 2
+    assert retrier.errors == {kind: 2}
+    assert clock.sleeps == sleeps
+
+
+def test_retrier_not_found_is_fatal(clock):
+    """Un 404 non viene ripetuto e diventa `FatalJudgeError`."""
+    simulator = create_simulator(not_found_rate=1.0)
+    retrier = make_retrier(clock)
+    with pytest.raises(FatalJudgeError):
+        retrier.call("simulated", faulty(simulator, failures=5))
+    assert simulator.stats.calls == 1
+    assert clock.sleeps == []
+    assert retrier.breaker("simulated").state == "closed"
+
+
+def test_retrier_rejected_request_fails_only_that_call(clock):
+    """Un 400 non viene ripetuto e non è irreversibile per l'esecuzione."""
+    calls = []
+
+    def rejected():
+        calls.append(1)
+        raise SimulatedAPIError(400, "Request payload size exceeds the limit")
+
+    retrier = make_retrier(clock)
+    with pytest.raises(RequestRejectedError) as info:
+        retrier.call("simulated", rejected)
+    assert isinstance(info.value, RetriesExhaustedError)
+    assert not isinstance(info.value, FatalJudgeError)
+    assert info.value.attempts == 1
+    assert len(calls) == 1
+
+
+def test_retrier_exhausts_attempts(clock):
+    """Con errori temporanei continui si arrende dopo `max_attempts` tentativi."""
+    simulator = create_simulator(error_rate=1.0)
+    retrier = make_retrier(clock, failure_threshold=0)
+    with pytest.raises(RetriesExhaustedError) as info:
+        retrier.call("simulated", faulty(simulator, failures=10))
+    assert info.value.kind == UNAVAILABLE
+    assert info.value.attempts == 3
+    assert simulator.stats.calls == 3
+
+
+def test_retrier_breaker_max_trips_is_fatal(clock):
+    """Il breaker aperto `max_trips` volte di seguito interrompe con `FatalJudgeError`."""
+    simulator = create_simulator(error_rate=1.0)
+    policy = RetryPolicy(max_attempts=5, base_delay=10.0, jitter=0.0)
+    retrier = make_retrier(clock, policy=policy, failure_threshold=1, cooldown=5.0, max_trips=2)
+    with pytest.raises(FatalJudgeError) as info:
+        retrier.call("simulated", faulty(simulator, failures=10))
+    assert isinstance(info.value.cause, CircuitOpenError)
+    assert simulator.stats.calls == 2
+
+
+def test_retrier_releases_probe_on_interrupt(clock):
+    """Una chiamata di prova interrotta (KeyboardInterrupt) non lascia il circuito bloccato."""
+    simulator = create_simulator(error_rate=1.0)
+    policy = RetryPolicy(max_attempts=1)
+    retrier = make_retrier(clock, policy=policy, failure_threshold=1, cooldown=5.0)
+    with pytest.raises(RetriesExhaustedError):
+        retrier.call("simulated", faulty(simulator, failures=1))
+    clock.now += 5.0
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        retrier.call("simulated", interrupted)
+    breaker = retrier.breaker("simulated")
+    assert breaker.state == "half_open"
+    assert not breaker._probing
+    assert retrier.call("simulated", faulty(simulator, failures=0))["Score"] == "STUB"
+    assert breaker.state == "closed"
@@ -0,0 +1,216 @@
+"""Servizio HTTP di valutazione: micro-batch, deduplicazione nel batch e risposte di errore."""
+
+import http.client
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from evaluation import service as service_module
+from evaluation.service import EvaluationService, MicroBatcher, PayloadError, make_server
+
+TURNS = [{"role": "user", "content": "ciao"}, {"role": "assistant", "content": "salve"}]
+
+
+class FakeJudge:
+    """`evaluate_batch` locale: registra i batch ricevuti e assegna a ogni conversazione un punteggio fisso."""
+
+    def __init__(self):
+        """Nessun batch ricevuto."""
+        self.batches: list[list[dict]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, convs: list[dict]) -> list[dict]:
+        """Ritorna una risposta per conversazione, nello stesso ordine."""
+        with self._lock:
+            self.batches.append(convs)
+        return [{"sim_id": conv["sim_id"], "scores": {"Coerenza": 4}} for conv in convs]
+
+
+def collect_batches(window: float, max_batch: int) -> tuple[MicroBatcher, list[list]]:
+    """MicroBatcher che ritorna gli elementi raddoppiati e registra i batch ricevuti."""
+    batches: list[list] = []
+
+    def process(items: list) -> list:
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    return MicroBatcher(process, window=window, max_batch=max_batch), batches
+
+
+def test_window_groups_concurrent_items():
+    """Gli elementi arrivati entro la finestra formano un solo batch."""
+    batcher, batches = collect_batches(window=0.3, max_batch=16)
+    try:
+        futures = [batcher.submit(i) for i in range(3)]
+        assert [future.result(timeout=5) for future in futures] == [(0, 3), (2, 3), (4, 3)]
+    finally:
+        batcher.close()
+    assert batches == [[0, 1, 2]]
+    assert (batcher.batches, batcher.largest_batch) == (1, 3)
+
+
+def test_max_batch_closes_window_early():
+    """Raggiunto `max_batch` il batch parte senza attendere la fine della finestra."""
+    batcher, batches = collect_batches(window=30.0, max_batch=2)
+    try:
+        futures = [batcher.submit(i) for i in range(4)]
+        assert [future.result(timeout=5)[0] for future in futures] == [0, 2, 4, 6]
+    finally:
+        batcher.close()
+    assert sorted(batches) == [[0, 1], [2, 3]]
+
+
+def test_missing_results_fail_leftover_futures():
+    """Se `process` ritorna meno risultati degli elementi, le richieste rimaste falliscono invece di restare appese."""
+    batcher = MicroBatcher(lambda items: items[:1], window=0.3, max_batch=3)
+    try:
+        futures = [batcher.submit(i) for i in range(3)]
+        assert futures[0].result(timeout=5) == (0, 3)
+        for future in futures[1:]:
+            with pytest.raises(RuntimeError, match="1 risultati per 3 richieste"):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+
+
+def test_process_error_fails_whole_batch():
+    """Un'eccezione di `process` viene propagata a tutte le richieste del batch."""
+
+    def process(items: list) -> list:
+        raise ValueError("giudice non disponibile")
+
+    batcher = MicroBatcher(process, window=0.3, max_batch=2)
+    try:
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            with pytest.raises(ValueError, match="giudice non disponibile"):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+
+
+def test_submit_after_close_raises():
+    """Dopo `close()` non si accettano nuove richieste."""
+    batcher, _ = collect_batches(window=0.0, max_batch=1)
+    batcher.close()
+    with pytest.raises(RuntimeError, match="in chiusura"):
+        batcher.submit(1)
+
+
+def test_identical_requests_evaluated_once():
+    """Richieste identiche nello stesso batch arrivano al giudice una sola volta."""
+    judge = FakeJudge()
+    service = EvaluationService(judge, window=0.3, max_batch=16)
+    payload = json.dumps(TURNS).encode("utf-8")
+    try:
+        with ThreadPoolExecutor(3) as pool:
+            results = list(pool.map(lambda name: service.evaluate(payload, name, "prof"), ["a", "a", "b"]))
+    finally:
+        service.close()
+    assert [result["sim_id"] for result in results] == ["Sim_001_a", "Sim_001_a", "Sim_001_b"]
+    assert [result["batch_size"] for result in results] == [3, 3, 3]
+    assert len(judge.batches) == 1
+    assert sorted(conv["sim_id"] for conv in judge.batches[0]) == ["Sim_001_a", "Sim_001_b"]
+
+
+@pytest.mark.parametrize(("payload", "name", "message"), [
+    (b"{non json", None, "JSON non valido"),
+    (b"42", None, "oggetto di log o una lista di turni"),
+    (json.dumps(TURNS).encode("utf-8"), "../fuori", "nome non valido"),
+])
+def test_invalid_payload_raises(payload, name, message):
+    """Corpi o nomi non validi sollevano `PayloadError` e contano come `invalid_request`."""
+    judge = FakeJudge()
+    service = EvaluationService(judge, window=0.0)
+    try:
+        with pytest.raises(PayloadError, match=message):
+            service.evaluate(payload, name)
+    finally:
+        service.close()
+    assert service.errors == {"invalid_request": 1}
+    assert judge.batches == []
+
+
+@pytest.fixture
+def server():
+    """Servizio con il giudice locale, in ascolto su una porta libera di 127.0.0.1."""
+    service = EvaluationService(FakeJudge(), window=0.0)
+    httpd = make_server(service, port=0)
+    threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+
+
+def request(httpd, method: str, path: str, body: bytes | None = None,
+            headers: dict | None = None) -> tuple[int, bytes]:
+    """Invia una richiesta al server e ritorna stato e corpo della risposta."""
+    connection = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+    try:
+        connection.putrequest(method, path)
+        for name, value in (headers or {}).items():
+            connection.putheader(name, value)
+        if body is not None and "Content-Length" not in (headers or {}):
+            connection.putheader("Content-Length", str(len(body)))
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def test_evaluate_and_status(server):
+    """`POST /evaluate` risponde con i punteggi e `/status` conta richieste e micro-batch."""
+    status, body = request(server, "POST", "/evaluate?name=scen_a&profile=prof", json.dumps(TURNS).encode("utf-8"))
+    assert status == 200
+    result = json.loads(body)
+    assert result["sim_id"] == "Sim_001_scen_a"
+    assert result["scores"] == {"Coerenza": 4}
+    assert result["batch_size"] == 1
+    status, body = request(server, "GET", "/status")
+    assert status == 200
+    report = json.loads(body)
+    assert report["requests"] == 1
+    assert report["errors"] == {}
+    assert report["in_flight"] == 0
+    assert report["micro_batches"]["batches"] == 1
+    assert report["latency_seconds"]["samples"] == 1
+
+
+def test_invalid_body_is_400(server):
+    """Un corpo non valido risponde 400 ed è contato tra gli errori di `/status`."""
+    status, body = request(server, "POST", "/evaluate", b"{non json")
+    assert status == 400
+    assert "JSON non valido" in json.loads(body)["error"]
+    assert json.loads(request(server, "GET", "/status")[1])["errors"] == {"invalid_request": 1}
+
+
+def test_negative_content_length_is_400(server):
+    """Un `Content-Length` negativo viene rifiutato senza leggere il corpo."""
+    status, body = request(server, "POST", "/evaluate", b"", {"Content-Length": "-1"})
+    assert status == 400
+    assert "Content-Length non valido" in json.loads(body)["error"]
+
+
+def test_missing_content_length_is_411(server):
+    """Senza `Content-Length` il servizio risponde 411."""
+    assert request(server, "POST", "/evaluate")[0] == 411
+
+
+def test_body_too_large_is_413(server, monkeypatch):
+    """Un corpo oltre `MAX_BODY_BYTES` risponde 413."""
+    monkeypatch.setattr(service_module, "MAX_BODY_BYTES", 8)
+    status, body = request(server, "POST", "/evaluate", json.dumps(TURNS).encode("utf-8"))
+    assert status == 413
+    assert "corpo troppo grande" in json.loads(body)["error"]
+
+
+@pytest.mark.parametrize(("method", "path"), [("GET", "/sconosciuto"), ("POST", "/status"), ("GET", "/metrics")])
+def test_unknown_path_is_404(server, method, path):
+    """Percorsi sconosciuti (e `/metrics` senza metriche configurate) rispondono 404."""
+    status, body = request(server, method, path, b"" if method == "POST" else None)
+    assert status == 404
+    assert "percorso sconosciuto" in json.loads(body)["error"]
@@ -0,0 +1,40 @@
+"""Ordinamento dei Sim_ID e suddivisione del corpus tra shard."""
+
+import pytest
+
+from evaluation.shard import ShardSpec, shard_of, sim_index
+
+
+@pytest.mark.parametrize(("sim_id", "expected"), [
+    ("Sim_007_scen", (7, -1)),
+    ("Sim_007_scen#2", (7, 2)),
+    ("Sim_007_scen#v2", (7, -1)),
+    ("Sim_007_scen#v2#0", (7, 0)),
+    ("Sim_007_a#1b", (7, -1)),
+    ("Sim_012_", (12, -1)),
+])
+def test_sim_index(sim_id, expected):
+    """Indice del file e, solo con un `#k` numerico finale, posizione della conversazione."""
+    assert sim_index(sim_id) == expected
+
+
+@pytest.mark.parametrize("sim_id", ["", "sim_001_x", "Sim_x_scen", "Sim_001"])
+def test_sim_index_rejects_unknown_ids(sim_id):
+    """Un Sim_ID che non inizia con `Sim_<indice>_` non è ordinabile."""
+    with pytest.raises(ValueError, match="Sim_ID non riconosciuto"):
+        sim_index(sim_id)
+
+
+def test_shard_partition_is_stable():
+    """Ogni log cade in uno e un solo shard, lo stesso a ogni esecuzione."""
+    paths = [f"prof/scen_{i}.json" for i in range(50)]
+    owners = [[ShardSpec(i, 3).owns(path) for i in (1, 2, 3)] for path in paths]
+    assert all(sum(owned) == 1 for owned in owners)
+    assert [shard_of(path, 3) for path in paths] == [shard_of(path, 3) for path in paths]
+
+
+@pytest.mark.parametrize("value", ["0/2", "3/2", "1/0", "a/b", "2"])
+def test_shard_spec_parse_rejects_invalid(value):
+    """`i/N` richiede 1 <= i <= N."""
+    with pytest.raises(ValueError, match="shard non valido"):
+        ShardSpec.parse(value)
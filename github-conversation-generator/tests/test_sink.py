@@ -0,0 +1,69 @@
+"""Compattazione degli output scritti in append: una riga e un dettaglio per simulazione."""
+
+import csv
+import json
+
+from evaluation.sink import compact_details, compact_summary
+
+HEADER = ["Sim_ID", "Approach", "Profile", "Scenario", "Asymmetry", "Coerenza"]
+
+
+def write_csv(path, rows: list[list[str]]) -> None:
+    """Scrive intestazione e righe come `valut.py`."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+
+
+def read_csv(path) -> list[list[str]]:
+    """Righe del CSV, intestazione compresa."""
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def row(index: int, score: int) -> list[str]:
+    """Riga della simulazione `index` con punteggio `score`."""
+    return [f"Sim_{index:03d}_scen{index}", "A", "prof", f"scen{index}", "low", str(score)]
+
+
+def test_last_row_replaces_first_in_place(tmp_path):
+    """Una simulazione rivalutata tiene la posizione della prima riga con il contenuto dell'ultima."""
+    path = tmp_path / "results_summary.csv"
+    write_csv(path, [row(1, 3), row(2, 3), row(1, 4), row(3, 3), row(1, 5)])
+    assert compact_summary(path) == (5, 3)
+    assert read_csv(path) == [HEADER, row(1, 5), row(2, 3), row(3, 3)]
+    assert not (tmp_path / "results_summary.csv.tmp").exists()
+
+
+def test_without_duplicates_file_is_untouched(tmp_path):
+    """Senza Sim_ID ripetuti il file non viene riscritto."""
+    path = tmp_path / "results_summary.csv"
+    write_csv(path, [row(1, 3), row(2, 4)])
+    mtime = path.stat().st_mtime_ns
+    assert compact_summary(path) == (2, 2)
+    assert path.stat().st_mtime_ns == mtime
+
+
+def test_header_only(tmp_path):
+    """Un CSV con la sola intestazione resta invariato."""
+    path = tmp_path / "results_summary.csv"
+    write_csv(path, [])
+    assert compact_summary(path) == (0, 0)
+    assert read_csv(path) == [HEADER]
+
+
+def test_details_keep_position_of_first_occurrence(tmp_path):
+    """Con `keep_position` il dettaglio rivalutato prende il posto del precedente; senza, va in fondo."""
+    stream = tmp_path / "results_details.jsonl"
+    details = [{"Sim_ID": f"Sim_00{i}", "log_file": f"scen{i}.json", "score": score}
+               for i, score in [(1, 3), (2, 3), (1, 5), (3, 3)]]
+    stream.write_text("".join(json.dumps(d) + "\n" for d in details), encoding="utf-8")
+
+    assert compact_details([stream], tmp_path / "kept.json", keep_position=True) == (4, 3)
+    kept = json.loads((tmp_path / "kept.json").read_text(encoding="utf-8"))
+    assert [(d["Sim_ID"], d["score"]) for d in kept] == [("Sim_001", 5), ("Sim_002", 3), ("Sim_003", 3)]
+
+    assert compact_details([stream], tmp_path / "last.json") == (4, 3)
+    last = json.loads((tmp_path / "last.json").read_text(encoding="utf-8"))
+    assert [d["Sim_ID"] for d in last] == ["Sim_002", "Sim_001", "Sim_003"]
@@ -0,0 +1,52 @@
+"""Archivio SQLite dei risultati: sostituzione delle simulazioni rivalutate ed export ordinato."""
+
+from evaluation.shard import merge_shards, sim_index
+from evaluation.store import ResultsStore, export_store, iter_store
+
+HEADER = ["Sim_ID", "Approach", "Profile", "Scenario", "Asymmetry", "Coerenza"]
+
+
+def simulation(index: int, score: int) -> tuple[list, dict]:
+    """Riga del CSV e dettaglio della simulazione `index` con punteggio `score`."""
+    sim_id = f"Sim_{index:03d}_scen{index}"
+    row = [sim_id, "A", "prof", f"scen{index}", "low", str(score)]
+    detail = {
+        "Sim_ID": sim_id,
+        "log_file": f"prof/scen{index}.json",
+        "evaluations": {"Coerenza": {"Score": score, "Justification": "ok", "RawResponse": "{}"}},
+        "transcript": "user: ciao",
+    }
+    return row, detail
+
+
+def write(path, simulations: list[tuple[int, int]], resume: bool = False) -> None:
+    """Scrive nell'archivio le simulazioni `(indice, punteggio)`."""
+    with ResultsStore(path, HEADER, resume=resume) as store:
+        for index, score in simulations:
+            store.add(*simulation(index, score))
+
+
+def test_reevaluated_sim_keeps_its_position(tmp_path):
+    """Una simulazione rivalutata sostituisce la precedente senza spostarsi in fondo."""
+    path = tmp_path / "results.sqlite"
+    write(path, [(1, 3), (2, 3), (3, 3)])
+    write(path, [(1, 5)], resume=True)
+    rows = [row for row, _ in iter_store(path)]
+    assert [row[0] for row in rows] == ["Sim_001_scen1", "Sim_002_scen2", "Sim_003_scen3"]
+    assert rows[0][5] == "5"
+    details = [detail for _, detail in iter_store(path)]
+    assert details[0]["evaluations"]["Coerenza"]["Score"] == 5
+
+
+def test_export_after_reevaluation_can_be_merged(tmp_path):
+    """L'export di un archivio con simulazioni rivalutate resta ordinato per Sim_ID e si può unire."""
+    path = tmp_path / "results.sqlite"
+    write(path, [(1, 3), (2, 3)])
+    write(path, [(1, 4), (3, 4)], resume=True)
+    export_store(path, tmp_path / "export")
+    summary = merge_shards([tmp_path / "export"], tmp_path / "merged")
+    assert summary["rows"] == 3
+    lines = (tmp_path / "merged" / "results_summary.csv").read_text(encoding="utf-8").splitlines()
+    sim_ids = [line.split(",")[0] for line in lines[1:]]
+    assert sim_ids == sorted(sim_ids, key=sim_index)
+    assert lines[1].endswith(",4")
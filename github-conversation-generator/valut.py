@@ -1,171 +1,1418 @@
+"""Valutazione delle conversazioni simulate con un LLM giudice, secondo le metriche di `config/`."""
+
 import argparse
-import json
 import csv
+import json
+import os
+import threading
 import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from functools import partial
 from pathlib import Path
-from datetime import datetime
-import os
 
 from rich.console import Console
 from rich.progress import Progress
 
-# Import gestiti con controlli successivi
-try:
-    # Prova a importare i componenti necessari
-    from llm_conversation import configure, GenerationConfig, GenerativeModel
-except ImportError:
-    # Se fallisce, imposta le variabili a None per un controllo successivo
-    configure, GenerationConfig, GenerativeModel = None, None, None
-
-try:
-    from dotenv import load_dotenv
-except ImportError:
-    load_dotenv = None
+from evaluation import (
+    COLUMNS_DIR,
+    FATAL,
+    FINGERPRINT_KEY,
+    PROFILE_NAME,
+    REJECTED,
+    STORE_NAME,
+    CheckpointJournal,
+    ContextCache,
+    DuplicateIndex,
+    EvaluationEngine,
+    EvaluationService,
+    FatalJudgeError,
+    IncrementalPlan,
+    IngestPipeline,
+    InputFingerprints,
+    JsonlDetailsSink,
+    JudgeCache,
+    JudgePool,
+    JudgeRetrier,
+    LogWatcher,
+    MalformedResponseError,
+    MetricPlan,
+    NearDuplicateIndex,
+    PreviousResults,
+    Profiler,
+    PromptPlan,
+    RateLimiter,
+    ResultsStore,
+    RetriesExhaustedError,
+    RetryPolicy,
+    RunMetrics,
+    ShardSpec,
+    SharedPrefix,
+    TranscriptOptions,
+    VoteTally,
+    classify_error,
+    compact_details,
+    compact_summary,
+    estimate_tokens,
+    find_log_files,
+    # format_transcript vive ora nella fase di ingest; la riesportiamo per chi la importa da qui
+    format_transcript,  # noqa: F401
+    load_pool,
+    make_server,
+    parse_address,
+    prepare_log_record,
+    write_columns,
+    write_manifest,
+)
 
 # --- CONFIGURAZIONE GLOBALE ---
 console = Console()
+# Limitatore di frequenza condiviso dai worker (impostato da main())
+rate_limiter: RateLimiter | None = None
+# Cache persistente delle risposte del giudice (impostata da main(), None = disattivata)
+judge_cache: JudgeCache | None = None
+# Retry con backoff e circuit breaker per modello (riconfigurato da main())
+judge_retrier = JudgeRetrier()
+# Se True, un errore irreversibile del modello fa passare esplicitamente allo stub locale
+# invece di interrompere la valutazione
+allow_stub_fallback = False
+_model_lock = threading.Lock()
+# Strumentazione dell'esecuzione (latenze, dimensioni, attese) e profiler opzionale (--profile)
+run_metrics = RunMetrics()
+profiler = Profiler()
+# Cache di contesto del provider per il prefisso comune dei prompt (impostata da main(), None = disattivata)
+context_cache: ContextCache | None = None
+# Punteggi che indicano una valutazione non riuscita: non vanno mai messi in cache
+NON_CACHEABLE_SCORES = {"EVALUATION_FAILED", "EVALUATION_SKIPPED"}
 
 # --- CLASSE FALLBACK ---
 # Modello stub locale usato quando il modello remoto non è disponibile.
 class StubGenerativeModel:
+    """Modello di ripiego usato quando il client remoto non è disponibile."""
+
     def __init__(self, label: str = "local-stub"):
+        """Modello con nome `label`."""
         self.model_name = label
 
-    def generate_content(self, prompt: str):
+    def generate_content(self, prompt: str, generation_config=None):
+        """Ritorna una valutazione `EVALUATION_SKIPPED`."""
         class Resp:
             def __init__(self, text: str):
                 self.text = text
-        stub = {"Score": "EVALUATION_SKIPPED", "Justification": "Fallback stub used: remote model unavailable or unsupported."}
+        stub = {"Score": "EVALUATION_SKIPPED",
+                "Justification": "Fallback stub used: remote model unavailable or unsupported."}
         return Resp(json.dumps(stub, ensure_ascii=False))
 
 # --- CONFIGURAZIONE GEMINI ---
+# Il client del giudice viene creato al primo uso (get_judge_model()), non all'import:
+# il modulo si importa come libreria, nei worker e con --dry-run senza chiave API né rete.
+
+DEFAULT_CANDIDATE_MODELS = ["gemini-pro-latest", "gemini-1.5-pro-latest", "models/text-bison-001"]
+
+gemini_model = None
+json_generation_config = None
+# Configurazione del pool di endpoint (--judge-pool); None = un solo modello Gemini
+judge_pool_path: Path | None = None
 
-# Verifica che la libreria google.generativeai sia installata
-if configure is None or GenerationConfig is None or GenerativeModel is None:
-    console.print("[bold red]Libreria 'google.generativeai' non trovata.[/bold red]")
-    console.print("Installala con: [bold]pip install --upgrade google-generativeai[/bold]")
-    exit(1)
 
-# Carica le variabili d'ambiente da .env se dotenv è disponibile
-if load_dotenv:
+def _genai_client():
+    """Configura `google.generativeai` con la chiave del processo. Ritorna il modulo con le classi del client."""
+    # Import gestiti con controlli successivi: `llm_conversation` espone None se google.generativeai manca
+    try:
+        import llm_conversation as client
+    except ImportError:
+        client = None
+    # Verifica che la libreria google.generativeai sia installata
+    if any(getattr(client, name, None) is None for name in ("configure", "GenerationConfig", "GenerativeModel")):
+        console.print("[bold red]Libreria 'google.generativeai' non trovata.[/bold red]")
+        console.print("Installala con: [bold]pip install --upgrade google-generativeai[/bold]")
+        raise FatalJudgeError("libreria 'google.generativeai' non trovata", "")
+
+    _load_dotenv()
+
+    # Ottieni la chiave API
+    api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("API_KEY")
+    if not api_key:
+        console.print("[bold red]ERRORE: Variabile d'ambiente GOOGLE_API_KEY non impostata.[/bold red]")
+        raise FatalJudgeError("variabile d'ambiente GOOGLE_API_KEY non impostata", "")
+
+    # Configura l'API
+    client.configure(api_key=api_key.strip())
+    return client
+
+
+def _load_dotenv() -> None:
+    """Carica le variabili d'ambiente da .env se dotenv è disponibile."""
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
     env_path = Path(__file__).parent / ".env"
     if env_path.exists():
         load_dotenv(env_path)
 
-# Ottieni la chiave API
-api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("API_KEY")
-if not api_key:
-    console.print("[bold red]ERRORE: Variabile d'ambiente GOOGLE_API_KEY non impostata.[/bold red]")
-    exit(1)
 
-# Configura l'API
-configure(api_key=api_key.strip())
+def _build_judge_model():
+    """Configura il client e prova i modelli candidati; solleva FatalJudgeError se nessuno è utilizzabile."""
+    global json_generation_config
+    if judge_pool_path is not None:
+        return _build_judge_pool(judge_pool_path)
+    client = _genai_client()
 
-# Cerca un modello valido da usare
-env_model = os.getenv("MODEL_NAME")
-candidate_models = [env_model] if env_model else []
-candidate_models.extend(["gemini-pro-latest", "gemini-1.5-pro-latest", "models/text-bison-001"])
+    # Cerca un modello valido da usare
+    env_model = os.getenv("MODEL_NAME")
+    candidate_models = [env_model] if env_model else []
+    candidate_models.extend(DEFAULT_CANDIDATE_MODELS)
 
-json_generation_config = GenerationConfig(
-    temperature=0.0,
-    response_mime_type="application/json"
-)
+    json_generation_config = client.GenerationConfig(
+        temperature=0.0,
+        response_mime_type="application/json"
+    )
 
-gemini_model = None
-last_exc = None
-for candidate in filter(None, candidate_models): # filter(None, ...) rimuove stringhe vuote
-    try:
-        gemini_model = GenerativeModel(model_name=candidate, generation_config=json_generation_config)
-        console.print(f"[green]Modello '{candidate}' inizializzato con successo.[/green]")
-        break
-    except Exception as e:
-        last_exc = e
-        console.print(f"[yellow]Impossibile inizializzare il modello '{candidate}': {e}[/yellow]")
+    last_exc = None
+    for candidate in filter(None, candidate_models): # filter(None, ...) rimuove stringhe vuote
+        try:
+            model = client.GenerativeModel(model_name=candidate, generation_config=json_generation_config)
+            console.print(f"[green]Modello '{candidate}' inizializzato con successo.[/green]")
+            return model
+        except Exception as e:
+            last_exc = e
+            console.print(f"[yellow]Impossibile inizializzare il modello '{candidate}': {e}[/yellow]")
 
-# Blocco di controllo per prevenire errori successivi se nessun modello è stato caricato
-if gemini_model is None:
+    # Nessun modello caricato: meglio fermarsi subito che fallire su ogni chiamata
     console.print("\n[bold red]ERRORE CRITICO: Impossibile inizializzare qualsiasi modello generativo.[/bold red]")
     console.print(f"L'ultimo errore ricevuto è stato: [italic]{last_exc}[/italic]\n")
-    console.print("[bold yellow]Controlla che la chiave API sia valida e che l'API 'Generative Language' sia abilitata nel tuo progetto Google Cloud.[/bold yellow]")
-    exit(1)
+    console.print("[bold yellow]Controlla che la chiave API sia valida e che l'API 'Generative Language' sia "
+                  "abilitata nel tuo progetto Google Cloud.[/bold yellow]")
+    raise FatalJudgeError(f"impossibile inizializzare un modello generativo: {last_exc}", "", last_exc)
+
+
+def _build_judge_pool(path: Path) -> JudgePool:
+    """Pool di endpoint da `--judge-pool`: le chiamate vengono distribuite tra modelli, chiavi e backend locali."""
+    global json_generation_config
+    _load_dotenv()
+    try:
+        config = load_json_config(path)
+    except Exception as e:
+        raise FatalJudgeError(f"impossibile leggere la configurazione del pool '{path}': {e}", "", e) from e
+
+    def genai_model(model_name: str):
+        # backend 'genai': client google.generativeai del processo (una sola chiave)
+        global json_generation_config
+        client = _genai_client()
+        json_generation_config = client.GenerationConfig(temperature=0.0, response_mime_type="application/json")
+        return client.GenerativeModel(model_name=model_name, generation_config=json_generation_config)
+
+    try:
+        pool = load_pool(config, genai_factory=genai_model)
+    except ValueError as e:
+        console.print(f"[bold red]Configurazione del pool '{path}' non valida: {e}.[/bold red]")
+        raise FatalJudgeError(f"configurazione del pool non valida: {e}", "", e) from e
+    endpoints = ", ".join(f"{ep.name} ({ep.model_name})" for ep in pool.endpoints)
+    console.print(f"[green]Pool del giudice ({pool.strategy}): {endpoints}.[/green]")
+    return pool
+
+
+def get_judge_model():
+    """Modello del giudice, creato alla prima chiamata (thread-safe)."""
+    global gemini_model
+    model = gemini_model
+    if model is not None:
+        return model
+    with _model_lock:
+        if gemini_model is None:
+            gemini_model = _build_judge_model()
+        return gemini_model
 
 # --- FUNZIONI HELPER ---
 
 def load_json_config(path: Path) -> dict | list:
     """Carica in modo sicuro un file di configurazione JSON."""
     try:
-        with open(path, 'r', encoding='utf-8') as f:
+        with open(path, encoding='utf-8') as f:
             return json.load(f)
     except Exception as e:
         console.print(f"[bold red]Errore fatale durante il caricamento di '{path}': {e}[/bold red]")
         raise
 
-def format_transcript(conversation_log: list[dict]) -> str:
-    """Formatta il log di conversazione in una stringa leggibile.
-
-    Supporta più formati di log: prova chiavi comuni come
-    'agent'/'content' oppure 'speaker'/'message' o 'speaker'/'text'.
+def _switch_to_stub(failed_model, error: FatalJudgeError) -> None:
+    """Fallback esplicito (--fallback-stub): da qui in poi le valutazioni risultano EVALUATION_SKIPPED."""
+    global gemini_model
+    with _model_lock:
+        if gemini_model is failed_model:
+            console.log(f"[bold yellow]{error}. --fallback-stub attivo: passo al modello stub locale, "
+                        f"le valutazioni successive saranno EVALUATION_SKIPPED.[/bold yellow]")
+            gemini_model = StubGenerativeModel()
+            run_metrics.add("stub_fallbacks")
+
+def _register_context_prefix(model, prefix: str, ttl: float):
+    """Registra `prefix` nella cache di contesto di `google.generativeai` (vedi `evaluation.context_cache`).
+
+    Ritorna il modello legato alla voce e la funzione che la cancella, o None
+    se il giudice non è un modello `google.generativeai` con cache di contesto
+    (pool di endpoint, stub di fallback).
     """
-    lines = []
-    for turn in conversation_log:
-        if not isinstance(turn, dict):
-            continue
-        agent = turn.get('agent') or turn.get('speaker') or turn.get('speaker_name') or turn.get('from') or turn.get('role') or 'Unknown'
-        content = turn.get('content') or turn.get('message') or turn.get('text') or turn.get('utterance') or turn.get('body') or ''
+    try:
+        from llm_conversation import genai
+    except ImportError:
+        return None
+    model_class = getattr(genai, "GenerativeModel", None)
+    caching = getattr(genai, "caching", None)
+    if caching is None or model_class is None or not isinstance(model, model_class) \
+            or not hasattr(model_class, "from_cached_content"):
+        return None
+    content = caching.CachedContent.create(model=model.model_name, contents=[prefix], ttl=timedelta(seconds=ttl))
+    return model_class.from_cached_content(content, generation_config=json_generation_config), content.delete
+
+def _make_context_cache(min_tokens: int | None, ttl: float) -> ContextCache | None:
+    """Cache di contesto dell'esecuzione; None se disattivata (`min_tokens` None)."""
+    if min_tokens is None:
+        return None
+
+    def on_disable(reason: str) -> None:
+        console.log(f"[yellow]Cache di contesto disattivata, invio i prompt completi: {reason}.[/yellow]")
+
+    return ContextCache(_register_context_prefix, min_tokens=min_tokens, ttl=ttl, on_disable=on_disable)
+
+def _generate(model, full_prompt: str, shared: SharedPrefix | None, call_kwargs: dict):
+    """Una chiamata al giudice; con `shared` invia solo la parte dopo il prefisso registrato in cache."""
+    suffix = shared.split(full_prompt) if shared is not None else None
+    bound = shared.bind(model) if suffix is not None else None
+    if bound is None:
+        return model.generate_content(full_prompt, **call_kwargs)
+    try:
+        response = bound.generate_content(suffix, **call_kwargs)
+    except Exception as e:
+        if classify_error(e) not in (FATAL, REJECTED):
+            raise
+        # voce scaduta o rifiutata dal provider: la si abbandona e si invia il prompt completo
+        console.log(f"[yellow]Voce della cache di contesto non utilizzabile ({e}): invio il prompt completo.[/yellow]")
+        shared.close()
+        return model.generate_content(full_prompt, **call_kwargs)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        prompt_tokens = int(getattr(usage, "prompt_token_count", 0) or 0)
+        cached_tokens = int(getattr(usage, "cached_content_token_count", 0) or 0)
+        shared.cache.record_usage(prompt_tokens, cached_tokens)
+        run_metrics.add("input_tokens", cached_tokens, kind="cached")
+        run_metrics.add("input_tokens", prompt_tokens - cached_tokens, kind="uncached")
+    return response
+
+def request_judge_json(system_prompt: str, user_prompt: str, temperature: float | None = None,
+                       shared: SharedPrefix | None = None) -> tuple[dict | None, str]:
+    """Invia il prompt al giudice applicando la politica di retry di `judge_retrier`.
+
+    Ritorna l'oggetto JSON della risposta e il testo grezzo, oppure
+    `(None, "")` se tutti i tentativi falliscono con errori temporanei o
+    risposte non valide. Gli errori irreversibili sollevano `FatalJudgeError`,
+    a meno che il fallback allo stub non sia stato abilitato esplicitamente.
+    Con `temperature` la chiamata sovrascrive la temperatura del modello
+    (campioni dell'autoconsistenza). Con `shared` il prefisso comune della
+    conversazione viene inviato una volta sola tramite la cache di contesto.
+    """
+    full_prompt = f"{system_prompt}\n\n{user_prompt}"
+    model = get_judge_model()
+    if model is None or not hasattr(model, "generate_content"):
+        raise FatalJudgeError("gemini_model non inizializzato o privo di 'generate_content'", str(model))
+    model_name = getattr(model, 'model_name', '') or type(model).__name__
+    prompt_bytes = len(full_prompt.encode("utf-8"))
+    if isinstance(model, StubGenerativeModel):
+        run_metrics.add("stub_calls")
+    call_kwargs = {}
+    if temperature is not None:
+        call_kwargs["generation_config"] = {"temperature": temperature, "response_mime_type": "application/json"}
+
+    def attempt() -> tuple[dict, str]:
+        # Il limitatore (se configurato) sostituisce la pausa fissa tra le chiamate
+        if rate_limiter is not None:
+            rate_limiter.acquire(estimate_tokens(full_prompt))
+        start = time.perf_counter()
         try:
-            content_str = str(content)
+            response = _generate(model, full_prompt, shared, call_kwargs)
         except Exception:
-            content_str = ''
-        lines.append(f"{agent}: {content_str}")
-    return "\n".join(lines)
-
-def evaluate_single_metric(system_prompt: str, user_prompt: str) -> dict:
-    """Chiama l'API di Gemini per valutare una singola metrica, con logica di retry."""
-    global gemini_model
-    full_prompt = f"{system_prompt}\n\n{user_prompt}"
-
-    if gemini_model is None or not hasattr(gemini_model, "generate_content"):
-        console.log("[yellow]gemini_model non inizializzato o manca 'generate_content': uso StubGenerativeModel come fallback.[/yellow]")
-        gemini_model = StubGenerativeModel()
-
-    for attempt in range(3):
-        resp_text = ""
+            run_metrics.observe_call(model_name, time.perf_counter() - start, prompt_bytes, ok=False)
+            raise
+        resp_text = getattr(response, 'text', str(response))
+        elapsed = time.perf_counter() - start
+        if rate_limiter is not None:
+            rate_limiter.record_tokens(estimate_tokens(resp_text))
         try:
-            response = gemini_model.generate_content(full_prompt)
-            resp_text = getattr(response, 'text', str(response))
             result = json.loads(resp_text)
-            return {
-                "Score": result.get('Score', 'EVALUATION_FAILED'),
-                "Justification": result.get('Justification', 'Giustificazione non fornita.'),
-                "RawResponse": resp_text,
-            }
         except json.JSONDecodeError:
-            console.log(f"[yellow]Risposta non JSON (tentativo {attempt+1}). Contenuto: {resp_text}[/yellow]")
-        except Exception as e:
-            msg = str(e).lower()
-            console.log(f"[yellow]Tentativo {attempt + 1}/3 fallito. Errore: {e}. Riprovo...[/yellow]")
-            if "not found" in msg or "not supported" in msg or "permission_denied" in msg:
-                console.log("[yellow]Errore irreversibile: passo al modello di fallback locale (stub).[/yellow]")
-                gemini_model = StubGenerativeModel()
+            run_metrics.observe_call(model_name, elapsed, prompt_bytes, len(resp_text.encode("utf-8")), ok=False)
+            run_metrics.add("json_parse_failures")
+            raise MalformedResponseError(f"risposta non JSON: {resp_text[:200]}") from None
+        run_metrics.observe_call(model_name, elapsed, prompt_bytes, len(resp_text.encode("utf-8")))
+        if not isinstance(result, dict):
+            raise MalformedResponseError(f"la risposta JSON non è un oggetto ({type(result).__name__})")
+        return result, resp_text
+
+    def log_retry(attempt_idx: int, kind: str, error: BaseException, delay: float) -> None:
+        console.log(f"[yellow]Tentativo {attempt_idx + 1}/{judge_retrier.policy.max_attempts} fallito ({kind}): "
+                    f"{error}. Riprovo tra {delay:.1f}s...[/yellow]")
+
+    try:
+        return judge_retrier.call(model_name, attempt, on_retry=log_retry)
+    except RetriesExhaustedError as e:
+        console.log(f"[yellow]{e}[/yellow]")
+        return None, ""
+    except FatalJudgeError as e:
+        if not allow_stub_fallback or isinstance(model, StubGenerativeModel):
+            raise
+        _switch_to_stub(model, e)
+    return request_judge_json(system_prompt, user_prompt, temperature, shared)
+
+def evaluate_single_metric(system_prompt: str, user_prompt: str, temperature: float | None = None,
+                           shared: SharedPrefix | None = None) -> dict:
+    """Chiama l'API di Gemini per valutare una singola metrica, con logica di retry."""
+    result, resp_text = request_judge_json(system_prompt, user_prompt, temperature, shared)
+    if result is None:
+        run_metrics.add("evaluations_failed")
+        attempts = judge_retrier.policy.max_attempts
+        return {"Score": "EVALUATION_FAILED",
+                "Justification": f"Gemini non ha risposto correttamente dopo {attempts} tentativi.", "RawResponse": ""}
+    return {
+        "Score": result.get('Score', 'EVALUATION_FAILED'),
+        "Justification": result.get('Justification', 'Giustificazione non fornita.'),
+        "RawResponse": resp_text,
+    }
+
+def evaluate_metric_batch(system_prompt: str, user_prompt: str, metric_names: list[str],
+                          shared: SharedPrefix | None = None) -> dict[str, dict]:
+    """Valuta più metriche con una sola chiamata al giudice.
+
+    Ritorna solo le metriche presenti (con uno 'Score') nella risposta: quelle
+    mancanti vanno rivalutate singolarmente dal chiamante.
+    """
+    result, resp_text = request_judge_json(system_prompt, user_prompt, shared=shared)
+    if result is None:
+        return {}
+    # Tolleriamo risposte annidate sotto una chiave contenitore
+    for container in ("evaluations", "metrics", "results"):
+        if isinstance(result.get(container), dict) and not any(name in result for name in metric_names):
+            result = result[container]
+            break
+
+    evaluations = {}
+    for name in metric_names:
+        entry = result.get(name)
+        if not isinstance(entry, dict) or 'Score' not in entry:
+            continue
+        evaluations[name] = {
+            "Score": entry.get('Score', 'EVALUATION_FAILED'),
+            "Justification": entry.get('Justification', 'Giustificazione non fornita.'),
+            "RawResponse": resp_text,
+        }
+    return evaluations
+
+def _judge_cache_key(system_prompt: str, user_prompt: str, variant: str = "") -> str:
+    model_name = getattr(get_judge_model(), 'model_name', '') or ''
+    return JudgeCache.make_key(model_name, json_generation_config, system_prompt, user_prompt, variant)
+
+def _is_cacheable(evaluation: dict) -> bool:
+    """Fallimenti e risposte del modello stub di fallback non vanno mai memorizzati."""
+    if isinstance(gemini_model, StubGenerativeModel):
+        return False
+    return str(evaluation.get("Score", "")) not in NON_CACHEABLE_SCORES
+
+def evaluate_single_metric_cached(system_prompt: str, user_prompt: str, temperature: float | None = None,
+                                  variant: str = "", shared: SharedPrefix | None = None,
+                                  on_call: Callable[[], None] | None = None) -> dict:
+    """Come evaluate_single_metric(), ma consulta prima la cache persistente.
+
+    `variant` distingue in cache i campioni dello stesso prompt (autoconsistenza).
+    `on_call` viene chiamata solo se la richiesta arriva davvero al giudice.
+    """
+    cached = None
+    if judge_cache is not None:
+        key = _judge_cache_key(system_prompt, user_prompt, variant)
+        cached = judge_cache.get(key)
+    if cached is not None:
+        return cached
+    if on_call is not None:
+        on_call()
+    if judge_cache is None:
+        return evaluate_single_metric(system_prompt, user_prompt, temperature, shared)
+    evaluation = evaluate_single_metric(system_prompt, user_prompt, temperature, shared)
+    if _is_cacheable(evaluation):
+        judge_cache.put(key, evaluation)
+    return evaluation
+
+def evaluate_metric_batch_cached(system_prompt: str, user_prompt: str, metric_names: list[str],
+                                 shared: SharedPrefix | None = None,
+                                 on_call: Callable[[], None] | None = None) -> dict[str, dict]:
+    """Come evaluate_metric_batch(); in cache finiscono solo le risposte complete. `on_call` come sopra."""
+    cached = None
+    if judge_cache is not None:
+        key = _judge_cache_key(system_prompt, user_prompt)
+        cached = judge_cache.get(key)
+    if cached is not None:
+        return cached
+    if on_call is not None:
+        on_call()
+    if judge_cache is None:
+        return evaluate_metric_batch(system_prompt, user_prompt, metric_names, shared)
+    evaluations = evaluate_metric_batch(system_prompt, user_prompt, metric_names, shared)
+    if len(evaluations) == len(metric_names) and all(_is_cacheable(ev) for ev in evaluations.values()):
+        judge_cache.put(key, evaluations)
+    return evaluations
+
+def normalize_score(metric: dict, evaluation: dict) -> str:
+    """Normalizza tipi speciali (likert_5 -> int 1..5) per la scrittura nel CSV."""
+    value_type = metric.get("value_type", "").lower()
+    score_to_write = evaluation.get('Score', '')
+    if value_type == "likert_5":
+        try:
+            # supporta numeri come "4", "4.0" o anche stringhe
+            si = int(float(str(score_to_write).strip()))
+            return str(min(max(si, 1), 5))
+        except Exception:
+            return ""
+    return str(score_to_write)
+
+def sample_vote(metric: dict, evaluation: dict) -> str:
+    """Forma canonica del punteggio di un campione per il voto; "" se il campione è fallito."""
+    if str(evaluation.get("Score", "")) in NON_CACHEABLE_SCORES:
+        return ""
+    # true/True/"true" e 4/"4.0" devono contare come lo stesso voto
+    return normalize_score(metric, evaluation).strip().lower()
+
+def evaluate_conversation(conv: dict, plan: PromptPlan, engine: EvaluationEngine,
+                          batch_metrics: bool = False, journal: CheckpointJournal | None = None,
+                          fingerprints: InputFingerprints | None = None,
+                          reuse: dict[str, dict] | None = None) -> tuple[list, dict]:
+    """Valuta tutte le metriche di una conversazione, con le chiamate in parallelo sul pool del motore.
+
+    Con `batch_metrics` le metriche applicabili vengono inviate insieme (una
+    chiamata per `batch_group`); quelle assenti dalla risposta vengono
+    rivalutate singolarmente. Con un `journal` le metriche già completate in
+    un'esecuzione precedente vengono riusate e quelle nuove registrate appena
+    terminano. Le metriche con `samples` vengono valutate con più campioni
+    a ondate (vedi `evaluation.consistency`), orchestrate da questo thread
+    così i campioni non occupano i worker del giudice in attesa. Le metriche
+    condizionate (`depends_on`/`skip_if`, vedi `evaluation.gating`) partono
+    dopo le loro dipendenze e, se una condizione è soddisfatta, vengono
+    registrate come `N/A` con il motivo. Con la cache di contesto attiva il
+    prefisso comune dei prompt (system prompt e contesto) viene registrato
+    alla prima chiamata e riusato da tutte le altre. Con `fingerprints` ogni
+    valutazione riceve l'impronta dei suoi input (vedi `evaluation.incremental`)
+    e le metriche del journal con un'impronta diversa vengono ricalcolate; le
+    valutazioni in `reuse` (per nome di metrica) vengono riusate così come sono.
+    Le chiamate arrivate davvero al giudice (escluse quindi le metriche riusate,
+    dal journal e dalla cache) finiscono in `conv['judge_calls']`.
+    """
+    row = [conv['sim_id'], conv['approach'], conv['profile'], conv['scenario_name'], conv['asymmetry_level']]
+    evaluations = {}
+    ctx = plan.context(conv)
+    issued = {"calls": 0}
+    issued_lock = threading.Lock()
+
+    def count_call() -> None:
+        with issued_lock:
+            issued["calls"] += 1
+
+    def stamp(mp: MetricPlan, evaluation: dict) -> dict:
+        return fingerprints.stamp(conv['log_hash'], mp.name, evaluation) if fingerprints is not None else evaluation
+
+    def record(metric_name: str, evaluation: dict) -> None:
+        if journal is not None and str(evaluation.get("Score", "")) not in NON_CACHEABLE_SCORES:
+            journal.record_metric(conv['log_hash'], metric_name, evaluation)
+
+    def run_single(mp: MetricPlan) -> dict:
+        with run_metrics.label(mp.name), profiler.active():
+            # con la strategia `relevance` la metrica può avere una propria finestra della trascrizione
+            user_prompt = plan.single_prompt(plan.metric_context(ctx, conv, mp), mp)
+            evaluation = stamp(mp, evaluate_single_metric_cached(plan.system_prompt, user_prompt, shared=shared,
+                                                                 on_call=count_call))
+        record(mp.name, evaluation)
+        return evaluation
+
+    def run_sample(mp: MetricPlan, sample: int) -> dict:
+        with run_metrics.label(mp.name), profiler.active():
+            user_prompt = plan.single_prompt(plan.metric_context(ctx, conv, mp), mp)
+            return evaluate_single_metric_cached(plan.system_prompt, user_prompt, mp.sampling.temperature,
+                                                 mp.sampling.cache_variant(sample), shared, count_call)
+
+    def submit_samples(mp: MetricPlan, tally: VoteTally) -> list:
+        first = tally.issued
+        return [engine.submit(run_sample, mp, n) for n in range(first, first + tally.next_wave())]
+
+    def collect_samples(mp: MetricPlan) -> dict:
+        tally = tallies[mp.index]
+        while sample_futures[mp.index]:
+            for future in sample_futures.pop(mp.index):
+                tally.add(future.result())
+            sample_futures[mp.index] = submit_samples(mp, tally)
+        run_metrics.add("consistency_samples", tally.issued, outcome="issued")
+        run_metrics.add("consistency_samples", mp.sampling.samples - tally.issued, outcome="saved")
+        evaluation = stamp(mp, tally.result())
+        record(mp.name, evaluation)
+        return evaluation
+
+    def start(mp: MetricPlan) -> None:
+        if mp.sampling is None:
+            futures[mp.index] = engine.submit(run_single, mp)
+        else:
+            tallies[mp.index] = VoteTally(mp.sampling, lambda evaluation: sample_vote(mp.metric, evaluation))
+            sample_futures[mp.index] = submit_samples(mp, tallies[mp.index])
+
+    def run_batch(group: list[MetricPlan]) -> dict[str, dict]:
+        names = [mp.name for mp in group]
+        with run_metrics.label(f"batch:{group[0].batch_group}"), profiler.active():
+            batch_result = evaluate_metric_batch_cached(plan.system_prompt, plan.batch_prompt(ctx, group), names,
+                                                        shared, count_call)
+        batch_result = {mp.name: stamp(mp, batch_result[mp.name]) for mp in group if mp.name in batch_result}
+        for metric_name, evaluation in batch_result.items():
+            record(metric_name, evaluation)
+        return batch_result
+
+    # Metriche già completate in un'esecuzione precedente (--resume, --incremental)
+    applicable = {mp.index for mp in plan.applicable(conv['approach'])}
+    resolved = {}
+    pending = []
+    # metriche saltate per una condizione `skip_if`
+    skipped: set[int] = set()
+    for mp in plan.applicable(conv['approach']):
+        previous = reuse.get(mp.name) if reuse else None
+        if previous is None and journal is not None:
+            previous = journal.get_metric(conv['log_hash'], mp.name)
+            # valutazione registrata con altri input (metrica o prompt modificati): va ricalcolata
+            if previous is not None and fingerprints is not None and FINGERPRINT_KEY in previous \
+                    and previous[FINGERPRINT_KEY] != fingerprints.cell(conv['log_hash'], mp.name):
+                previous = None
+        if previous is not None:
+            resolved[mp.index] = previous
+            if "SkipReason" in previous:
+                skipped.add(mp.index)
+        else:
+            pending.append(mp)
+    # prefisso condiviso dalle chiamate (le finestre di rilevanza hanno un contesto proprio e non lo usano)
+    expected_calls = len(plan.batch_groups(pending)) if batch_metrics else len(pending)
+    shared = context_cache.prefix(plan.shared_prefix(ctx), expected_calls) if context_cache is not None else None
+
+    futures = {}
+    # metriche campionate: voti raccolti e campioni dell'ondata in corso
+    tallies: dict[int, VoteTally] = {}
+    sample_futures: dict[int, list] = {}
+    # metriche in attesa di una risposta batch: indice -> (gruppo, future)
+    batched: dict[int, tuple[list[MetricPlan], Future]] = {}
+    by_name = {mp.name: mp for mp in plan.metrics}
+
+    def launch(plans: list[MetricPlan]) -> None:
+        if not batch_metrics:
+            for mp in plans:
+                start(mp)
+            return
+        for group in plan.batch_groups(plans):
+            if len(group) == 1:
+                start(group[0])
+            else:
+                future = engine.submit(run_batch, group)
+                for mp in group:
+                    batched[mp.index] = (group, future)
+
+    def drain_batch(mp: MetricPlan) -> None:
+        group, future = batched[mp.index]
+        batch_result = future.result()
+        for member in group:
+            del batched[member.index]
+            if member.name in batch_result:
+                resolved[member.index] = batch_result[member.name]
+            else:
+                console.log(f"[yellow]{conv['sim_id']}: metrica '{member.name}' assente dalla risposta batch, la "
+                            "rivaluto singolarmente.[/yellow]")
+                start(member)
+
+    def settle(mp: MetricPlan) -> dict:
+        """Valutazione di una metrica avviata o ripresa, attendendo la risposta se serve."""
+        if mp.index in batched:
+            drain_batch(mp)
+        if mp.index not in resolved:
+            resolved[mp.index] = collect_samples(mp) if mp.index in tallies else futures[mp.index].result()
+        return resolved[mp.index]
+
+    def dependency_value(name: str) -> str:
+        dependency = by_name[name]
+        if dependency.index not in applicable or dependency.index in skipped:
+            return "N/A"
+        return normalize_score(dependency.metric, settle(dependency))
+
+    # Prima accodiamo tutte le chiamate, poi raccogliamo i risultati nell'ordine delle metriche.
+    # Con `depends_on`/`skip_if` le metriche partono per livelli del grafo: quelle
+    # condizionate solo quando i risultati delle loro dipendenze sono disponibili.
+    for level in sorted({mp.level for mp in pending}):
+        ready = []
+        for mp in pending:
+            if mp.level != level:
+                continue
+            reason = mp.gate.skip_reason({d: dependency_value(d) for d in mp.gate.depends_on}) if mp.gate else None
+            if reason is None:
+                ready.append(mp)
                 continue
-            time.sleep(5)
+            skipped.add(mp.index)
+            resolved[mp.index] = stamp(mp, {"Score": "N/A", "Justification": f"Metric skipped: {reason}.",
+                                            "RawResponse": "", "SkipReason": reason})
+            run_metrics.add("metrics_skipped", metric=mp.name)
+        launch(ready)
+
+    # le metriche assenti dalle risposte batch vengono rilanciate prima di attendere le altre
+    while batched:
+        drain_batch(next(iter(batched.values()))[0][0])
+
+    for mp in plan.metrics:
+        if mp.index not in applicable:
+            # scrivi N/A per questa metrica nel CSV e continua
+            row.append("N/A")
+            evaluations[mp.name] = {"Score": "N/A", "Justification": "Metric not applicable for this approach.",
+                                    "RawResponse": ""}
+            continue
 
-    return {"Score": "EVALUATION_FAILED", "Justification": "Gemini non ha risposto correttamente dopo 3 tentativi.", "RawResponse": ""}
+        evaluation = settle(mp)
+        # Scrivi solo il punteggio sintetico nel CSV
+        row.append("N/A" if mp.index in skipped else normalize_score(mp.metric, evaluation))
+        # Salviamo comunque l'intera valutazione per il file di dettaglio JSON.
+        evaluations[mp.name] = evaluation
+    # tutte le chiamate sono terminate: la voce in cache non serve più (se la valutazione
+    # si interrompe prima, la voce scade dopo il suo ttl)
+    if shared is not None:
+        shared.close()
+
+    # Report delle finestre di rilevanza per metrica, accanto a quello della trascrizione
+    if ctx.variants and 'transcript_trimming' in conv:
+        conv['transcript_trimming']['by_metric'] = {
+            mp.name: ctx.variants[mp.relevance_keywords].report
+            for mp in plan.metrics if mp.relevance_keywords in ctx.variants
+        }
+    conv['judge_calls'] = issued["calls"]
+
+    return row, evaluations
+
+def build_detail(conv: dict, evaluations: dict) -> dict:
+    """Oggetto di dettaglio di una simulazione (`details/` e results_details.json)."""
+    detail_obj = {
+        'Sim_ID': conv['sim_id'],
+        'log_file': conv['log_file'],
+        'evaluations': evaluations,
+        'ground_truth': conv['ground_truth'],
+        'transcript': conv['transcript'],
+        'agent2_persona': conv['extra_persona_info'],
+        'evaluated_at': datetime.now().isoformat()
+    }
+    if 'transcript_trimming' in conv:
+        detail_obj['transcript_trimming'] = conv['transcript_trimming']
+    return detail_obj
+
+def print_prompt_stats(prompt_stats: dict) -> None:
+    """Dimensioni dei prompt: dove vanno i token di input."""
+    components = ", ".join(f"{name} {tokens}" for name, tokens in prompt_stats["components_est_tokens"].items())
+    console.print(f"[cyan]Prompt costruiti: {prompt_stats['requests']} ({prompt_stats['bytes']} byte, "
+                  f"~{prompt_stats['est_tokens']} token stimati; per componente: {components}).[/cyan]")
+    for label, entry in prompt_stats["by_label"].items():
+        console.print(f"   {label}: {entry['requests']} richieste, media {entry['avg_bytes']} byte / "
+                      f"~{entry['avg_est_tokens']} token")
+
+def print_near_duplicates(report: dict, limit: int = 10) -> dict:
+    """Riepilogo a console del report dei quasi-duplicati (i gruppi più numerosi); ritorna il report."""
+    console.print(f"[cyan]Quasi-duplicati (somiglianza >= {report['threshold']}): {report['clusters']} gruppi, "
+                  f"{report['redundant']} conversazioni ridondanti su {report['conversations']}.[/cyan]")
+    for group in report["groups"][:limit]:
+        names = ", ".join(c["sim_id"] for c in group["conversations"][:5])
+        more = f" e altre {group['size'] - 5}" if group["size"] > 5 else ""
+        console.print(f"   {group['size']} conversazioni (somiglianza minima {group['min_similarity']}): {names}{more}")
+    return report
+
+def _call_groups(plan: PromptPlan, plans: list[MetricPlan], batch_metrics: bool) -> list[list[MetricPlan]]:
+    """Metriche inviate insieme al giudice: singole, o per `batch_group` con `batch_metrics`."""
+    if not batch_metrics:
+        return [[mp] for mp in plans]
+    # come in evaluate_conversation(): i batch non mescolano livelli diversi del grafo condizionale
+    return [group for level in sorted({mp.level for mp in plans})
+            for group in plan.batch_groups([mp for mp in plans if mp.level == level])]
+
+def plan_conversation_calls(conv: dict, plan: PromptPlan, batch_metrics: bool = False) -> int:
+    """Costruisce (senza inviarli) i prompt di una conversazione e ritorna le chiamate al giudice previste.
+
+    I prompt finiscono in `plan.stats` come in una valutazione vera; cache,
+    journal, arresto anticipato dei campioni e condizioni `skip_if` non sono
+    considerati, quindi il conteggio è un limite superiore.
+    """
+    ctx = plan.context(conv)
+    calls = 0
+    for group in _call_groups(plan, plan.applicable(conv['approach']), batch_metrics):
+        if len(group) == 1:
+            mp = group[0]
+            samples = mp.sampling.samples if mp.sampling else 1
+            for _ in range(samples):
+                plan.single_prompt(plan.metric_context(ctx, conv, mp), mp)
+            calls += samples
+        else:
+            plan.batch_prompt(ctx, group)
+            calls += 1
+    return calls
+
+def dry_run(plan: PromptPlan, logs_dir: Path, selected_logs: list[tuple[int, Path]], batch_metrics: bool = False,
+            ingest_workers: int | None = None, transcript_options: TranscriptOptions | None = None,
+            dedupe: bool = True, near_duplicates: NearDuplicateIndex | None = None) -> dict:
+    """Valida i log e conta le chiamate previste, senza creare il client del giudice né scrivere output.
+
+    Con `dedupe` i duplicati esatti non contano nelle chiamate previste
+    (`duplicates` e `calls_saved` nel riepilogo).
+    """
+    summary = {"logs": len(selected_logs), "valid": 0, "skipped": 0, "calls": 0, "duplicates": 0, "calls_saved": 0}
+    # impronta -> chiamate previste per la prima conversazione con quell'impronta
+    planned: dict[str, int] = {}
+    with IngestPipeline(logs_dir, workers=ingest_workers, transcript_options=transcript_options) as ingest:
+        for _, log_file, fetch_record in ingest.iter_records([f for _, f in selected_logs],
+                                                             [i for i, _ in selected_logs]):
+            record = fetch_record()
+            for message in record["messages"]:
+                console.print(message)
+            conv = record["conv"]
+            if conv is None:
+                summary["skipped"] += 1
+                continue
+            summary["valid"] += 1
+            if near_duplicates is not None:
+                near_duplicates.add(conv)
+            if dedupe and conv["fingerprint"] in planned:
+                summary["duplicates"] += 1
+                summary["calls_saved"] += planned[conv["fingerprint"]]
+                continue
+            calls = plan_conversation_calls(conv, plan, batch_metrics=batch_metrics)
+            planned[conv["fingerprint"]] = calls
+            summary["calls"] += calls
+    return summary
+
+def plan_incremental(plan: PromptPlan, logs_dir: Path, selected_logs: list[tuple[int, Path]],
+                     previous: PreviousResults, fingerprints: InputFingerprints, ingest_workers: int | None = None,
+                     transcript_options: TranscriptOptions | None = None) -> IncrementalPlan:
+    """Celle (log, metrica) da ricalcolare e da riusare in un'esecuzione incrementale, senza chiamare il giudice."""
+    summary = IncrementalPlan()
+    with IngestPipeline(logs_dir, workers=ingest_workers, transcript_options=transcript_options) as ingest:
+        for _, log_file, fetch_record in ingest.iter_records([f for _, f in selected_logs],
+                                                             [i for i, _ in selected_logs]):
+            conv = fetch_record()["conv"]
+            if conv is None:
+                continue
+            plans = plan.applicable(conv['approach'])
+            summary.add(previous.known(conv), plans, previous.reusable(conv, fingerprints, plans))
+    summary.removed = previous.unseen()
+    return summary
+
+def print_incremental_plan(summary: IncrementalPlan) -> None:
+    """Piano dell'esecuzione incrementale: celle da ricalcolare per metrica."""
+    console.print(f"[bold cyan]Piano incrementale: {summary.summary()}.[/bold cyan]")
+    for name, entry in summary.by_metric.items():
+        if entry["recompute"]:
+            console.print(f"   {name}: {entry['recompute']} da ricalcolare, {entry['reuse']} riutilizzate")
+    if summary.removed:
+        console.print(f"[yellow]{len(summary.removed)} log dell'esecuzione precedente non sono più presenti: "
+                      f"le loro righe non saranno nel CSV.[/yellow]")
+
+class Evaluator:
+    """Valutazione programmatica di singoli log, senza CLI né file di output.
+
+        with Evaluator(Path("config")) as evaluator:
+            result = evaluator.evaluate(Path("conversation_logs/sim.json"))
+
+    Le configurazioni vengono caricate alla costruzione; il client del giudice
+    viene creato (e i modelli provati) alla prima chiamata al giudice.
+    """
 
-def main(logs_dir: Path, output_dir: Path, judge_config_path: Path, metrics_config_path: Path):
-    """Orchestra il processo di valutazione."""
+    def __init__(self, config_dir: Path = Path("config"), batch_metrics: bool = False, workers: int = 4,
+                 transcript_budget: int | None = None, transcript_strategy: str = "whitespace,dedupe,headtail"):
+        """Carica e valida le configurazioni di `config_dir` e compila i prompt."""
+        config_dir = Path(config_dir)
+        judge_config = load_json_config(config_dir / "config_judge.json")
+        metrics_config = load_json_config(config_dir / "config_metrics.json")
+        if not isinstance(judge_config, dict) or 'system_prompt' not in judge_config:
+            raise ValueError("'config_judge.json' deve essere un oggetto JSON con la chiave 'system_prompt'")
+        if not isinstance(metrics_config, list):
+            raise ValueError("'config_metrics.json' deve essere un array JSON")
+        self.transcript_options = TranscriptOptions.from_cli(transcript_budget, transcript_strategy)
+        self.plan = PromptPlan(judge_config, metrics_config, self.transcript_options)
+        self.batch_metrics = batch_metrics
+        self.workers = workers
+        self._engine: EvaluationEngine | None = None
+
+    def planned_calls(self, log_file: Path, logs_dir: Path | None = None, index: int = 0) -> int:
+        """Chiamate al giudice che `evaluate()` farebbe per il log (0 se il log va saltato)."""
+        conv = self._prepare(Path(log_file), logs_dir, index)
+        return 0 if conv is None else plan_conversation_calls(conv, self.plan, batch_metrics=self.batch_metrics)
+
+    def evaluate(self, log_file: Path, logs_dir: Path | None = None, index: int = 0) -> dict | None:
+        """Valuta un log. Ritorna `{"row": ..., "detail": ...}` come nel CSV e in `details/`, None se il log va saltato.
+
+        `logs_dir` e `index` determinano il Sim_ID (default: cartella del log, indice 0).
+        """
+        conv = self._prepare(Path(log_file), logs_dir, index)
+        if conv is None:
+            return None
+        if self._engine is None:
+            self._engine = EvaluationEngine(workers=self.workers)
+        row, evaluations = evaluate_conversation(conv, self.plan, self._engine, batch_metrics=self.batch_metrics)
+        return {"row": row, "detail": build_detail(conv, evaluations)}
+
+    def evaluate_batch(self, convs: list[dict]) -> list[dict]:
+        """Valuta conversazioni già preparate (es. da `prepare_payload_record()`), in parallelo sullo stesso motore.
+
+        Per ogni conversazione ritorna identificativi, punteggi normalizzati per
+        metrica (come nel CSV) e valutazioni complete.
+        """
+        if self._engine is None:
+            self._engine = EvaluationEngine(workers=self.workers)
+        engine = self._engine
+        metric_names = [mp.name for mp in self.plan.metrics]
+        results = []
+        for conv, (row, evaluations) in engine.map_ordered(
+                lambda c: evaluate_conversation(c, self.plan, engine, batch_metrics=self.batch_metrics), convs):
+            results.append({
+                "sim_id": row[0], "approach": row[1], "profile": row[2], "scenario": row[3], "asymmetry": row[4],
+                "scores": dict(zip(metric_names, row[5:])),
+                "evaluations": evaluations,
+            })
+        return results
+
+    def _prepare(self, log_file: Path, logs_dir: Path | None, index: int) -> dict | None:
+        record = prepare_log_record(str(log_file), str(logs_dir or log_file.parent), index, self.transcript_options)
+        for message in record["messages"]:
+            console.print(message)
+        return record["conv"]
+
+    def close(self) -> None:
+        """Chiude il motore di valutazione (idempotente)."""
+        if self._engine is not None:
+            self._engine.close()
+            self._engine = None
+
+    def __enter__(self) -> "Evaluator":
+        """Ritorna il valutatore stesso."""
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Chiude il valutatore."""
+        self.close()
+
+@dataclass
+class RunOptions:
+    """Opzioni di un'esecuzione di `main()`; i default sono quelli della CLI."""
+
+    # giudice: concorrenza, quote, retry e fallback
+    workers: int = 4
+    requests_per_minute: float | None = 60
+    tokens_per_minute: float | None = None
+    batch_metrics: bool = False
+    retry_policy: RetryPolicy | None = None
+    breaker_threshold: int = 5
+    breaker_cooldown: float = 30.0
+    breaker_max_trips: int = 10
+    fallback_stub: bool = False
+    # file JSON degli endpoint del pool (vedi `evaluation.pool`)
+    judge_pool: Path | None = None
+    # cache delle risposte del giudice
+    use_cache: bool = True
+    refresh_cache: bool = False
+    cache_path: Path | None = None
+    cache_max_entries: int | None = 100_000
+    cache_max_age_days: float | None = 30
+    # prefisso comune dei prompt registrato nella cache di contesto del provider (None = disattivata)
+    context_cache_min_tokens: int | None = 4096
+    context_cache_ttl: float = 600.0
+    # preparazione dei log e delle trascrizioni
+    ingest_workers: int | None = None
+    transcript_budget: int | None = None
+    transcript_strategy: str = "whitespace,dedupe,headtail"
+    # duplicati esatti valutati una volta; soglia del report dei quasi-duplicati (vedi `evaluation.dedup`)
+    dedupe: bool = True
+    near_duplicates: float | None = None
+    # output
+    resume: bool = False
+    details_format: str = "json"
+    fsync_every: int = 50
+    # archivio SQLite al posto dei file di details/ (vedi `evaluation.store`)
+    results_store: Path | None = None
+    columnar: bool = False
+    # modalità di esecuzione
+    shard: ShardSpec | None = None
+    profile: bool = False
+    dry_run_only: bool = False
+    # riusa le valutazioni con l'impronta attesa (vedi `evaluation.incremental`)
+    incremental: bool = False
+    # dopo il primo passaggio valuta in append i log nuovi o modificati (vedi `evaluation.watch`)
+    watch: bool = False
+    watch_settle: float = 2.0
+    watch_interval: float = 1.0
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace, script_dir: Path) -> "RunOptions":
+        """Dagli argomenti della CLI; `ValueError` se retry o shard non sono validi."""
+        judge_pool = args.judge_pool
+        if judge_pool is not None and not judge_pool.is_absolute():
+            judge_pool = (script_dir / judge_pool).resolve()
+        return cls(
+            workers=args.workers,
+            requests_per_minute=args.rpm if args.rpm is not None else (0 if args.judge_pool else 60),
+            tokens_per_minute=args.tpm,
+            batch_metrics=args.batch_metrics,
+            retry_policy=RetryPolicy(max_attempts=args.max_attempts, base_delay=args.retry_base_delay,
+                                     max_delay=args.retry_max_delay),
+            breaker_threshold=args.breaker_threshold,
+            breaker_cooldown=args.breaker_cooldown,
+            breaker_max_trips=args.breaker_max_trips,
+            fallback_stub=args.fallback_stub,
+            judge_pool=judge_pool,
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh,
+            cache_path=args.cache_path,
+            cache_max_entries=args.cache_max_entries,
+            cache_max_age_days=args.cache_max_age_days,
+            context_cache_min_tokens=None if args.no_context_cache else args.context_cache_min_tokens,
+            context_cache_ttl=args.context_cache_ttl,
+            ingest_workers=args.ingest_workers,
+            transcript_budget=args.transcript_budget,
+            transcript_strategy=args.transcript_strategy,
+            dedupe=not args.no_dedupe,
+            near_duplicates=args.near_duplicates,
+            resume=args.resume,
+            details_format=args.details_format,
+            fsync_every=args.fsync_every,
+            results_store=(args.output_dir / STORE_NAME) if args.results_store is True else args.results_store,
+            columnar=args.columnar,
+            shard=ShardSpec.parse(args.shard) if args.shard else None,
+            profile=args.profile,
+            dry_run_only=args.dry_run,
+            incremental=args.incremental,
+            watch=args.watch,
+            watch_settle=args.watch_settle,
+            watch_interval=args.watch_interval,
+        )
+
+
+def _use_judge_pool(judge_pool: Path | None) -> None:
+    """Con un file di pool diverso dal precedente, il client del giudice viene ricreato alla prima chiamata."""
+    global gemini_model, judge_pool_path
+    if judge_pool is not None and judge_pool != judge_pool_path:
+        with _model_lock:
+            judge_pool_path = judge_pool
+            gemini_model = None
+
+
+def _load_plan(judge_config_path: Path, metrics_config_path: Path,
+               options: RunOptions) -> tuple[PromptPlan, list, NearDuplicateIndex | None] | None:
+    """Piano dei prompt, configurazione delle metriche e indice dei quasi-duplicati.
+
+    Ritorna None, con l'errore già stampato, se le configurazioni non sono valide.
+    """
     try:
         judge_config = load_json_config(judge_config_path)
         metrics_config = load_json_config(metrics_config_path)
     except Exception:
-        return
+        return None
 
     if not isinstance(judge_config, dict) or 'system_prompt' not in judge_config:
-        console.print("[bold red]Errore: 'config_judge.json' deve essere un oggetto JSON con la chiave 'system_prompt'.[/bold red]")
-        return
+        console.print("[bold red]Errore: 'config_judge.json' deve essere un oggetto JSON con la chiave "
+                      "'system_prompt'.[/bold red]")
+        return None
     if not isinstance(metrics_config, list):
         console.print("[bold red]Errore: 'config_metrics.json' deve essere un array JSON.[/bold red]")
+        return None
+
+    try:
+        transcript_options = TranscriptOptions.from_cli(options.transcript_budget, options.transcript_strategy)
+    except ValueError as e:
+        console.print(f"[bold red]Errore: {e}.[/bold red]")
+        return None
+
+    # Parti statiche dei prompt (system prompt, criteri, applicabilità) calcolate una sola volta
+    try:
+        plan = PromptPlan(judge_config, metrics_config, transcript_options)
+    except ValueError as e:
+        console.print(f"[bold red]Errore in 'config_metrics.json': {e}.[/bold red]")
+        return None
+    try:
+        near_index = NearDuplicateIndex(options.near_duplicates) if options.near_duplicates is not None else None
+    except ValueError as e:
+        console.print(f"[bold red]Errore: {e}.[/bold red]")
+        return None
+    return plan, metrics_config, near_index
+
+
+def _report_dry_run(plan: PromptPlan, logs_dir: Path, selected_logs: list[tuple[int, Path]], options: RunOptions,
+                    near_index: NearDuplicateIndex | None) -> dict:
+    """Solo validazione e conteggio: nessun client del giudice, nessun file scritto."""
+    summary = dry_run(plan, logs_dir, selected_logs, batch_metrics=options.batch_metrics,
+                      ingest_workers=options.ingest_workers, transcript_options=plan.transcript_options,
+                      dedupe=options.dedupe, near_duplicates=near_index)
+    console.print(f"[bold cyan]Dry run: {summary['valid']} log validi, {summary['skipped']} saltati; "
+                  f"chiamate al giudice previste: {summary['calls']} (senza considerare cache e journal).[/bold cyan]")
+    if summary["duplicates"]:
+        console.print(f"[cyan]Duplicati esatti: {summary['duplicates']} conversazioni, "
+                      f"{summary['calls_saved']} chiamate al giudice evitate.[/cyan]")
+    if near_index is not None:
+        summary["near_duplicates"] = print_near_duplicates(near_index.report())
+    prompt_stats = plan.stats.to_dict()
+    if prompt_stats["requests"]:
+        print_prompt_stats(prompt_stats)
+    return summary
+
+
+def _load_previous_results(plan: PromptPlan, logs_dir: Path, output_dir: Path, selected_logs: list[tuple[int, Path]],
+                           fingerprints: InputFingerprints, options: RunOptions) -> PreviousResults:
+    """Valutazioni precedenti per `--incremental`, lette prima che gli output vengano riscritti.
+
+    Il piano delle celle da ricalcolare viene stampato e salvato in
+    `incremental_plan.json` prima di qualunque chiamata al giudice.
+    """
+    previous = PreviousResults.load(output_dir, logs_dir, options.details_format, options.results_store)
+    if previous.source is None:
+        console.print(f"[yellow]--incremental: nessun risultato precedente in '{output_dir}', valuto tutte le "
+                      "celle.[/yellow]")
+    else:
+        console.print(f"[cyan]--incremental: {len(previous)} simulazioni precedenti lette da "
+                      f"'{previous.source}'.[/cyan]")
+    incremental_plan = plan_incremental(plan, logs_dir, selected_logs, previous, fingerprints,
+                                        ingest_workers=options.ingest_workers,
+                                        transcript_options=plan.transcript_options)
+    print_incremental_plan(incremental_plan)
+    run_metrics.add("incremental_cells", incremental_plan.recompute, action="recompute")
+    run_metrics.add("incremental_cells", incremental_plan.reuse, action="reuse")
+    try:
+        with open(output_dir / "incremental_plan.json", "w", encoding="utf-8") as pf:
+            json.dump(incremental_plan.to_dict(), pf, ensure_ascii=False, indent=2)
+    except Exception as e:
+        console.print(f"[yellow]Impossibile scrivere incremental_plan.json: {e}[/yellow]")
+    return previous
+
+
+def _open_csv(csv_path: Path, output_dir: Path, append: bool):
+    """Apre il CSV dei risultati, con un file alternativo se è bloccato.
+
+    Ritorna `(file, percorso usato, append)`, None (con l'errore stampato) se
+    nessun file può essere aperto.
+    """
+    try:
+        return open(csv_path, "a" if append else "w", newline="", encoding="utf-8"), csv_path, append
+    except PermissionError:
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        fallback = output_dir / f"results_summary_{ts}.csv"
+        console.print(f"[yellow]PermissionError: non posso scrivere su '{csv_path}'. Provo con file alternativo: "
+                      f"'{fallback}'[/yellow]")
+        try:
+            return open(fallback, "w", newline="", encoding="utf-8"), fallback, False
+        except Exception as e:
+            console.print(f"[bold red]Errore: impossibile aprire file di output: {e}[/bold red]")
+    except Exception as e:
+        console.print(f"[bold red]Errore aprendo il file di output '{csv_path}': {e}[/bold red]")
+    return None
+
+
+def _configure_judge(options: RunOptions, output_dir: Path) -> None:
+    """Retry, limitatore, cache delle risposte e cache di contesto condivisi dalle chiamate al giudice."""
+    global rate_limiter, judge_cache, judge_retrier, allow_stub_fallback, context_cache
+    judge_retrier = JudgeRetrier(options.retry_policy, failure_threshold=options.breaker_threshold,
+                                 cooldown=options.breaker_cooldown, max_trips=options.breaker_max_trips)
+    allow_stub_fallback = options.fallback_stub
+
+    # Il limitatore condiviso sostituisce la pausa fissa di 1s dopo ogni chiamata
+    rate_limiter = RateLimiter(options.requests_per_minute, options.tokens_per_minute)
+    console.print(f"[cyan]Valutazione concorrente: {options.workers} chiamate in parallelo, "
+                  f"limite {options.requests_per_minute or '∞'} richieste/min, "
+                  f"{options.tokens_per_minute or '∞'} token/min.[/cyan]")
+
+    # Cache delle risposte: con --refresh le letture vengono ignorate ma le nuove risposte salvate
+    judge_cache = None
+    if options.use_cache:
+        try:
+            judge_cache = JudgeCache(options.cache_path or (output_dir / "judge_cache.sqlite"),
+                                     max_entries=options.cache_max_entries, max_age_days=options.cache_max_age_days,
+                                     refresh=options.refresh_cache)
+            removed = judge_cache.evict()
+            console.print(f"[cyan]Cache del giudice: '{judge_cache.path}' ({len(judge_cache)} voci, {removed} "
+                          "rimosse).[/cyan]")
+        except Exception as e:
+            console.print(f"[yellow]Impossibile aprire la cache del giudice, proseguo senza: {e}[/yellow]")
+            judge_cache = None
+
+    context_cache = _make_context_cache(options.context_cache_min_tokens, options.context_cache_ttl)
+
+
+def _open_details_outputs(options: RunOptions, output_dir: Path, header: list[str],
+                          resume: bool) -> tuple[ResultsStore | None, JsonlDetailsSink, Path]:
+    """Archivio SQLite (con `results_store`) e file JSONL dei dettagli scritto in streaming.
+
+    Ritorna `(archivio o None, sink dei dettagli, percorso del file JSONL)`;
+    solleva l'eccezione dell'archivio se non può essere aperto.
+    """
+    # Archivio SQLite dei risultati al posto dei file di details/: una transazione ogni blocco di simulazioni
+    store = None
+    if options.results_store is not None:
+        store = ResultsStore(options.results_store, header=header, resume=resume)
+        console.print(f"[cyan]Archivio dei risultati: '{store.path}'.[/cyan]")
+
+    # I dettagli per conversazione vengono scritti in streaming (una riga JSONL per simulazione)
+    # invece di essere accumulati in memoria; alla fine vengono compattati per log_file.
+    if options.details_format == "jsonl":
+        details_stream_path = output_dir / "results_details.jsonl"
+        details_sink = JsonlDetailsSink(details_stream_path, append=True, fsync_every=options.fsync_every)
+    else:
+        details_stream_path = output_dir / "results_details.partial.jsonl"
+        details_sink = JsonlDetailsSink(details_stream_path, append=resume, fsync_every=options.fsync_every)
+    return store, details_sink, details_stream_path
+
+
+class _LogProcessor:
+    """Valutazione di un log nel suo thread: journal, duplicati, riuso incrementale e giudice."""
+
+    def __init__(self, plan: PromptPlan, engine: EvaluationEngine, journal: CheckpointJournal,
+                 fingerprints: InputFingerprints, batch_metrics: bool, duplicates: DuplicateIndex | None,
+                 near_index: NearDuplicateIndex | None, previous: PreviousResults | None):
+        self.plan = plan
+        self.engine = engine
+        self.journal = journal
+        self.fingerprints = fingerprints
+        self.batch_metrics = batch_metrics
+        self.duplicates = duplicates
+        self.near_index = near_index
+        self.previous = previous
+
+    def __call__(self, item: tuple[int, Path, Callable[[], dict]]) -> dict | None:
+        """Ritorna None per i log da saltare, altrimenti un dict con riga, dettagli e hash del log.
+
+        Il record preparato dalla fase di ingest viene atteso qui, nel thread
+        del log, così il thread principale continua a scrivere i risultati.
+        Per i log già completati in un'esecuzione precedente la riga è None:
+        sono già nel CSV, in `details/` e nel file JSONL dei dettagli.
+        """
+        i, log_file, fetch_record = item
+        with run_metrics.stage("ingest"), profiler.active():
+            record = fetch_record()
+        for message in record["messages"]:
+            console.print(message)
+        log_hash = record["log_hash"]
+        if log_hash and self.journal.completed_sim_id(str(log_file), log_hash) is not None:
+            run_metrics.add("logs", status="resumed")
+            return {"row": None, "detail": None, "log_hash": log_hash}
+
+        conv = record["conv"]
+        if conv is None:
+            run_metrics.add("logs", status="skipped")
+            return None
+        if self.near_index is not None:
+            self.near_index.add(conv)
+        reuse = None
+        if self.previous is not None:
+            reuse = self.previous.reusable(conv, self.fingerprints, self.plan.applicable(conv['approach']))
+        duplicates = self.duplicates
+        original = duplicates.claim(conv["fingerprint"]) if duplicates is not None else None
+        # comprende l'attesa delle chiamate al giudice della conversazione (o della sua prima copia)
+        with run_metrics.stage("evaluate"), profiler.active():
+            if original is not None:
+                row, evaluations = self.reuse_evaluation(conv, original.result())
+            else:
+                try:
+                    row, evaluations = evaluate_conversation(conv, self.plan, self.engine,
+                                                             batch_metrics=self.batch_metrics, journal=self.journal,
+                                                             fingerprints=self.fingerprints, reuse=reuse)
+                except BaseException as e:
+                    if duplicates is not None:
+                        duplicates.fail(conv["fingerprint"], e)
+                    raise
+                if duplicates is not None:
+                    duplicates.resolve(conv["fingerprint"], (row[5:], evaluations, conv.get("transcript_trimming"),
+                                                             conv["judge_calls"]))
+        return {"row": row, "detail": build_detail(conv, evaluations), "log_hash": log_hash}
+
+    def reuse_evaluation(self, conv: dict, original: tuple[list, dict, dict | None, int]) -> tuple[list, dict]:
+        """Riga e valutazioni di un duplicato esatto, dalla valutazione della prima copia.
+
+        Le chiamate evitate sono quelle che la prima copia ha inviato davvero al
+        giudice: le celle che ha riusato sarebbero state riusate anche qui.
+        """
+        scores, evaluations, trimming, calls = original
+        if trimming is not None and 'by_metric' in trimming and 'transcript_trimming' in conv:
+            conv['transcript_trimming']['by_metric'] = trimming['by_metric']
+        self.duplicates.add_saved_calls(calls)
+        # l'impronta dipende dall'hash del log, che può differire tra copie con la stessa conversazione
+        evaluations = {name: self.fingerprints.stamp(conv['log_hash'], name, evaluation)
+                       if FINGERPRINT_KEY in evaluation else evaluation for name, evaluation in evaluations.items()}
+        row = [conv['sim_id'], conv['approach'], conv['profile'], conv['scenario_name'], conv['asymmetry_level']]
+        return row + list(scores), evaluations
+
+
+def _watch_logs(watcher: LogWatcher, logs_dir: Path, log_files: list[Path], shard: ShardSpec | None,
+                evaluate_logs: Callable[[list[tuple[int, Path]]], int]) -> None:
+    """Modalità watch: valuta con `evaluate_logs` i log nuovi o modificati, fino a Ctrl+C.
+
+    Client del giudice, cache, motore e pool di ingest restano attivi e i
+    risultati vanno in append sugli output esistenti. I log nuovi ricevono
+    l'indice (e quindi il Sim_ID) successivo a quelli già noti: i Sim_ID sono
+    in append e un log che si colloca tra quelli esistenti non ha quello di una
+    nuova esecuzione completa (né di --shard/merge, che numerano l'elenco
+    ordinato dei log).
+    """
+    sim_indices = {f: i for i, f in enumerate(log_files)}
+    last_log = log_files[-1] if log_files else None
+    console.print(f"[bold cyan]Modalità watch ({watcher.backend}): in attesa di log nuovi o modificati "
+                  f"in '{logs_dir}' (Ctrl+C per terminare).[/bold cyan]")
+    while True:
+        batch = []
+        misplaced = 0
+        for log_file in watcher.wait():
+            if shard is not None and not shard.owns(log_file.relative_to(logs_dir).as_posix()):
+                continue
+            if log_file not in sim_indices:
+                if last_log is not None and log_file < last_log:
+                    misplaced += 1
+                else:
+                    last_log = log_file
+                sim_indices[log_file] = len(sim_indices)
+            batch.append((sim_indices[log_file], log_file))
+        if not batch:
+            continue
+        if misplaced:
+            run_metrics.add("watch_misplaced_logs", misplaced)
+            console.print(f"[yellow]Watch: {misplaced} log nuovi si collocano tra quelli già valutati e "
+                          f"ricevono un Sim_ID in coda, diverso da quello di una nuova esecuzione "
+                          f"completa: rieseguire senza --watch per allinearli a --shard/merge.[/yellow]")
+        written = evaluate_logs(batch)
+        run_metrics.add("watch_batches")
+        console.print(f"[cyan]Watch: {written} log valutati su {len(batch)} nuovi o modificati.[/cyan]")
+
+
+def _close_judge_caches() -> None:
+    """Riepiloga e chiude la cache delle risposte e la cache di contesto dell'esecuzione."""
+    global judge_cache, context_cache
+    if judge_cache is not None:
+        judge_cache.evict()
+        console.print(f"[cyan]Cache del giudice: {judge_cache.summary()}.[/cyan]")
+        run_metrics.add("cache_lookups", judge_cache.hits, result="hit")
+        run_metrics.add("cache_lookups", judge_cache.misses, result="miss")
+        judge_cache.close()
+        judge_cache = None
+    if context_cache is not None:
+        if context_cache.registrations or context_cache.failures:
+            console.print(f"[cyan]Cache di contesto: {context_cache.summary()}.[/cyan]")
+        run_metrics.add("context_cache_registrations", context_cache.registrations)
+        context_cache = None
+
+
+def _finalize_details(details_format: str, details_stream_path: Path, output_dir: Path,
+                      keep_position: bool = False) -> None:
+    """Compattazione in streaming del file dei dettagli.
+
+    Deduplica per log_file (le nuove entry sovrascrivono le vecchie) e, nel
+    formato "json", unisce con l'eventuale results_details.json esistente.
+    Con `keep_position` (esecuzioni in append) una entry rivalutata resta al
+    posto della precedente, come la sua riga nel CSV.
+    """
+    try:
+        if details_format == "jsonl":
+            final_details = details_stream_path
+            _, written = compact_details([details_stream_path], final_details, output_format="jsonl",
+                                         keep_position=keep_position)
+        else:
+            final_details = output_dir / "results_details.json"
+            try:
+                _, written = compact_details([final_details, details_stream_path], final_details, output_format="json",
+                                             keep_position=keep_position)
+            except Exception as e:
+                # se il file esistente è corrotto, lo ignoro e sovrascrivo
+                console.print(f"[yellow]Impossibile unire '{final_details}' esistente ({e}): lo sovrascrivo.[/yellow]")
+                _, written = compact_details([details_stream_path], final_details, output_format="json",
+                                             keep_position=keep_position)
+            details_stream_path.unlink(missing_ok=True)
+        console.print(f"-> File JSON riepilogativo salvato in: '{final_details}' ({written} simulazioni)")
+    except Exception as e:
+        console.print(f"[bold red]Errore scrivendo il JSON aggregato: {e}[/bold red]")
+
+
+def _compact_summary(csv_path: Path) -> None:
+    """Tiene nel CSV scritto in append una sola riga per Sim_ID (l'ultima), al posto della prima."""
+    try:
+        read, written = compact_summary(csv_path)
+    except Exception as e:
+        console.print(f"[bold red]Errore compattando '{csv_path}': {e}[/bold red]")
         return
+    if written < read:
+        console.print(f"-> '{csv_path}': {read - written} righe sostituite da una rivalutazione dello stesso Sim_ID")
+
+
+def _print_run_summary(plan: PromptPlan, output_dir: Path, duplicates: DuplicateIndex | None,
+                       near_index: NearDuplicateIndex | None, trimmed_logs: int, trimmed_tokens: int) -> None:
+    """Riepilogo di trascrizioni, duplicati, prompt e giudice; scrive near_duplicates.json e prompt_stats.json."""
+    if plan.transcript_options.enabled:
+        console.print(f"[cyan]Trascrizioni ridotte: {trimmed_logs} log, "
+                      f"~{trimmed_tokens} token stimati in meno.[/cyan]")
+    if duplicates is not None and duplicates.duplicates:
+        console.print(f"[cyan]Deduplicazione: {duplicates.summary()}.[/cyan]")
+    if near_index is not None:
+        try:
+            with open(output_dir / "near_duplicates.json", "w", encoding="utf-8") as nf:
+                json.dump(print_near_duplicates(near_index.report()), nf, ensure_ascii=False, indent=2)
+            console.print(f"-> Report dei quasi-duplicati salvato in: '{output_dir / 'near_duplicates.json'}'")
+        except Exception as e:
+            console.print(f"[yellow]Impossibile scrivere near_duplicates.json: {e}[/yellow]")
+    # Dimensioni dei prompt: dove vanno i token di input
+    prompt_stats = plan.stats.to_dict()
+    if prompt_stats["requests"]:
+        print_prompt_stats(prompt_stats)
+        try:
+            with open(output_dir / "prompt_stats.json", "w", encoding="utf-8") as pf:
+                json.dump(prompt_stats, pf, ensure_ascii=False, indent=2)
+        except Exception as e:
+            console.print(f"[yellow]Impossibile scrivere prompt_stats.json: {e}[/yellow]")
+    if judge_retrier.retries or judge_retrier.errors:
+        console.print(f"[cyan]Retry del giudice: {judge_retrier.summary()}.[/cyan]")
+    if rate_limiter.enabled:
+        console.print(f"[cyan]Attesa totale imposta dal limitatore: {rate_limiter.waited_seconds:.1f}s su "
+                      f"{rate_limiter.acquired} richieste.[/cyan]")
+    if isinstance(gemini_model, JudgePool):
+        console.print(f"[cyan]Pool del giudice: {gemini_model.summary()}.[/cyan]")
+
+
+def _record_judge_metrics(duplicates: DuplicateIndex | None) -> None:
+    """Ritentativi, errori, attese e statistiche del pool nel report dell'esecuzione."""
+    run_metrics.add("retries", judge_retrier.retries)
+    if duplicates is not None:
+        run_metrics.add("duplicate_conversations", duplicates.duplicates)
+        run_metrics.add("duplicate_calls_saved", duplicates.calls_saved)
+    for kind, count in judge_retrier.errors.items():
+        run_metrics.add("judge_errors", count, kind=kind)
+    run_metrics.add("sleep_seconds", rate_limiter.waited_seconds, reason="rate_limiter")
+    run_metrics.add("sleep_seconds", judge_retrier.backoff_seconds, reason="backoff")
+    run_metrics.add("sleep_seconds", judge_retrier.breaker_paused_seconds, reason="circuit_breaker")
+    if isinstance(gemini_model, JudgePool):
+        for entry in gemini_model.stats():
+            run_metrics.add("pool_calls", entry["calls"], endpoint=entry["name"])
+            run_metrics.add("pool_errors", entry["errors"], endpoint=entry["name"])
+            run_metrics.add("pool_ejections", entry["ejections"], endpoint=entry["name"])
+            run_metrics.add("sleep_seconds", entry["quota_wait_seconds"], reason=f"pool:{entry['name']}")
+        run_metrics.add("pool_failovers", gemini_model.failovers)
+
+
+def main(logs_dir: Path, output_dir: Path, judge_config_path: Path, metrics_config_path: Path,
+         options: RunOptions | None = None, **overrides):
+    """Orchestra il processo di valutazione.
+
+    Le opzioni sono quelle di `RunOptions`; gli argomenti con nome ne
+    sostituiscono i campi. Solleva `FatalJudgeError` (dopo aver salvato il
+    lavoro completato) se il modello restituisce un errore irreversibile e
+    `fallback_stub` è disattivato. Con `dry_run_only` ritorna il riepilogo
+    delle chiamate previste senza contattare il giudice.
+    """
+    global run_metrics, profiler
+    options = replace(options or RunOptions(), **overrides)
+    _use_judge_pool(options.judge_pool)
+    run_metrics = RunMetrics()
+    profiler = Profiler(enabled=options.profile)
+    loaded = _load_plan(judge_config_path, metrics_config_path, options)
+    if loaded is None:
+        return
+    plan, metrics_config, near_index = loaded
+    transcript_options = plan.transcript_options
+    shard = options.shard
 
     script_dir = Path(__file__).parent
     if not logs_dir.is_absolute():
@@ -175,311 +1422,493 @@ def main(logs_dir: Path, output_dir: Path, judge_config_path: Path, metrics_conf
         console.print(f"[bold red]La cartella di input non esiste: '{logs_dir}'.[/bold red]")
         return
 
-    log_files = sorted(list(logs_dir.rglob("*.json")))
-    if not log_files:
-        console.print(f"[bold red]Nessun file .json trovato in '{logs_dir}'.[/bold red]")
+    # Con --watch le modifiche vanno osservate da prima dell'elenco iniziale, per non perderne
+    watcher = None
+    if options.watch and not options.dry_run_only:
+        watcher = LogWatcher(logs_dir, settle_seconds=options.watch_settle, poll_interval=options.watch_interval)
+    log_files = find_log_files(logs_dir)
+    if not log_files and watcher is None:
+        console.print(f"[bold red]Nessun file .json o .jsonl trovato in '{logs_dir}'.[/bold red]")
         return
 
     console.print(f"[bold cyan]Trovati {len(log_files)} log. Inizio valutazione.[/bold cyan]")
+    # Con --shard si valuta solo una partizione stabile dei log; gli indici (e quindi i Sim_ID)
+    # restano quelli dell'elenco completo.
+    selected_logs = list(enumerate(log_files)) if shard is None else shard.select(log_files, logs_dir)
+    if shard is not None:
+        console.print(f"[cyan]Shard {shard}: {len(selected_logs)} log su {len(log_files)}.[/cyan]")
+    if transcript_options.enabled:
+        console.print(f"[cyan]Trascrizioni limitate a ~{transcript_options.budget_tokens} token "
+                      f"(strategie: {', '.join(transcript_options.strategies)}).[/cyan]")
+
+    if options.dry_run_only:
+        return _report_dry_run(plan, logs_dir, selected_logs, options, near_index)
+
+    if options.incremental and (options.resume or options.watch):
+        console.print("[bold red]Errore: l'esecuzione incrementale non è compatibile con --resume e "
+                      "--watch.[/bold red]")
+        return
+
+    # Il modello viene provato qui, prima di creare gli output: un errore di configurazione
+    # (chiave mancante, nessun modello disponibile) interrompe subito l'esecuzione.
+    judge_model = get_judge_model()
+    # Impronta degli input di ogni valutazione: log, definizione della metrica, system prompt, modello
+    fingerprints = InputFingerprints(plan, getattr(judge_model, 'model_name', '') or type(judge_model).__name__,
+                                     transcript_options)
 
     output_dir.mkdir(parents=True, exist_ok=True)
-    
+    details_dir = output_dir / "details"
+    if options.results_store is None:
+        details_dir.mkdir(parents=True, exist_ok=True)
+
+    previous = None
+    if options.incremental:
+        previous = _load_previous_results(plan, logs_dir, output_dir, selected_logs, fingerprints, options)
+
     # MODIFICA 1: Rinominiamo il file CSV per chiarire che è un riepilogo.
     csv_path = output_dir / "results_summary.csv"
 
     metric_names = [metric.get('metric_name', f'UNKNOWN_METRIC_{i}') for i, metric in enumerate(metrics_config)]
-    
+
     # MODIFICA 2: L'header ora contiene solo i nomi delle metriche, non le giustificazioni.
     header = ["Sim_ID", "Approach", "Profile", "Scenario", "Asymmetry"] + metric_names
+    if shard is not None:
+        write_manifest(output_dir, shard, len(log_files), len(selected_logs), metric_names)
+
+    # Journal di checkpoint: con --resume si riparte da dove ci si era fermati,
+    # in append su CSV e details/, altrimenti si ricomincia da zero.
+    journal_path = output_dir / "evaluation_journal.jsonl"
+    resume = options.resume
+    if watcher is not None and not resume:
+        # il processo in watch riparte da dove si era fermato, se trova un journal
+        resume = journal_path.exists()
+    if resume and not journal_path.exists():
+        console.print(f"[yellow]--resume richiesto ma nessun journal trovato in '{journal_path}': inizio una nuova "
+                      "valutazione.[/yellow]")
+        resume = False
 
     # Gestione apertura file CSV con fallback in caso di file bloccato
-    used_csv_path = None
+    opened = _open_csv(csv_path, output_dir, resume and csv_path.exists() and csv_path.stat().st_size > 0)
+    if opened is None:
+        return
+    csv_file, used_csv_path, append_csv = opened
+
+    _configure_judge(options, output_dir)
+
+    journal = CheckpointJournal(journal_path, resume=resume)
+    if resume:
+        console.print(f"[cyan]Ripresa dal journal '{journal_path}': {journal.completed_count} log completati, "
+                      f"{journal.metric_count} valutazioni riutilizzabili.[/cyan]")
+
     try:
-        csv_file = open(csv_path, "w", newline="", encoding="utf-8")
-        used_csv_path = csv_path
-    except PermissionError:
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        fallback = output_dir / f"results_summary_{ts}.csv"
-        console.print(f"[yellow]PermissionError: non posso scrivere su '{csv_path}'. Provo con file alternativo: '{fallback}'[/yellow]")
-        try:
-            csv_file = open(fallback, "w", newline="", encoding="utf-8")
-            used_csv_path = fallback
-        except Exception as e:
-            console.print(f"[bold red]Errore: impossibile aprire file di output: {e}[/bold red]")
-            return
+        store, details_sink, details_stream_path = _open_details_outputs(options, output_dir, header, resume)
     except Exception as e:
-        console.print(f"[bold red]Errore aprendo il file di output '{csv_path}': {e}[/bold red]")
+        console.print(f"[bold red]Errore aprendo l'archivio dei risultati '{options.results_store}': {e}[/bold red]")
+        csv_file.close()
+        journal.close()
         return
 
-    # Raccogliamo anche un unico JSON riepilogativo con tutti i dettagli per conversazione
-    all_details = []
-
-    with csv_file as csv_f, Progress(console=console) as progress:
+    # Pipeline produttore/consumatore: un pool di processi prepara i log (lettura, parsing,
+    # trascrizione, persona) qualche record in anticipo rispetto alla fase di giudizio.
+    ingest_workers = options.ingest_workers
+    if options.profile and ingest_workers is None:
+        # cProfile vede solo questo processo: con --profile l'ingest gira nei thread dei log
+        ingest_workers = 0
+        console.print("[cyan]--profile: preparazione dei log nel processo principale (--ingest-workers 0).[/cyan]")
+    # Conversazioni identiche: la prima viene valutata, le copie ne riusano il risultato
+    duplicates = DuplicateIndex() if options.dedupe else None
+    engine = EvaluationEngine(workers=options.workers)
+    ingest = IngestPipeline(logs_dir, workers=ingest_workers, prefetch=engine.max_pending + 2 * (ingest_workers or 1),
+                            transcript_options=transcript_options)
+    process_log = _LogProcessor(plan, engine, journal, fingerprints, options.batch_metrics, duplicates, near_index,
+                                previous)
+    trimmed_logs = 0
+    trimmed_tokens = 0
+    fatal_error = None
+
+    with csv_file as csv_f, Progress(console=console) as progress, ingest, engine, profiler.active():
         csv_writer = csv.writer(csv_f)
-        csv_writer.writerow(header)
+        if not append_csv:
+            csv_writer.writerow(header)
 
-        log_task = progress.add_task("[green]Valutando i log...", total=len(log_files))
+        planned_logs = len(selected_logs)
+        log_task = progress.add_task("[green]Valutando i log...", total=planned_logs)
 
-        for i, log_file in enumerate(log_files):
-            progress.update(log_task, description=f"Processing [bold]{log_file.name}[/bold]")
-            # Protezione: salta file JSON vuoti o non-parsabili invece di rompere l'intero run.
-            try:
-                # controlla dimensione file prima di aprire
-                if log_file.stat().st_size == 0:
-                    console.print(f"[yellow]File vuoto ignorato: {log_file}[/yellow]")
+        def write_outputs(row: list, detail_obj: dict, log_file: Path, log_hash: str) -> None:
+            csv_writer.writerow(row)
+            csv_f.flush()
+            details_sink.write(detail_obj)
+            # Solo ora il log è completo: riga CSV e dettagli sono su disco
+            journal.record_log(str(log_file), log_hash, detail_obj['Sim_ID'])
+
+        def evaluate_logs(logs: list[tuple[int, Path]]) -> int:
+            """Valuta i log `(indice, file)` e ne scrive i risultati; ritorna quanti sono stati scritti."""
+            nonlocal trimmed_logs, trimmed_tokens
+            written = 0
+            # I risultati arrivano nell'ordine dei file: righe CSV e dettagli restano deterministici
+            for (i, log_file, _), result in engine.map_ordered(process_log, ingest.iter_records(
+                    [f for _, f in logs], [i for i, _ in logs])):
+                # i file multi-conversazione aggiungono un record per conversazione
+                progress.update(log_task, total=planned_logs + ingest.extra_records,
+                                description=f"Processing [bold]{log_file.name}[/bold]")
+                if result is None:
                     progress.update(log_task, advance=1)
                     continue
-                with open(log_file, "r", encoding="utf-8") as f:
-                    log_data = json.load(f)
-            except json.JSONDecodeError:
-                # Tentativo di recupero: rimuoviamo eventuale testo prefisso non-JSON
-                try:
-                    txt = open(log_file, 'r', encoding='utf-8', errors='replace').read()
-                    start = txt.find('{')
-                    end = txt.rfind('}')
-                    if start != -1 and end != -1 and end > start:
-                        candidate = txt[start:end+1]
-                        log_data = json.loads(candidate)
-                        console.print(f"[yellow]Parsed JSON dopo trimming del prefisso per: {log_file}[/yellow]")
-                    else:
-                        console.print(f"[yellow]JSON non valido in file (nessun oggetto individuabile), salto: {log_file}[/yellow]")
-                        progress.update(log_task, advance=1)
-                        continue
-                except Exception:
-                    console.print(f"[yellow]JSON non valido in file, salto: {log_file}[/yellow]")
+                row, detail_obj = result["row"], result["detail"]
+                if row is None:
+                    # già scritto in un'esecuzione precedente (--resume)
                     progress.update(log_task, advance=1)
                     continue
-            except Exception as e:
-                console.print(f"[yellow]Errore aprendo/parsing {log_file}: {e} - salto file[/yellow]")
+                with run_metrics.stage("output"):
+                    if store is not None:
+                        # CSV, dettagli e journal seguono il commit del blocco che contiene la simulazione
+                        store.add(row, detail_obj, on_commit=partial(write_outputs, row, detail_obj, log_file,
+                                                                     result["log_hash"]))
+                    else:
+                        # salva anche file di dettaglio singolo (opzionale, per auditing)
+                        details_path = details_dir / f"{detail_obj['Sim_ID']}__details.json"
+                        with open(details_path, "w", encoding="utf-8") as df:
+                            json.dump(detail_obj, df, ensure_ascii=False, indent=2)
+                        write_outputs(row, detail_obj, log_file, result["log_hash"])
+                run_metrics.add("logs", status="evaluated")
+                written += 1
+                trimming = detail_obj.get('transcript_trimming')
+                if trimming and trimming['trimmed_est_tokens']:
+                    trimmed_logs += 1
+                    trimmed_tokens += trimming['trimmed_est_tokens']
                 progress.update(log_task, advance=1)
-                continue
+            if store is not None:
+                with run_metrics.stage("output"):
+                    store.flush()
+            return written
 
-            # Normalizziamo la struttura della conversazione per chiavi alternative
-            conv = log_data.get('conversation') or []
-            if isinstance(conv, list):
-                for turn in conv:
-                    if not isinstance(turn, dict):
-                        continue
-                    if 'speaker' in turn and 'agent' not in turn:
-                        try:
-                            turn['agent'] = turn.pop('speaker')
-                        except Exception:
-                            pass
-                    if 'message' in turn and 'content' not in turn:
-                        try:
-                            turn['content'] = turn.pop('message')
-                        except Exception:
-                            pass
-            if 'conversation' in log_data:
-                log_data['conversation'] = conv
-
-            # Estrazione metadati dal nome/percorso del file
-            relative_path = log_file.relative_to(logs_dir)
-            profile = relative_path.parent.name if len(relative_path.parts) > 1 else "N/A"
-            scenario_name = relative_path.stem
-            sim_id = f"Sim_{(i+1):03d}_{scenario_name}"
-            approach = 'A' if 'approach_a' in log_file.name.lower() else 'B'
-            asymmetry_level = scenario_name.split('_')[-1]
-            
-            # Preparazione dati per la valutazione
-            agents = log_data.get("agents", [])
-
-            # Estrarre ground-truth e il system_prompt completo dell'Agent_2 (raw + parsed se JSON)
-            gt_obj = agents[0].get("system_prompt", {}) if len(agents) > 0 and isinstance(agents[0], dict) else {}
-            ground_truth = json.dumps(gt_obj, ensure_ascii=False)
-            transcript = format_transcript(log_data.get("conversation", []))
-
-            # Agent_2: estrai system_prompt raw e prova a parsarlo se contiene JSON
-            agent2_persona_raw = ""
-            agent2_persona_parsed = {}
-            agent2_profile_name = ""
-            if len(agents) > 1 and isinstance(agents[1], dict):
-                agent2_persona_raw = agents[1].get("system_prompt", "") or ""
-                # tentativo semplice di estrarre oggetto JSON contenuto nella stringa
-                try:
-                    start = agent2_persona_raw.find("{")
-                    end = agent2_persona_raw.rfind("}")
-                    if start != -1 and end != -1 and end > start:
-                        candidate = agent2_persona_raw[start:end+1]
-                        parsed = json.loads(candidate)
-                        if isinstance(parsed, dict):
-                            agent2_persona_parsed = parsed
-                            persona_cfg = parsed.get("persona_configuration", {}) or {}
-                            agent2_profile_name = persona_cfg.get("profile_name", "") or persona_cfg.get("agent_name", "")
-                except Exception:
-                    agent2_persona_parsed = {}
-
-            # Aggiungiamo le informazioni del personaggio al prompt del giudice per valutazioni contestuali
-            persona_section = ""
-            if agent2_profile_name or agent2_persona_parsed:
-                persona_section = "\n\n**AGENT_2 PERSONA / CHARACTER METADATA**\n"
-                if agent2_profile_name:
-                    persona_section += f"- Profile name: {agent2_profile_name}\n"
-                if agent2_persona_parsed:
-                    persona_section += f"- Persona JSON (estratto): {json.dumps(agent2_persona_parsed, ensure_ascii=False)}\n"
-                else:
-                    persona_section += f"- Persona raw (non-json): {agent2_persona_raw[:1000]}\n"
-
-            # Rendiamo disponibili queste informazioni anche nei dettagli di output
-            # (evaluations viene popolato più avanti; salviamo comunque i raw qui)
-            extra_persona_info = {
-                "agent2_persona_raw": agent2_persona_raw,
-                "agent2_persona_parsed": agent2_persona_parsed,
-                "agent2_profile_name": agent2_profile_name,
-            }
-            
-            row = [sim_id, approach, profile, scenario_name, asymmetry_level]
-            evaluations = {}
-
-            metric_task = progress.add_task(f"  -> Metriche per {log_file.name}", total=len(metrics_config))
-            for metric in metrics_config:
-                metric_name = metric.get('metric_name', 'UNKNOWN_METRIC')
-                progress.update(metric_task, description=f"  -> Valutando [yellow]{metric_name}[/yellow]")
-
-                # Applicabilità: default = "all". Se configurato diversamente, rispettalo.
-                applicable = metric.get("applicable_to", "all")
-                applies = False
-                if isinstance(applicable, str):
-                    applies = (applicable.lower() == "all") or (applicable.upper() == approach)
-                elif isinstance(applicable, list):
-                    applies = ( "all" in [a.lower() for a in applicable] ) or (approach in applicable)
-                if not applies:
-                    # scrivi N/A per questa metrica nel CSV e continua
-                    row.append("N/A")
-                    evaluations[metric_name] = {"Score": "N/A", "Justification": "Metric not applicable for this approach.", "RawResponse": ""}
-                    progress.update(metric_task, advance=1)
-                    continue
-
-                system_prompt_str = json.dumps(judge_config['system_prompt'], ensure_ascii=False)
-
-                user_prompt_str = f"""
-                **CONTESTO DELLA CONVERSAZIONE**
-                - Ground Truth (Obiettivi Segreti Agente B): {ground_truth}
-                - Trascrizione Completa:\n{transcript}
-                {persona_section}
-
-                **METRICA DA VALUTARE**
-                - Nome Metrica: "{metric.get('metric_name', 'N/A')}
-                - Descrizione: {metric.get('description', 'N/A')}
-
-                **CRITERI DI VALUTAZIONE**
-                {json.dumps(metric.get('scoring_criteria', {}), ensure_ascii=False, indent=2)}
-
-                Per favore, valuta la conversazione SOLO in base alla metrica e ai criteri forniti.
-                """
-
-                evaluation = evaluate_single_metric(system_prompt_str, user_prompt_str)
-
-                # Normalizza tipi speciali (likert_5 -> int 1..5)
-                value_type = metric.get("value_type", "").lower()
-                score_to_write = evaluation.get('Score', '')
-                if value_type == "likert_5":
-                    try:
-                        # supporta numeri come "4", "4.0" o anche stringhe
-                        si = int(float(str(score_to_write).strip()))
-                        if si < 1: si = 1
-                        if si > 5: si = 5
-                        score_to_write = str(si)
-                    except Exception:
-                        score_to_write = ""
-                else:
-                    score_to_write = str(score_to_write)
-
-                # Scrivi solo il punteggio sintetico nel CSV
-                row.append(score_to_write)
+        def evaluate_watched(logs: list[tuple[int, Path]]) -> int:
+            nonlocal planned_logs
+            planned_logs += len(logs)
+            progress.update(log_task, total=planned_logs)
+            return evaluate_logs(logs)
 
-                # Salviamo comunque l'intera valutazione per il file di dettaglio JSON.
-                evaluations[metric_name] = evaluation
-
-                progress.update(metric_task, advance=1)
-                time.sleep(1) # Rallenta le chiamate per rispettare i limiti API
-
-            csv_writer.writerow(row)
-
-            # Il salvataggio del JSON di dettaglio per l'audit rimane invariato ed è cruciale.
-            details_dir = output_dir / "details"
-            details_dir.mkdir(parents=True, exist_ok=True)
-            details_path = details_dir / f"{sim_id}__details.json"
-            detail_obj = {
-                'Sim_ID': sim_id,
-                'log_file': str(log_file),
-                'evaluations': evaluations,
-                'ground_truth': ground_truth,
-                'transcript': transcript,
-                'agent2_persona': extra_persona_info,
-                'evaluated_at': datetime.now().isoformat()
-            }
-            all_details.append(detail_obj)
-
-            # salva anche file di dettaglio singolo (opzionale, per auditing)
-            details_dir = output_dir / "details"
-            details_dir.mkdir(parents=True, exist_ok=True)
-            details_path = details_dir / f"{sim_id}__details.json"
-            with open(details_path, "w", encoding="utf-8") as df:
-                json.dump(detail_obj, df, ensure_ascii=False, indent=2)
-
-            progress.remove_task(metric_task)
-            progress.update(log_task, advance=1)
+        try:
+            evaluate_logs(selected_logs)
+            if watcher is not None:
+                _watch_logs(watcher, logs_dir, log_files, shard, evaluate_watched)
+        except KeyboardInterrupt:
+            if watcher is None:
+                raise
+            # fine della modalità watch: si chiudono gli output come al termine di una valutazione
+            console.print("[cyan]Modalità watch interrotta: chiudo gli output.[/cyan]")
+            engine.close(cancel=True)
+            ingest.close(cancel=True)
+        except FatalJudgeError as e:
+            # errore irreversibile del giudice: fermiamo i lavori in coda, quanto completato resta su disco
+            fatal_error = e
+            engine.close(cancel=True)
+            ingest.close(cancel=True)
+        finally:
+            # le simulazioni completate ancora in coda nell'archivio vengono scritte prima di chiudere il CSV
+            if store is not None:
+                store.close()
+
+    details_sink.close()
+    journal.close()
+    if watcher is not None:
+        watcher.close()
+
+    _close_judge_caches()
+    _print_run_summary(plan, output_dir, duplicates, near_index, trimmed_logs, trimmed_tokens)
 
     # MODIFICA 4: Aggiorniamo i messaggi finali per riflettere la nuova struttura dei file.
-    console.print(f"\n[bold green]Valutazione completata![/bold green]")
-    if used_csv_path:
-        console.print(f"-> Riepilogo CSV salvato in: '{used_csv_path}'")
-    console.print(f"-> Dettagli JSON per l'analisi approfondita salvati in: '{output_dir / 'details'}'")
+    if fatal_error is not None:
+        console.print(f"\n[bold red]Valutazione interrotta: {fatal_error}.[/bold red]")
+        console.print("[bold yellow]Controlla modello e chiave API, poi riprendi con --resume "
+                      "(oppure usa --fallback-stub per proseguire con il modello stub locale).[/bold yellow]")
+    else:
+        console.print("\n[bold green]Valutazione completata![/bold green]")
+    console.print(f"-> Riepilogo CSV salvato in: '{used_csv_path}'")
+    if store is not None:
+        console.print(f"-> Dettagli per l'analisi approfondita salvati nell'archivio: '{store.path}' ({store.written} "
+                      "simulazioni)")
+    else:
+        console.print(f"-> Dettagli JSON per l'analisi approfondita salvati in: '{output_dir / 'details'}'")
+
+    with run_metrics.stage("finalize"):
+        # log rivalutati (modificati durante --watch o prima di --resume): vale l'ultima valutazione,
+        # al posto della precedente
+        appended = resume or watcher is not None
+        if appended:
+            _compact_summary(used_csv_path)
+        _finalize_details(options.details_format, details_stream_path, output_dir, keep_position=appended)
+        if options.columnar:
+            # Archivio colonnare tipizzato per le analisi (python -m evaluation analyze)
+            try:
+                schema = write_columns(used_csv_path, metrics_config, output_dir / COLUMNS_DIR)
+                console.print(f"-> Archivio colonnare salvato in: '{output_dir / COLUMNS_DIR}' "
+                              f"({schema['rows']} righe)")
+            except Exception as e:
+                console.print(f"[yellow]Impossibile scrivere l'archivio colonnare: {e}[/yellow]")
 
-    # Scriviamo un singolo file JSON riepilogativo contenente tutti i dettagli per conversazione
-    summary_json_path = output_dir / "results_details.json"
+    # Report dell'esecuzione: dove sono andati tempo, byte e ritentativi
+    _record_judge_metrics(duplicates)
     try:
-        with open(summary_json_path, 'w', encoding='utf-8') as sf:
-            json.dump(all_details, sf, ensure_ascii=False, indent=2)
-        console.print(f"-> File JSON riepilogativo salvato in: '{summary_json_path}'")
+        report_path, prom_path = run_metrics.write(output_dir)
+        console.print(f"-> Report dell'esecuzione salvato in: '{report_path}' (metriche Prometheus in "
+                      f"'{prom_path.name}')")
     except Exception as e:
-        console.print(f"[yellow]Impossibile scrivere il file JSON riepilogativo: {summary_json_path} - Errore: {e}[/yellow]")
-        # fine loop dei log
-    # Merge con eventuale results_details.json esistente e scrittura atomica
-    final_json = output_dir / "results_details.json"
-    merged_map = {}
-    if final_json.exists():
-        try:
-            with open(final_json, "r", encoding="utf-8") as f_exist:
-                existing = json.load(f_exist)
-                for item in existing:
-                    key = item.get("log_file") or item.get("Sim_ID")
-                    if key:
-                        merged_map[key] = item
-        except Exception:
-            # se il file esistente è corrotto, lo ignoro e sovrascrivo
-            merged_map = {}
-
-    for item in all_details:
-        key = item.get("log_file") or item.get("Sim_ID")
-        if key:
-            merged_map[key] = item  # le nuove entry sovrascrivono le vecchie
+        console.print(f"[yellow]Impossibile scrivere il report dell'esecuzione: {e}[/yellow]")
+    if options.profile:
+        summary = profiler.dump(output_dir / PROFILE_NAME)
+        if summary:
+            (output_dir / "profile.txt").write_text(summary, encoding="utf-8")
+            console.print(f"-> Profilo cProfile salvato in: '{output_dir / PROFILE_NAME}' (riepilogo in 'profile.txt')")
+
+    if fatal_error is not None:
+        raise fatal_error
+
+
+def serve(address: tuple[str, int], config_dir: Path, output_dir: Path, workers: int = 4,
+          requests_per_minute: float | None = 60, tokens_per_minute: float | None = None,
+          batch_metrics: bool = False, use_cache: bool = True, cache_path: Path | None = None,
+          judge_pool: Path | None = None, transcript_budget: int | None = None,
+          transcript_strategy: str = "whitespace,dedupe,headtail", batch_window: float = 0.02,
+          max_batch: int = 16, context_cache_min_tokens: int | None = 4096, context_cache_ttl: float = 600.0) -> None:
+    """Servizio HTTP locale di valutazione (vedi `evaluation.service`), fino a Ctrl+C.
+
+    Le richieste concorrenti vengono raccolte in micro-batch di al più
+    `max_batch` conversazioni entro `batch_window` secondi; tutte condividono
+    limitatore, cache, cache di contesto e pool del giudice.
+    """
+    global rate_limiter, judge_cache, run_metrics, context_cache
+    _use_judge_pool(judge_pool)
+    run_metrics = RunMetrics()
+    try:
+        evaluator = Evaluator(config_dir, batch_metrics=batch_metrics, workers=workers,
+                              transcript_budget=transcript_budget, transcript_strategy=transcript_strategy)
+    except ValueError as e:
+        console.print(f"[bold red]Errore: {e}.[/bold red]")
+        return
+    except Exception:
+        return
 
-    merged_list = list(merged_map.values())
-    tmp_path = final_json.with_suffix(".json.tmp")
+    # come in main(): un errore di configurazione del giudice interrompe prima di accettare richieste
+    get_judge_model()
+    rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    context_cache = _make_context_cache(context_cache_min_tokens, context_cache_ttl)
+    if use_cache:
+        try:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            judge_cache = JudgeCache(cache_path or (output_dir / "judge_cache.sqlite"))
+            console.print(f"[cyan]Cache del giudice: '{judge_cache.path}' ({len(judge_cache)} voci).[/cyan]")
+        except Exception as e:
+            console.print(f"[yellow]Impossibile aprire la cache del giudice, proseguo senza: {e}[/yellow]")
+            judge_cache = None
+
+    def status_extra() -> dict:
+        model = gemini_model
+        extra = {"judge_model": getattr(model, 'model_name', '') or type(model).__name__}
+        if judge_cache is not None:
+            extra["cache"] = {"hits": judge_cache.hits, "misses": judge_cache.misses}
+        if context_cache is not None:
+            extra["context_cache"] = context_cache.to_dict()
+        return extra
+
+    service = EvaluationService(evaluator.evaluate_batch, transcript_options=evaluator.transcript_options,
+                                window=batch_window, max_batch=max_batch, concurrency=max(1, workers),
+                                metrics_text=lambda: run_metrics.to_prometheus(), status_extra=status_extra)
     try:
-        with open(tmp_path, "w", encoding="utf-8") as tf:
-            json.dump(merged_list, tf, ensure_ascii=False, indent=2)
-        os.replace(tmp_path, final_json)  # atomic move
-        console.print(f"[green]Aggregated JSON aggiornato: {final_json}[/green]")
-    except Exception as e:
-        console.print(f"[bold red]Errore scrivendo il JSON aggregato: {e}[/bold red]")
+        server = make_server(service, *address)
+    except OSError as e:
+        console.print(f"[bold red]Impossibile avviare il servizio su {address[0]}:{address[1]}: {e}[/bold red]")
+        service.close()
+        evaluator.close()
+        return
+    host, port = server.server_address[:2]
+    console.print(f"[bold cyan]Servizio di valutazione in ascolto su http://{host}:{port} "
+                  f"(POST /evaluate, GET /status, GET /metrics; micro-batch di {max_batch} entro "
+                  f"{batch_window * 1000:g} ms). Ctrl+C per terminare.[/bold cyan]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        console.print("[yellow]Interruzione richiesta: chiusura del servizio.[/yellow]")
+    finally:
+        server.server_close()
+        service.close()
+        evaluator.close()
+        if judge_cache is not None:
+            console.print(f"[cyan]Cache del giudice: {judge_cache.summary()}.[/cyan]")
+            judge_cache.close()
+        if context_cache is not None and context_cache.registrations:
+            console.print(f"[cyan]Cache di contesto: {context_cache.summary()}.[/cyan]")
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Valuta i log di conversazione usando il giudice LLM di Google Gemini.")
-    parser.add_argument("-i", "--input-dir", type=Path, default="conversation_logs", help="Cartella contenente i log .json.")
-    parser.add_argument("-o", "--output-dir", type=Path, default="evaluation_results", help="Cartella dove salvare gli output.")
-    parser.add_argument("-c", "--config-dir", type=Path, default="config", help="Cartella contenente i file di configurazione JSON.")
+    parser = argparse.ArgumentParser(
+        description="Valuta i log di conversazione usando il giudice LLM di Google Gemini.")
+    parser.add_argument("-i", "--input-dir", type=Path, default="conversation_logs",
+                        help="Cartella contenente i log .json.")
+    parser.add_argument("-o", "--output-dir", type=Path, default="evaluation_results",
+                        help="Cartella dove salvare gli output.")
+    parser.add_argument("-c", "--config-dir", type=Path, default="config",
+                        help="Cartella contenente i file di configurazione JSON.")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Numero massimo di chiamate al giudice in parallelo.")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="Limite di richieste al minuto (0 = nessun limite; default 60, 0 con --judge-pool dove "
+                             "valgono le quote per endpoint).")
+    parser.add_argument("--tpm", type=float, default=0, help="Limite stimato di token al minuto (0 = nessun limite).")
+    parser.add_argument("--batch-metrics", action="store_true",
+                        help="Valuta tutte le metriche (o ciascun 'batch_group') con una sola chiamata per "
+                             "conversazione.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Riusa le valutazioni dei dettagli esistenti i cui input (log, definizione della "
+                             "metrica, system prompt, modello) non sono cambiati e ricalcola solo le altre celle; "
+                             "stampa il piano prima di chiamare il giudice.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Riprende una valutazione interrotta usando il journal di checkpoint nella cartella di "
+                             "output.")
+    parser.add_argument("--ingest-workers", type=int, default=None,
+                        help="Processi dedicati a lettura e preparazione dei log (default: numero di core, 0 = nel "
+                             "thread di valutazione).")
+    parser.add_argument("--details-format", choices=["json", "jsonl"], default="json",
+                        help="Formato del file riepilogativo dei dettagli: results_details.json (array) o "
+                             "results_details.jsonl (una riga per simulazione).")
+    parser.add_argument("--fsync-every", type=int, default=50,
+                        help="Forza la scrittura su disco dei dettagli ogni N simulazioni (0 = solo alla fine).")
+    parser.add_argument("--transcript-budget", type=int, default=0,
+                        help="Budget stimato in token per la trascrizione inviata al giudice (0 = trascrizione "
+                             "completa).")
+    parser.add_argument("--transcript-strategy", default="whitespace,dedupe,headtail",
+                        help="Strategie di riduzione separate da virgola: whitespace, dedupe, headtail, relevance.")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Tentativi per ogni chiamata al giudice.")
+    parser.add_argument("--retry-base-delay", type=float, default=1.0,
+                        help="Attesa iniziale del backoff esponenziale, in secondi.")
+    parser.add_argument("--retry-max-delay", type=float, default=60.0,
+                        help="Attesa massima tra due tentativi, in secondi (Retry-After del server fino a 300s).")
+    parser.add_argument("--breaker-threshold", type=int, default=5,
+                        help="Errori consecutivi dopo cui il circuit breaker sospende le chiamate al modello (0 = "
+                             "disattivato).")
+    parser.add_argument("--breaker-cooldown", type=float, default=30.0,
+                        help="Secondi di pausa del circuit breaker prima di una chiamata di prova.")
+    parser.add_argument("--breaker-max-trips", type=int, default=10,
+                        help="Aperture consecutive del circuit breaker dopo cui la valutazione si interrompe (0 = "
+                             "attende indefinitamente).")
+    parser.add_argument("--judge-pool", type=Path, default=None,
+                        help="File JSON con gli endpoint del pool del giudice (modelli, chiavi, backend Ollama "
+                             "locali); vedi config/judge_pool.example.json.")
+    parser.add_argument("--fallback-stub", action="store_true",
+                        help="In caso di errore irreversibile del modello (es. modello inesistente) prosegue con lo "
+                             "stub locale invece di interrompersi.")
+    parser.add_argument("--shard", default=None,
+                        help="Valuta solo la partizione i di N del corpus (es. 2/4); unire poi gli output con "
+                             "'python -m evaluation merge'.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profila con cProfile il percorso caldo locale e salva profile.pstats e profile.txt "
+                             "nella cartella di output.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Valida configurazioni e log e stampa le chiamate al giudice previste, senza rete e "
+                             "senza scrivere output.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Dopo il primo passaggio resta in attesa di log nuovi o modificati e li valuta in append "
+                             "sugli output (Ctrl+C per terminare). I log nuovi ricevono i Sim_ID successivi a quelli "
+                             "esistenti.")
+    parser.add_argument("--watch-settle", type=float, default=2.0,
+                        help="Secondi senza modifiche dopo cui un log osservato da --watch è considerato completo.")
+    parser.add_argument("--watch-interval", type=float, default=1.0,
+                        help="Intervallo di scansione di --watch quando inotify non è disponibile, in secondi.")
+    parser.add_argument("--serve", default=None, metavar="[HOST:]PORT",
+                        help="Avvia il servizio HTTP locale di valutazione (POST /evaluate, GET /status, "
+                             "GET /metrics) invece di valutare la cartella di input.")
+    parser.add_argument("--serve-batch-window", type=float, default=20.0,
+                        help="Finestra in millisecondi in cui --serve raccoglie le richieste concorrenti in un "
+                             "micro-batch.")
+    parser.add_argument("--serve-max-batch", type=int, default=16,
+                        help="Numero massimo di conversazioni per micro-batch di --serve.")
+    parser.add_argument("--no-dedupe", action="store_true",
+                        help="Valuta separatamente anche le conversazioni identiche (stessa ground truth, "
+                             "trascrizione normalizzata, persona e approccio).")
+    parser.add_argument("--near-duplicates", type=float, nargs="?", const=0.8, default=None, metavar="SOGLIA",
+                        help="Scrive near_duplicates.json con i gruppi di conversazioni quasi identiche (somiglianza "
+                             "MinHash >= SOGLIA, default 0.8).")
+    parser.add_argument("--results-store", type=Path, nargs="?", const=True, default=None, metavar="PATH",
+                        help="Salva le simulazioni in un archivio SQLite indicizzato "
+                             f"(default: <output-dir>/{STORE_NAME}) invece che nei file di details/; "
+                             "'python -m evaluation export' rigenera i file.")
+    parser.add_argument("--columnar", action="store_true",
+                        help="Scrive anche l'archivio colonnare tipizzato results_columns/ per "
+                             "'python -m evaluation analyze'.")
+    parser.add_argument("--no-context-cache", action="store_true",
+                        help="Non registra il prefisso comune dei prompt (system prompt, ground truth, trascrizione, "
+                             "persona) nella cache di contesto del provider.")
+    parser.add_argument("--context-cache-min-tokens", type=int, default=4096,
+                        help="Token stimati minimi del prefisso comune perché venga registrato nella cache di "
+                             "contesto (il provider rifiuta voci più piccole).")
+    parser.add_argument("--context-cache-ttl", type=float, default=600.0,
+                        help="Durata in secondi delle voci della cache di contesto (vengono cancellate comunque a "
+                             "fine conversazione).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disattiva la cache persistente delle risposte del giudice.")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignora le risposte in cache e le sovrascrive con quelle nuove.")
+    parser.add_argument("--cache-path", type=Path, default=None,
+                        help="File SQLite della cache (default: <output-dir>/judge_cache.sqlite).")
+    parser.add_argument("--cache-max-entries", type=int, default=100_000,
+                        help="Numero massimo di risposte in cache (0 = illimitato).")
+    parser.add_argument("--cache-max-age-days", type=float, default=30,
+                        help="Età massima delle risposte in cache, in giorni (0 = illimitata).")
     args = parser.parse_args()
-    
+
     script_dir = Path(__file__).parent
     config_dir = args.config_dir if args.config_dir.is_absolute() else (script_dir / args.config_dir).resolve()
-    
-    main(
-        logs_dir=args.input_dir,
-        output_dir=args.output_dir,
-        judge_config_path=config_dir / "config_judge.json",
-        metrics_config_path=config_dir / "config_metrics.json"
-    )
\ No newline at end of file
+    try:
+        options = RunOptions.from_args(args, script_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.watch and args.dry_run:
+        parser.error("--watch non è compatibile con --dry-run")
+    if args.incremental and (args.resume or args.watch or args.dry_run):
+        parser.error("--incremental non è compatibile con --resume, --watch e --dry-run")
+    if args.serve is not None:
+        if args.watch or args.dry_run or args.shard:
+            parser.error("--serve non è compatibile con --watch, --dry-run e --shard")
+        try:
+            address = parse_address(args.serve)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.serve_batch_window < 0 or args.serve_max_batch < 1:
+            parser.error("--serve-batch-window deve essere >= 0 e --serve-max-batch >= 1")
+        judge_retrier = JudgeRetrier(options.retry_policy, failure_threshold=options.breaker_threshold,
+                                     cooldown=options.breaker_cooldown, max_trips=options.breaker_max_trips)
+        allow_stub_fallback = options.fallback_stub
+        try:
+            serve(
+                address,
+                config_dir=config_dir,
+                output_dir=args.output_dir,
+                workers=options.workers,
+                requests_per_minute=options.requests_per_minute,
+                tokens_per_minute=options.tokens_per_minute,
+                batch_metrics=options.batch_metrics,
+                use_cache=options.use_cache,
+                cache_path=options.cache_path,
+                judge_pool=options.judge_pool,
+                transcript_budget=options.transcript_budget,
+                transcript_strategy=options.transcript_strategy,
+                batch_window=args.serve_batch_window / 1000,
+                max_batch=args.serve_max_batch,
+                context_cache_min_tokens=options.context_cache_min_tokens,
+                context_cache_ttl=options.context_cache_ttl,
+            )
+        except FatalJudgeError:
+            exit(1)
+        exit(0)
+
+    try:
+        main(
+            logs_dir=args.input_dir,
+            output_dir=args.output_dir,
+            judge_config_path=config_dir / "config_judge.json",
+            metrics_config_path=config_dir / "config_metrics.json",
+            options=options,
+        )
+    except FatalJudgeError:
+        # il messaggio è già stato stampato da main()
+        exit(1)